@@ -0,0 +1,55 @@
+# coding: utf-8
+"""Расчет бизнес-метрик Яндекс.Афиши: посещаемость, когорты, LTV, CAC, ROMI."""
+
+from .activity import Activity, compute_activity
+from .attribution import NO_SOURCE, argmax_per_group, argmin_per_group, benchmark_first_source, touch_sources
+from .bench import benchmark, run_stages
+from .bootstrap import Bootstrap, bootstrap_intervals, user_summary
+from .cohorts import active_users_matrix, cohort_matrix, retention_pivot
+from .funnel import LagHistogram, conversion_lags, first_devices, lag_histogram, visits_first_devices
+from .histogram import SegmentedHistogram
+from .incremental import IncrementalState, ingest
+from .loader import (
+    load_all,
+    load_costs,
+    load_orders,
+    load_partitioned,
+    load_visits,
+    iter_chunks,
+    partitioned_dataset,
+    read_partitioned,
+    write_partitioned,
+)
+from .ltv import LtvCube, build_cube, cube_from_index, ltv_matrix, ltv_report, ltv_scenarios
+from .multitouch import Attribution, attribute, cac_romi
+from .outofcore import session_stats, visits_out_of_core
+from .parallel import cac_by_source, map_partitions, open_frame, report_fs_by_source, romi_by_source, share_frame
+from .pipeline import BACKENDS, NODES, DiskCache, Pipeline, compute, node
+from .profiling import Profiler, StageRecord, collapsed_stacks
+from .revenue import RevenueCube, revenue_cube
+from .rolling import RollingActivity, rolling_activity
+from .romi import iter_romi_report, merge_sorted, monthly_costs, romi_report
+from .sessions import DurationHistogram, duration_histogram, durations, iter_sessions, resessionize, sessions_from_hits
+from .sketch import accuracy_benchmark, approx_unique_counts
+from .store import Store
+from .synthetic import generate
+from .uids import (
+    attach_uid_index,
+    build_uid_dictionary,
+    decode,
+    encode,
+    export,
+    load_encoded,
+    lookup,
+    per_user,
+)
+from .userindex import (
+    build_user_index,
+    buyers_daily,
+    load_user_index,
+    purchase_frequency,
+    select_buyers,
+    source_revenue,
+    source_sizes,
+    user_index_path,
+)
@@ -0,0 +1,180 @@
+# coding: utf-8
+"""Запуск расчета метрик без интерфейса: python -m afisha_analysis run --out DIR.
+
+Метрики считаются графом pipeline и сохраняются в DIR (таблицы в CSV,
+числа в summary.json). Графики отправляются в пул процессов сразу, как
+только готовы их данные, и рисуются в DIR/charts, пока основной процесс
+считает следующие метрики. --no-charts отключает графики.
+
+python -m afisha_analysis generate --out DIR --visits N создает
+синтетические CSV, а python -m afisha_analysis bench замеряет время и
+память этапов расчета на таких данных. run --profile-report PATH
+сохраняет замеры этапов (JSON или .prom), а --profile-dump PATH -
+профиль cProfile самого медленного узла. python -m afisha_analysis
+store --path FILE загружает логи в хранилище SQLite для запросов.
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import loader
+from .bench import benchmark
+from .charts import CHARTS
+from .pipeline import BACKENDS, Pipeline
+from .profiling import Profiler
+from .store import Store
+from .synthetic import generate
+
+
+#метрики отчета в порядке расчета
+REPORT_METRICS = (
+    'dau', 'wau', 'mau', 'rolling_activity', 'session_stats', 'session_duration_bins', 'retention_pivot',
+    'days_to_first_order', 'lag_stats', 'days_to_first_order_bins', 'orders_mean', 'order_check', 'revenue_daily',
+    'ltv_report', 'ltv_output', 'ltv_cumulative', 'ltv_by_source',
+    'costs_per_source', 'buyers_daily', 'cac', 'cac_mean',
+    'report_fs', 'romi_table', 'romi', 'source_intervals',
+)
+#большие построчные таблицы в CSV не выгружаются, даже если запрошены в --metrics
+NOT_EXPORTED = ('session_duration', 'buyers')
+
+
+def export(name, value, out, summary):
+    """Сохраняет значение метрики: таблицы в CSV, числа в summary."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        value.to_csv(os.path.join(out, name + '.csv'))
+    elif isinstance(value, (int, float, np.integer, np.floating)):
+        summary[name] = float(value)
+
+
+def run(out, data_dir=loader.DATA_DIR, cache_dir=loader.CACHE_DIR, charts=True, workers=None,
+        metrics=REPORT_METRICS, profiler=None, backend='pandas', start=None, end=None, options=None):
+    """Считает метрики, выгружает их в out и рисует графики в фоне.
+
+    Возвращает список путей к графикам; ошибки отрисовки печатаются в stderr
+    и не прерывают расчет. profiler получает замеры узлов графа, backend -
+    'pandas' или 'polars', start и end ограничивают даты исходных таблиц,
+    options - опции узлов графа (см. Pipeline).
+    """
+    os.makedirs(out, exist_ok=True)
+    pipeline = Pipeline(data_dir, cache_dir, profiler=profiler, backend=backend, start=start, end=end,
+                        options=options)
+    pool = ProcessPoolExecutor(max_workers=workers) if charts else None
+    pending = list(CHARTS) if charts else []
+    futures = []
+    ready = {}
+    summary = {}
+    try:
+        for name in metrics:
+            ready[name] = pipeline.get(name)
+            if name not in NOT_EXPORTED:
+                export(name, ready[name], out, summary)
+            #графики, все данные которых уже готовы, уходят в пул без ожидания
+            for chart in [chart for chart in pending if all(dep in ready for dep in chart[1])]:
+                pending.remove(chart)
+                func, deps, filename = chart
+                path = os.path.join(out, 'charts', filename)
+                futures.append((filename, pool.submit(func, *[ready[dep] for dep in deps], path)))
+        with open(os.path.join(out, 'summary.json'), 'w') as target:
+            json.dump(summary, target, ensure_ascii=False, indent=2)
+    finally:
+        paths = []
+        for filename, future in futures:
+            try:
+                paths.append(future.result())
+            except Exception as error:
+                print('график {} не построен: {!r}'.format(filename, error), file=sys.stderr)
+        if pool is not None:
+            pool.shutdown()
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m afisha_analysis', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='посчитать метрики и сохранить отчет')
+    run_parser.add_argument('--out', required=True, help='каталог для отчета')
+    run_parser.add_argument('--data-dir', default=loader.DATA_DIR, help='каталог с CSV')
+    run_parser.add_argument('--cache-dir', default=loader.CACHE_DIR, help='каталог кеша')
+    run_parser.add_argument('--no-cache', action='store_true', help='не использовать кеш')
+    run_parser.add_argument('--no-charts', action='store_true', help='только метрики, без графиков')
+    run_parser.add_argument('--workers', type=int, default=None, help='процессов для графиков')
+    run_parser.add_argument('--partition-workers', type=int, default=None,
+                            help='процессов для метрик по источникам (CAC, report_fs, ROMI)')
+    run_parser.add_argument('--margin-rate', type=float, default=None,
+                            help='доля валовой прибыли в выручке для LTV (по умолчанию 1)')
+    run_parser.add_argument('--approx-error', type=float, default=None,
+                            help='граница ошибки HyperLogLog для DAU/WAU/MAU (pandas), например 0.01')
+    run_parser.add_argument('--metrics', nargs='+', default=list(REPORT_METRICS),
+                            help='узлы графа для расчета')
+    run_parser.add_argument('--backend', choices=BACKENDS, default='pandas', help='движок расчета')
+    run_parser.add_argument('--start', default=None, help='считать только данные с этой даты (включительно)')
+    run_parser.add_argument('--end', default=None,
+                            help='считать только данные до этой даты (не включая), например 2017-12-01')
+    run_parser.add_argument('--profile-report', default=None,
+                            help='файл отчета о замерах этапов (.json или .prom)')
+    run_parser.add_argument('--profile-dump', default=None,
+                            help='файл профиля самого медленного узла (.prof или свернутые стеки)')
+    run_parser.add_argument('--no-trace-memory', action='store_true',
+                            help='не замерять память Python (tracemalloc замедляет расчет)')
+    generate_parser = commands.add_parser('generate', help='создать синтетические CSV')
+    generate_parser.add_argument('--out', required=True, help='каталог для CSV')
+    generate_parser.add_argument('--visits', type=int, default=100_000, help='число посещений')
+    generate_parser.add_argument('--seed', type=int, default=0)
+    bench_parser = commands.add_parser('bench', help='замерить этапы на синтетических данных')
+    bench_parser.add_argument('--visits', type=int, default=100_000, help='число посещений')
+    bench_parser.add_argument('--data-dir', default=None,
+                              help='каталог с данными (без него данные создаются во временном каталоге)')
+    bench_parser.add_argument('--repeat', type=int, default=3, help='число повторов')
+    bench_parser.add_argument('--seed', type=int, default=0)
+    bench_parser.add_argument('--backend', choices=BACKENDS, default='pandas', help='движок расчета')
+    store_parser = commands.add_parser('store', help='загрузить логи в хранилище SQLite')
+    store_parser.add_argument('--path', required=True, help='файл хранилища')
+    store_parser.add_argument('--data-dir', default=loader.DATA_DIR, help='каталог с CSV')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        print(json.dumps(generate(args.out, n_visits=args.visits, seed=args.seed)))
+        return 0
+    if args.command == 'store':
+        store = Store.build(args.path, args.data_dir)
+        for name in ('visits', 'orders', 'costs', 'users'):
+            print(name, store.connection.execute('SELECT COUNT(*) FROM {}'.format(name)).fetchone()[0])
+        store.close()
+        return 0
+    if args.command == 'bench':
+        print(benchmark(args.visits, args.data_dir, args.repeat, args.seed, args.backend).round(3).to_string())
+        return 0
+    profiler = None
+    if args.profile_report or args.profile_dump:
+        profiler = Profiler(trace_memory=not args.no_trace_memory, profile=bool(args.profile_dump))
+    run(
+        args.out,
+        data_dir=args.data_dir,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        charts=not args.no_charts,
+        workers=args.workers,
+        metrics=args.metrics,
+        profiler=profiler,
+        backend=args.backend,
+        start=args.start,
+        end=args.end,
+        options={'workers': args.partition_workers, 'margin_rate': args.margin_rate,
+                 'approx_error': args.approx_error},
+    )
+    if args.profile_report:
+        profiler.save(args.profile_report)
+    if args.profile_dump:
+        record = profiler.dump_slowest(args.profile_dump)
+        print('профиль узла {} ({:.2f} с) сохранен в {}'.format(record.node, record.wall_seconds, args.profile_dump),
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# coding: utf-8
+"""Метрики активности аудитории: DAU, WAU, MAU и sticky factor за один проход.
+
+Вместо шести отдельных groupby(...).nunique() по всей таблице visits
+uid кодируется плотными целыми числами, пары (uid, день) сворачиваются
+одной сортировкой, а недельные и месячные уникальные пары получаются из
+уже свернутых дневных - они на порядки меньше исходного лога.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from . import sketch
+from .periods import day_index, day_start, month_of_day, month_start, week_of_day, week_start
+
+
+Activity = namedtuple('Activity', ['dau', 'wau', 'mau', 'sticky_wau', 'sticky_mau'])
+
+
+def encode_uids(uids):
+    """Плотные коды 0..n-1 для массива uid и число уникальных uid."""
+    codes, uniques = pd.factorize(np.asarray(uids), sort=False)
+    return codes.astype(np.int64), len(uniques)
+
+
+def unique_pairs(codes, periods):
+    """Уникальные пары (код пользователя, период) через один sort по общему ключу."""
+    codes = np.asarray(codes, dtype=np.int64)
+    periods = np.asarray(periods, dtype=np.int64)
+    if not len(codes):
+        return codes, periods
+    first = periods.min()
+    span = periods.max() - first + 1
+    keys = np.unique(codes * span + (periods - first))
+    return keys // span, keys % span + first
+
+
+def count_per_period(periods):
+    """Число уникальных пользователей в каждом периоде (периоды из unique_pairs)."""
+    values, counts = np.unique(periods, return_counts=True)
+    return values, counts
+
+
+def _series(periods, to_start, name):
+    values, counts = count_per_period(periods)
+    return pd.Series(counts, index=to_start(values), name=name)
+
+
+def build_activity(dau, wau, mau):
+    """Собирает Activity из готовых рядов DAU, WAU, MAU."""
+    dau.index.name = wau.index.name = mau.index.name = 'period'
+    return Activity(
+        dau=dau,
+        wau=wau,
+        mau=mau,
+        sticky_wau=dau.mean() / wau.mean() if len(wau) else np.nan,
+        sticky_mau=dau.mean() / mau.mean() if len(mau) else np.nan,
+    )
+
+
+def activity_from_codes(codes, days):
+    """DAU, WAU, MAU и sticky factor по кодам пользователей и номерам дней."""
+    user_codes, user_days = unique_pairs(codes, days)
+    _, user_weeks = unique_pairs(user_codes, week_of_day(user_days))
+    _, user_months = unique_pairs(user_codes, month_of_day(user_days))
+    return build_activity(
+        _series(user_days, day_start, 'dau'),
+        _series(user_weeks, week_start, 'wau'),
+        _series(user_months, month_start, 'mau'),
+    )
+
+
+def _merged_series(daily, periods, to_start, name):
+    values, groups = np.unique(periods, return_inverse=True)
+    merged = sketch.merge_sketches(daily, groups, len(values))
+    return pd.Series(sketch.estimate(merged), index=to_start(values), name=name)
+
+
+def activity_from_sketches(daily, days):
+    """DAU, WAU, MAU по дневным HLL-скетчам: недели и месяцы - слияние дней."""
+    days = np.asarray(days, dtype=np.int64)
+    return build_activity(
+        pd.Series(sketch.estimate(daily), index=day_start(days), name='dau'),
+        _merged_series(daily, week_of_day(days), week_start, 'wau'),
+        _merged_series(daily, month_of_day(days), month_start, 'mau'),
+    )
+
+
+def approximate_activity(uids, days, error=sketch.DEFAULT_ERROR):
+    """Приближенные DAU/WAU/MAU: по скетчу на день вместо точных пар (uid, день)."""
+    days, buckets = np.unique(np.asarray(days, dtype=np.int64), return_inverse=True)
+    daily = sketch.sketch_buckets(uids, buckets, len(days), sketch.precision_for_error(error))
+    return activity_from_sketches(daily, days)
+
+
+def compute_activity(visits, uid_column='uid', date_column='visit_start', error=None):
+    """Считает DAU, WAU, MAU и sticky factor по таблице посещений.
+
+    Возвращает Activity: три Series уникальных пользователей, индекс -
+    начало дня, недели (понедельник) и месяца, а также sticky factor
+    как отношение средних DAU/WAU и DAU/MAU. Если задана относительная
+    ошибка error, уникальные считаются приближенно через HyperLogLog.
+    """
+    days = day_index(visits[date_column])
+    if error is not None:
+        return approximate_activity(visits[uid_column].to_numpy(), days, error)
+    codes, _ = encode_uids(visits[uid_column])
+    return activity_from_codes(codes, days)
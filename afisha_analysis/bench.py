@@ -0,0 +1,62 @@
+# coding: utf-8
+"""Замеры этапов расчета на синтетических данных: python -m afisha_analysis bench.
+
+Данные создаются synthetic.generate, отчеты считаются графом pipeline
+без дискового кеша, а время, процессорное время и память каждого этапа
+(load, clean, activity, retention, conversion, ltv, cac, romi) пишет
+profiling.Profiler. Те же этапы под pytest-benchmark (время и прирост
+пика RSS по раундам) - в tests/test_bench.py.
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+
+from .loader import SOURCES
+from .pipeline import Pipeline
+from .profiling import Profiler
+from .synthetic import generate
+
+
+#узлы, которые считает замер: посещаемость, удержание, LTV, CAC и ROMI
+TARGETS = ('dau', 'wau', 'mau', 'retention_pivot', 'ltv_output', 'cac_mean', 'romi')
+
+
+def run_stages(data_dir, targets=TARGETS, repeat=1, trace_memory=True, backend='pandas'):
+    """Считает targets repeat раз и возвращает итоги Profiler по этапам для каждого повтора.
+
+    Каждый повтор начинается с нового Pipeline, то есть без мемоизации
+    предыдущего повтора.
+    """
+    frames = []
+    for attempt in range(repeat):
+        profiler = Profiler(trace_memory=trace_memory)
+        pipeline = Pipeline(data_dir, cache_dir=None, profiler=profiler, backend=backend)
+        for name in targets:
+            pipeline.get(name)
+        frames.append(profiler.summary().reset_index().assign(attempt=attempt))
+    return pd.concat(frames, ignore_index=True)
+
+
+def benchmark(n_visits=100_000, data_dir=None, repeat=1, seed=0, backend='pandas'):
+    """Генерирует данные на n_visits посещений (если data_dir пуст) и замеряет этапы.
+
+    Возвращает медиану по повторам для каждого этапа; память RSS - прирост
+    пика за время узлов этапа (см. profiling). С backend='polars' чтение
+    файлов происходит внутри узлов, поэтому этап load почти пуст. Без
+    data_dir данные создаются во временном каталоге и удаляются после
+    замера.
+    """
+    if data_dir is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return benchmark(n_visits, tmp, repeat, seed, backend)
+    if not os.path.exists(os.path.join(data_dir, SOURCES['visits']['file'])):
+        generate(data_dir, n_visits=n_visits, seed=seed)
+    result = run_stages(data_dir, repeat=repeat, backend=backend)
+    result['traced_peak_mb'] = result.pop('traced_peak_bytes') / 2 ** 20
+    result['peak_rss_delta_mb'] = result.pop('peak_rss_delta_bytes').astype(float) / 2 ** 20
+    return (
+        result.groupby('stage', sort=False)[['wall_seconds', 'cpu_seconds', 'traced_peak_mb', 'peak_rss_delta_mb']]
+        .median()
+    )
@@ -0,0 +1,196 @@
+# coding: utf-8
+"""Доверительные интервалы и сравнения источников и когорт пуассоновским бутстрепом.
+
+Каждая метрика - отношение сумм по пользователям группы (удержание -
+вернувшиеся / пользователи, LTV - выручка / пользователи и т.д.), CAC и
+ROMI - отношение к расходам группы, которые не перевыбираются. В
+пуассоновском бутстрепе каждый пользователь входит в перевыборку с весом
+Poisson(1), и перевыбранная сумма - это sum(w * x).
+
+Пользователи с одинаковыми группой и значениями столбцов сворачиваются
+в одну строку с кратностью m: сумма их весов распределена как
+Poisson(m), так что результат тот же, а строк остается порядка числа
+покупателей. Веса порции перевыборок - матрица (перевыборки x строки),
+суммы по группам - ее произведение на матрицу значений. Порции
+считаются в пуле процессов, у каждой свое зерно из SeedSequence, поэтому
+результат не зависит от числа процессов.
+"""
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .periods import month_index, month_start
+from .uids import per_user
+
+
+DEFAULT_RESAMPLES = 10_000
+#перевыборок в порции: матрица весов порции ~ BATCH_SIZE x число строк
+BATCH_SIZE = 200
+COLUMNS = ('users', 'retained', 'buyer', 'orders', 'revenue')
+#метрика: числитель и знаменатель из COLUMNS
+RATIOS = {
+    'retention': ('retained', 'users'),
+    'conversion': ('buyer', 'users'),
+    'ltv': ('revenue', 'users'),
+    'ltv_buyer': ('revenue', 'buyer'),
+    'orders_per_buyer': ('orders', 'buyer'),
+}
+#метрики с расходами группы: CAC = расходы / покупатели, ROMI = выручка / расходы
+COST_METRICS = ('cac', 'romi')
+DEFAULT_METRICS = ('retention', 'conversion', 'ltv', 'cac', 'romi')
+
+
+def user_summary(user_index, visit_codes, visit_times):
+    """Сводка по пользователям для бутстрепа: группы (source, cohort) и столбцы COLUMNS.
+
+    cohort - месяц первого посещения, retained - было посещение в более
+    поздний месяц, buyer - была покупка.
+    """
+    n_users = len(user_index)
+    last_activity = per_user(visit_codes, np.asarray(visit_times).astype('datetime64[ns]'), n_users, 'max')
+    first_activity = user_index['first_activity_date'].to_numpy()
+    visited = ~np.isnat(first_activity)
+    cohorts = month_index(first_activity)
+    #у пользователей без посещений номер месяца NaT и начало когорты тоже NaT
+    cohort_start = month_start(cohorts).to_numpy()
+    order_count = user_index['order_count'].to_numpy()
+    return pd.DataFrame({
+        'source': user_index['source'].to_numpy(),
+        'cohort': cohort_start,
+        'users': np.ones(n_users, dtype=np.int64),
+        'retained': (visited & (month_index(last_activity) > cohorts)).astype(np.int64),
+        'buyer': (order_count > 0).astype(np.int64),
+        'orders': order_count.astype(np.int64),
+        'revenue': user_index['revenue'].to_numpy(),
+    }, index=user_index.index)
+
+
+def _compress(frame, by, columns):
+    """Уникальные строки (группа, значения), их кратность и номера групп; строки упорядочены по группе."""
+    #пользователи без значения группы (например, без посещений для cohort) не входят ни в одну группу
+    frame = frame.dropna(subset=list(by))
+    counts = frame.groupby(list(by) + list(columns), sort=True).size()
+    rows = counts.index.to_frame(index=False)
+    group_codes, labels = pd.MultiIndex.from_frame(rows[list(by)]).factorize(sort=True)
+    order = np.argsort(group_codes, kind='stable')
+    values = rows[list(columns)].to_numpy(dtype=np.float64)[order]
+    return labels, group_codes[order], values, counts.to_numpy()[order]
+
+
+def _resample(seed, size, counts, values, bounds):
+    """Суммы столбцов по группам для size перевыборок: массив [size, группы, столбцы]."""
+    rng = np.random.default_rng(seed)
+    weights = rng.poisson(counts, size=(size, len(counts))).astype(np.float64)
+    sums = np.empty((size, len(bounds) - 1, values.shape[1]))
+    for group, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        sums[:, group] = weights[:, lo:hi] @ values[lo:hi]
+    return sums
+
+
+class Bootstrap:
+    """Перевыбранные суммы столбцов по группам и метрики на их основе.
+
+    frame - сводка по пользователям (см. user_summary), by - столбец или
+    столбцы группы. max_workers=1 считает без пула процессов.
+    """
+
+    def __init__(self, frame, by='source', columns=COLUMNS, n_resamples=DEFAULT_RESAMPLES, seed=0,
+                 batch_size=BATCH_SIZE, max_workers=None):
+        self.by = (by,) if isinstance(by, str) else tuple(by)
+        self.columns = tuple(columns)
+        labels, group_codes, values, counts = _compress(frame, self.by, self.columns)
+        self.labels = list(labels) if len(self.by) > 1 else [label[0] for label in labels]
+        bounds = np.searchsorted(group_codes, np.arange(len(labels) + 1))
+        self.sums = np.zeros((len(labels), len(self.columns)))
+        np.add.at(self.sums, group_codes, values * counts[:, None])
+
+        sizes = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = [(batch_seed, size, counts, values, bounds) for batch_seed, size in zip(seeds, sizes)]
+        if max_workers == 1:
+            batches = [_resample(*arg) for arg in args]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                batches = list(pool.map(_resample, *zip(*args)))
+        self.resampled = np.concatenate(batches) if batches else np.zeros((0,) + self.sums.shape)
+
+    def _index(self):
+        if len(self.by) > 1:
+            return pd.MultiIndex.from_tuples(self.labels, names=self.by)
+        return pd.Index(self.labels, name=self.by[0])
+
+    def _column(self, name):
+        return self.columns.index(name)
+
+    def _costs(self, costs):
+        if costs is None:
+            raise ValueError('для CAC и ROMI нужны расходы по группам (costs)')
+        return pd.Series(costs).reindex(self.labels).to_numpy(dtype=np.float64)
+
+    def metric(self, name, costs=None):
+        """Оценка метрики по группам и ее значения в перевыборках: (массив [группы], [перевыборки, группы])."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if name in RATIOS:
+                numerator, denominator = (self._column(column) for column in RATIOS[name])
+                return (self.sums[:, numerator] / self.sums[:, denominator],
+                        self.resampled[..., numerator] / self.resampled[..., denominator])
+            if name == 'cac':
+                costs, buyers = self._costs(costs), self._column('buyer')
+                return costs / self.sums[:, buyers], costs / self.resampled[..., buyers]
+            if name == 'romi':
+                costs, revenue = self._costs(costs), self._column('revenue')
+                return self.sums[:, revenue] / costs, self.resampled[..., revenue] / costs
+        raise ValueError('метрика должна быть одной из {}, получено {!r}'.format(
+            tuple(RATIOS) + COST_METRICS, name))
+
+    def intervals(self, metrics=DEFAULT_METRICS, costs=None, level=0.95):
+        """Таблица (группа, метрика): оценка, стандартная ошибка и перцентильный интервал уровня level."""
+        tail = (1 - level) / 2 * 100
+        frames = []
+        for name in metrics:
+            estimate, resampled = self.metric(name, costs)
+            with warnings.catch_warnings():
+                #группы без расходов или без покупателей дают NaN во всех перевыборках
+                warnings.simplefilter('ignore', RuntimeWarning)
+                low, high = np.nanpercentile(resampled, [tail, 100 - tail], axis=0)
+                std_error = np.nanstd(resampled, axis=0)
+            frames.append(pd.DataFrame({
+                'metric': name,
+                'estimate': estimate,
+                'std_error': std_error,
+                'low': low,
+                'high': high,
+            }, index=self._index()))
+        frame = pd.concat(frames).set_index('metric', append=True)
+        return frame.sort_index()
+
+    def compare(self, name, a, b, costs=None, level=0.95):
+        """Сравнение групп a и b по метрике: оценки, разность b - a, ее интервал и двусторонний p-value."""
+        estimate, resampled = self.metric(name, costs)
+        first, second = self.labels.index(a), self.labels.index(b)
+        difference = resampled[:, second] - resampled[:, first]
+        difference = difference[~np.isnan(difference)]
+        if len(difference):
+            tail = (1 - level) / 2 * 100
+            low, high = np.percentile(difference, [tail, 100 - tail])
+            p_value = min(1.0, 2 * min(np.mean(difference <= 0), np.mean(difference >= 0)))
+        else:
+            low = high = p_value = np.nan
+        return pd.Series({
+            'a': estimate[first],
+            'b': estimate[second],
+            'difference': estimate[second] - estimate[first],
+            'low': low,
+            'high': high,
+            'p_value': p_value,
+        }, name=name)
+
+
+def bootstrap_intervals(frame, by='source', metrics=DEFAULT_METRICS, costs=None, level=0.95,
+                        n_resamples=DEFAULT_RESAMPLES, seed=0, max_workers=None):
+    """Интервалы метрик по группам одним вызовом (см. Bootstrap.intervals)."""
+    bootstrap = Bootstrap(frame, by, n_resamples=n_resamples, seed=seed, max_workers=max_workers)
+    return bootstrap.intervals(metrics, costs, level)
@@ -0,0 +1,165 @@
+# coding: utf-8
+"""Графики отчета, которые рисуются в файлы без вывода на экран.
+
+Каждая функция принимает данные и путь к файлу, поэтому ее можно
+отправить в пул процессов. Распределения приходят уже разложенными по
+корзинам (Series с IntervalIndex), а не построчными таблицами, так что
+в пул пиклуются десятки чисел. matplotlib переключается на Agg до импорта
+pyplot, графики Plotly экспортируются статически (нужен kaleido), а без
+kaleido сохраняются в HTML.
+"""
+
+import os
+
+import numpy as np
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    return plt
+
+
+def _save(plt, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    plt.savefig(path, bbox_inches='tight')
+    plt.close('all')
+    return path
+
+
+def _binned_hist(plt, bins):
+    """Гистограмма по заранее посчитанным корзинам."""
+    edges = np.append(bins.index.left, bins.index.right[-1])
+    plt.hist(bins.index.left, bins=edges, weights=bins.to_numpy())
+    return plt.gca()
+
+
+def dau_hist(dau, path):
+    plt = _pyplot()
+    dau.hist(bins=50)
+    plt.title('Распределение DAU')
+    return _save(plt, path)
+
+
+def wau_hist(wau, path):
+    plt = _pyplot()
+    wau.hist()
+    plt.title('Распределение WAU')
+    return _save(plt, path)
+
+
+def mau_bar(mau, path):
+    plt = _pyplot()
+    mau = mau.copy()
+    mau.index = mau.index.strftime('%Y-%m')
+    mau.plot(kind='bar').set(xlabel='Дата посещения сайта', ylabel='Количество посетителей')
+    return _save(plt, path)
+
+
+def session_hist(bins, path):
+    plt = _pyplot()
+    _binned_hist(plt, bins).set(xlabel='Длительность посещения сайта, сек', ylabel='Количество посещений')
+    plt.grid(True)
+    return _save(plt, path)
+
+
+def retention_heatmap(retention_pivot, path):
+    plt = _pyplot()
+    import seaborn as sns
+    pivot = retention_pivot.copy()
+    pivot.index = [str(x)[0:10] for x in pivot.index]
+    sns.set(style='white')
+    plt.figure(figsize=(13, 9))
+    plt.title('Тепловая карта коэффициента удержания пользователей в разрезе когорт')
+    sns.heatmap(pivot, annot=True, fmt='.1%', linewidths=1, linecolor='gray')
+    plt.xlabel('Жизненный цикл когорт, месяцев')
+    plt.ylabel('Месяц первой активности посетителей сайта')
+    return _save(plt, path)
+
+
+def days_to_order_hist(bins, path):
+    plt = _pyplot()
+    plt.figure(figsize=(12, 7))
+    _binned_hist(plt, bins).set(
+        title='Распределение времени от первого посещения сайта до первой покупки',
+        xlabel='Дней после первого посещения сайта',
+        ylabel='Частота')
+    plt.xlim(0, 75)
+    return _save(plt, path)
+
+
+def revenue_line(revenue_daily, path):
+    plt = _pyplot()
+    plt.figure(figsize=(16, 10))
+    plt.plot(revenue_daily.index, revenue_daily['sum'], color='tab:brown')
+    plt.title('Выручка по дням')
+    plt.grid(axis='both', alpha=0.3)
+    plt.ylabel('Сумма чека, у.е.')
+    return _save(plt, path)
+
+
+def ltv_line(ltv_report, path):
+    plt = _pyplot()
+    ltv_report.groupby('first_order_month')['ltv'].sum().plot()
+    plt.title('Изменение показателя LTV по когортам')
+    plt.grid(axis='both', alpha=0.3)
+    plt.xlabel('Месяц первого заказа')
+    plt.ylabel('LTV')
+    return _save(plt, path)
+
+
+def costs_barh(costs_per_source, path):
+    plt = _pyplot()
+    costs_per_source.sort_values(ascending=False).plot(
+        kind='barh', figsize=(20, 8), title='Распределение маркетинговых расходов по источникам',
+        grid=True, color='green').set(xlabel='Сумма затрат на источник, у.е.', ylabel='Источник продвижения сайта')
+    return _save(plt, path)
+
+
+def cac_bar(cac_mean, path):
+    plt = _pyplot()
+    cac_mean.plot.bar(title='Стоимость привлечения клиента по источникам')
+    return _save(plt, path)
+
+
+def romi_barh(romi, path):
+    plt = _pyplot()
+    romi.sort_values(ascending=False).plot(
+        kind='barh', figsize=(20, 8), title='Распределение возврата затрат на посетителя сайта по источникам',
+        grid=True, color='green').set(xlabel='Возврат на привлечение посетителя сайта, у.е.',
+                                      ylabel='Источник продвижения сайта')
+    return _save(plt, path)
+
+
+def romi_lines(romi_table, path):
+    """График ROMI по источникам во времени (Plotly)."""
+    import plotly.express as px
+    data = romi_table.pivot_table(index=['source_id', 'cost_month'], values='romi', aggfunc='sum').reset_index()
+    fig = px.line(data, x='cost_month', y='romi', color='source_id',
+                  title='Распределение ROMI по источникам во времени')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        fig.write_image(path)
+    except (ValueError, ImportError):
+        #без kaleido статический экспорт недоступен
+        path = os.path.splitext(path)[0] + '.html'
+        fig.write_html(path, include_plotlyjs='cdn')
+    return path
+
+
+#график: функция, узлы графа метрик с данными и имя файла
+CHARTS = [
+    (dau_hist, ('dau',), 'dau.png'),
+    (wau_hist, ('wau',), 'wau.png'),
+    (mau_bar, ('mau',), 'mau.png'),
+    (session_hist, ('session_duration_bins',), 'session_duration.png'),
+    (retention_heatmap, ('retention_pivot',), 'retention.png'),
+    (days_to_order_hist, ('days_to_first_order_bins',), 'days_to_first_order.png'),
+    (revenue_line, ('revenue_daily',), 'revenue_daily.png'),
+    (ltv_line, ('ltv_report',), 'ltv.png'),
+    (costs_barh, ('costs_per_source',), 'costs_per_source.png'),
+    (cac_bar, ('cac_mean',), 'cac.png'),
+    (romi_barh, ('romi',), 'romi.png'),
+    (romi_lines, ('romi_table',), 'romi_by_month.png'),
+]
@@ -0,0 +1,91 @@
+# coding: utf-8
+"""Векторный расчет когорт: первый месяц, месяц жизни и матрица когорта x месяц.
+
+На входе - массивы идентификаторов (uid) и времени событий. Номера
+месяцев считаются арифметикой (см. periods), месяц первого события -
+одним groupby-min по плотным кодам uid, а матрица когорт заполняется
+через np.bincount по плоскому индексу когорта * число_месяцев + месяц_жизни.
+Временные столбцы в исходной таблице не создаются.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .activity import encode_uids, unique_pairs
+from .periods import month_index, month_start
+
+
+Cohorts = namedtuple('Cohorts', ['codes', 'months', 'first_months'])
+
+
+def first_period(codes, periods, n_codes=None):
+    """Минимальный период для каждого кода 0..n_codes-1."""
+    codes = np.asarray(codes, dtype=np.int64)
+    periods = np.asarray(periods, dtype=np.int64)
+    if n_codes is None:
+        n_codes = codes.max() + 1 if len(codes) else 0
+    first = np.full(n_codes, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first, codes, periods)
+    return first
+
+
+def assign_cohorts(ids, times):
+    """Коды id, номера месяцев событий и месяц первого события каждого кода."""
+    codes, n_codes = encode_uids(ids)
+    months = month_index(times)
+    return Cohorts(codes, months, first_period(codes, months, n_codes))
+
+
+def cohort_matrix(cohort, lifetime, weights=None):
+    """Матрица когорта x месяц жизни: число (или сумма weights) событий в ячейке.
+
+    Возвращает DataFrame, индекс - номера месяцев когорт, столбцы - месяц жизни.
+    """
+    cohort = np.asarray(cohort, dtype=np.int64)
+    lifetime = np.asarray(lifetime, dtype=np.int64)
+    if not len(cohort):
+        return pd.DataFrame()
+    first = cohort.min()
+    n_cohorts = cohort.max() - first + 1
+    n_lifetimes = lifetime.max() + 1
+    flat = (cohort - first) * n_lifetimes + lifetime
+    cells = np.bincount(flat, weights=weights, minlength=n_cohorts * n_lifetimes)
+    return pd.DataFrame(
+        cells.reshape(n_cohorts, n_lifetimes),
+        index=pd.Index(np.arange(first, first + n_cohorts), name='cohort'),
+        columns=pd.Index(np.arange(n_lifetimes), name='lifetime'),
+    )
+
+
+def active_users_matrix(ids, times):
+    """Число уникальных id в каждой ячейке когорта (месяц первого события) x месяц жизни."""
+    cohorts = assign_cohorts(ids, times)
+    user_codes, user_months = unique_pairs(cohorts.codes, cohorts.months)
+    first_months = cohorts.first_months[user_codes]
+    return cohort_matrix(first_months, user_months - first_months)
+
+
+def retention_pivot(ids, times, drop_first=True):
+    """Retention Rate по месячным когортам в формате сводной таблицы ноутбука.
+
+    Индекс - первое число месяца первой активности, столбцы - месяц жизни
+    когорты, пустые ячейки - NaN. drop_first убирает нулевой месяц жизни и
+    когорты, у которых не осталось ни одной ячейки (последний месяц), как
+    сводная таблица ноутбука.
+    """
+    return retention_from_users(active_users_matrix(ids, times), drop_first)
+
+
+def retention_from_users(users, drop_first=True):
+    """Retention Rate из матрицы уникальных пользователей active_users_matrix."""
+    if users.empty:
+        return users
+    retention = users.div(users[0], axis=0).where(users > 0)
+    if drop_first:
+        retention = retention.drop(columns=0).dropna(how='all')
+    retention.index = month_start(retention.index.to_numpy())
+    retention.index.name = 'first_activity_month'
+    retention.columns.name = 'cohort_lifetime'
+    return retention
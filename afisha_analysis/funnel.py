@@ -0,0 +1,90 @@
+# coding: utf-8
+"""Время от первого посещения до первой покупки: лаги по пользователям и гистограммы по сегментам.
+
+Лаг считается одним проходом по сводной таблице пользователей (разность
+first_order_date и first_activity_date в секундах), без повторного
+разбора дат и слияния таблиц. Устройство первого посещения берется из
+visits той же строкой, что и дата первого посещения.
+
+LagHistogram (histogram.SegmentedHistogram) копит по сегментам
+(источник, устройство, когорта первой покупки) число покупателей,
+точную сумму секунд и гистограмму: по минуте на корзину в первые сутки,
+по часу до недели и по дню до года, дальше - одна корзина. Гистограммы
+складываются, поэтому квантили по любому сегменту и по их объединению
+берутся из накопленных счетчиков.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .attribution import argmin_per_group
+from .histogram import SegmentedHistogram
+from .uids import UID_INDEX
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+#нижние границы корзин в секундах: минуты в первые сутки, часы до недели, дни до года
+EDGES = np.concatenate([
+    np.arange(0, SECONDS_PER_DAY, 60),
+    np.arange(SECONDS_PER_DAY, 7 * SECONDS_PER_DAY, 60 * 60),
+    np.arange(7 * SECONDS_PER_DAY, 365 * SECONDS_PER_DAY + 1, SECONDS_PER_DAY),
+])
+DEFAULT_BY = ('source', 'device', 'cohort')
+
+
+def conversion_lags(user_index):
+    """Лаг до первой покупки в секундах по uid_index покупателей с известным первым посещением."""
+    first_order = user_index['first_order_date'].to_numpy().astype('datetime64[s]')
+    first_activity = user_index['first_activity_date'].to_numpy().astype('datetime64[s]')
+    known = ~np.isnat(first_order) & ~np.isnat(first_activity)
+    lags = (first_order[known] - first_activity[known]).astype(np.int64)
+    return pd.Series(lags, index=user_index.index[known], name='lag_seconds')
+
+
+def first_devices(codes, times, devices, n_users):
+    """Устройство первого посещения по uid_index (None у пользователей без посещений)."""
+    rows = argmin_per_group(codes, np.asarray(times).astype('datetime64[ns]'), n_users)
+    result = np.full(n_users, None, dtype=object)
+    found = rows >= 0
+    result[found] = np.asarray(devices, dtype=object)[rows[found]]
+    return result
+
+
+class LagHistogram(SegmentedHistogram):
+    """Складываемая гистограмма лагов до первой покупки по сегментам.
+
+    Отрицательные лаги (покупка раньше первого известного посещения)
+    только подсчитываются; сводка - в днях.
+    """
+
+    count_name = 'buyers'
+    unit = SECONDS_PER_DAY
+    suffix = '_days'
+
+    def __init__(self, by=DEFAULT_BY):
+        super().__init__(EDGES, by)
+
+
+def lag_histogram(user_index, devices=None, by=DEFAULT_BY):
+    """Гистограмма лагов по сводной таблице пользователей.
+
+    devices - устройство первого посещения по uid_index (см. first_devices),
+    нужно, если в by есть 'device'; когорта - месяц первой покупки.
+    """
+    lags = conversion_lags(user_index)
+    rows = lags.index.to_numpy()
+    keys = pd.DataFrame({
+        'source': user_index['source'].to_numpy()[rows],
+        'cohort': user_index['first_order_month'].to_numpy()[rows],
+    })
+    if 'device' in by:
+        if devices is None:
+            raise ValueError("для разреза по 'device' нужен массив devices")
+        keys['device'] = np.asarray(devices, dtype=object)[rows]
+    return LagHistogram(by).add(lags.to_numpy(), keys)
+
+
+def visits_first_devices(visits, n_users):
+    """first_devices по таблице visits с uid_index."""
+    return first_devices(visits[UID_INDEX].to_numpy(), visits['visit_start'].to_numpy(),
+                         visits['device'].to_numpy(), n_users)
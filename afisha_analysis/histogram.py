@@ -0,0 +1,175 @@
+# coding: utf-8
+"""Складываемая гистограмма по сегментам с заданными границами корзин.
+
+SegmentedHistogram копит по сегментам (кортежам значений полей by) число
+наблюдений, точную сумму и счетчики по корзинам [edges[i], edges[i + 1]),
+последняя корзина без верхней границы. Отрицательные значения только
+подсчитываются. Гистограммы порций складываются (merge), сегменты можно
+объединять (select, total), поэтому среднее и квантили по любому разрезу
+получаются из накопленных счетчиков без второго прохода по данным.
+
+Квантили внутри корзины: если заданы values (значение каждой корзины),
+то линейная интерполяция между ними, как в pandas, и в сводке есть
+мода; иначе значения считаются равномерно распределенными по ширине
+корзины.
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75, 0.9, 0.99)
+
+
+class SegmentedHistogram:
+    """Складываемая гистограмма значений по сегментам."""
+
+    #название столбца с числом наблюдений в binned и summary
+    count_name = 'count'
+    #единица значений в summary и суффикс названий столбцов среднего и квантилей
+    unit = 1
+    suffix = ''
+
+    def __init__(self, edges, by=(), values=None):
+        self.edges = np.asarray(edges)
+        #последняя корзина без верхней границы; для квантилей ее ширина равна предыдущей
+        self.widths = np.append(np.diff(self.edges), self.edges[-1] - self.edges[-2])
+        self.values = values
+        self._clear(by)
+
+    def _clear(self, by):
+        self.by = tuple(by)
+        self.labels = []
+        self.rows = {}
+        self.counts = np.zeros((0, len(self.edges)), dtype=np.int64)
+        self.sums = np.zeros(0)
+        self.negative = np.zeros(0, dtype=np.int64)
+
+    def _empty(self, by=()):
+        result = copy.copy(self)
+        result._clear(by)
+        return result
+
+    def _bins(self, values):
+        return np.searchsorted(self.edges, values, side='right') - 1
+
+    def _rows_of(self, labels):
+        rows = []
+        for label in labels:
+            if label not in self.rows:
+                self.rows[label] = len(self.labels)
+                self.labels.append(label)
+            rows.append(self.rows[label])
+        grow = len(self.labels) - len(self.sums)
+        if grow:
+            self.counts = np.vstack([self.counts, np.zeros((grow, len(self.edges)), dtype=np.int64)])
+            self.sums = np.concatenate([self.sums, np.zeros(grow)])
+            self.negative = np.concatenate([self.negative, np.zeros(grow, dtype=np.int64)])
+        return np.asarray(rows, dtype=np.int64)
+
+    def add(self, values, keys=None):
+        """Добавляет значения; keys - таблица со столбцами self.by той же длины."""
+        values = np.asarray(values, dtype=np.int64)
+        if self.by:
+            codes, uniques = pd.MultiIndex.from_frame(keys[list(self.by)]).factorize()
+            rows = self._rows_of(list(uniques))[codes]
+        else:
+            rows = self._rows_of([()])[np.zeros(len(values), dtype=np.int64)]
+        n_rows, n_bins = len(self.labels), len(self.edges)
+        valid = values >= 0
+        self.negative += np.bincount(rows[~valid], minlength=n_rows)
+        rows, values = rows[valid], values[valid]
+        self.sums += np.bincount(rows, weights=values, minlength=n_rows)
+        flat = rows * n_bins + self._bins(values)
+        self.counts += np.bincount(flat, minlength=n_rows * n_bins).reshape(n_rows, n_bins)
+        return self
+
+    def merge(self, other):
+        """Прибавляет гистограмму other с теми же сегментами by."""
+        rows = self._rows_of(other.labels)
+        self.counts[rows] += other.counts
+        self.sums[rows] += other.sums
+        self.negative[rows] += other.negative
+        return self
+
+    def select(self, by=(), **values):
+        """Гистограмма по полям by из сегментов, у которых поля values равны заданным.
+
+        Например, select(('source',)) - разрез по источникам,
+        select(source=4) - все наблюдения источника 4 вместе.
+        """
+        unknown = (set(by) | set(values)) - set(self.by)
+        if unknown:
+            raise ValueError('нет таких полей сегмента: {}'.format(sorted(unknown)))
+        positions = [self.by.index(field) for field in by]
+        filters = [(self.by.index(field), value) for field, value in values.items()]
+        result = self._empty(by)
+        for row, label in enumerate(self.labels):
+            if all(label[position] == value for position, value in filters):
+                target = result._rows_of([tuple(label[position] for position in positions)])[0]
+                result.counts[target] += self.counts[row]
+                result.sums[target] += self.sums[row]
+                result.negative[target] += self.negative[row]
+        return result
+
+    def total(self):
+        """Гистограмма всех сегментов вместе."""
+        return self.select()
+
+    def binned(self, edges, unit=1):
+        """Число наблюдений всех сегментов в корзинах [edges[i], edges[i + 1]), edges - в единицах unit.
+
+        Для графиков: точно, если границы совпадают с границами корзин
+        гистограммы.
+        """
+        edges = np.asarray(edges)
+        target = np.searchsorted(edges * unit, self.edges, side='right') - 1
+        inside = (target >= 0) & (target < len(edges) - 1)
+        counts = np.bincount(target[inside], weights=self.counts.sum(axis=0)[inside], minlength=len(edges) - 1)
+        return pd.Series(counts.astype(np.int64), index=pd.IntervalIndex.from_breaks(edges, closed='left'),
+                         name=self.count_name)
+
+    def _value_at(self, bin_, offset, count):
+        #значение наблюдения с номером offset (с нуля) из count в корзине bin_
+        if self.values is not None:
+            return self.values[bin_]
+        return self.edges[bin_] + self.widths[bin_] * (offset + 0.5) / count
+
+    def quantile(self, q):
+        """Квантиль q значения по сегментам."""
+        result = np.full(len(self.labels), np.nan)
+        for row, counts in enumerate(self.counts):
+            total = counts.sum()
+            if not total:
+                continue
+            cumulative = np.cumsum(counts)
+            position = (total - 1) * q
+            values = []
+            for rank in (np.floor(position), np.ceil(position)):
+                bin_ = np.searchsorted(cumulative, rank, side='right')
+                values.append(self._value_at(bin_, rank - (cumulative[bin_] - counts[bin_]), counts[bin_]))
+            result[row] = values[0] + (position - np.floor(position)) * (values[1] - values[0])
+        return result
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        """Таблица по сегментам: число наблюдений, отрицательных значений, среднее, мода и квантили.
+
+        Значения - в единицах unit; мода есть, только если заданы values.
+        """
+        count = self.counts.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sums / count / self.unit
+        if self.by:
+            index = pd.MultiIndex.from_tuples(self.labels, names=self.by)
+        else:
+            index = pd.Index(['all'] * len(self.labels), name='segment')
+        frame = pd.DataFrame({self.count_name: count, 'negative': self.negative, 'mean' + self.suffix: mean},
+                             index=index)
+        if self.values is not None:
+            mode = np.where(count > 0, self.values[self.counts.argmax(axis=1)], np.nan)
+            frame['mode' + self.suffix] = mode / self.unit
+        for q in quantiles:
+            frame['q{:g}{}'.format(q * 100, self.suffix)] = self.quantile(q) / self.unit
+        return frame.sort_index()
@@ -0,0 +1,373 @@
+# coding: utf-8
+"""Инкрементальное обновление метрик по ежедневным партициям логов.
+
+Состояние хранится в каталоге state_dir (Parquet) и состоит из двух частей:
+
+- таблица пользователей: для каждого uid день первого посещения, первый
+  источник, последние учтенные неделя и месяц активности и день первой
+  покупки;
+- аддитивные агрегаты по когортам и периодам: DAU/WAU/MAU, удержание,
+  новые покупатели, выручка по когортам и источникам, расходы.
+
+Новая партиция (visits, orders, costs за очередной день) обрабатывается
+только своими строками: по таблице пользователей определяется, какие
+пары (uid, неделя) и (uid, месяц) новые, и к агрегатам прибавляются только
+затронутые ячейки. Поэтому партиции должны приходить по возрастанию дат.
+
+Покупатель может впервые зайти на сайт позже первой покупки. Пока его
+источник неизвестен, выручка копится в pending_revenue по uid, а с
+первым посещением переносится в выручку источника, и покупатель
+добавляется в новых покупателей источника за день первой покупки.
+
+Таблица пользователей на диске - основной файл и дельты: каждое
+сохранение пишет только строки пользователей, затронутых с прошлого
+сохранения, а раз в compact_every сохранений таблица переписывается
+целиком и дельты удаляются. Список файлов хранится в meta.json.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .activity import build_activity, unique_pairs
+from .cohorts import retention_from_users
+from .loader import read_source
+from .periods import day_index, day_start, month_of_day, month_start, week_of_day, week_start
+
+
+USERS_FILE = 'users.parquet'
+META_FILE = 'meta.json'
+#после стольких дельт таблица пользователей сохраняется целиком
+COMPACT_EVERY = 30
+
+#столбцы таблицы пользователей; -1 означает "еще не было"
+USER_COLUMNS = {
+    'first_day': 'int32',
+    'first_source': 'int16',
+    'last_week': 'int32',
+    'last_month': 'int32',
+    'first_order_day': 'int32',
+}
+
+#агрегаты: ключевые столбцы и суммируемое значение
+AGGREGATES = {
+    'dau': (['day'], 'users'),
+    'wau': (['week'], 'users'),
+    'mau': (['month'], 'users'),
+    'retention': (['cohort_month', 'lifetime'], 'users'),
+    'source_users': (['source_id'], 'users'),
+    'new_buyers': (['first_order_month'], 'buyers'),
+    'buyers_daily': (['source_id', 'day'], 'buyers'),
+    'revenue': (['first_order_month', 'order_month'], 'revenue'),
+    'source_revenue': (['source_id', 'order_month'], 'revenue'),
+    #выручка покупателей, у которых еще не было посещений
+    'pending_revenue': (['uid', 'order_month'], 'revenue'),
+    'costs': (['source_id', 'day'], 'costs'),
+}
+
+
+def _empty_users():
+    columns = {column: pd.Series([], dtype=kind) for column, kind in USER_COLUMNS.items()}
+    return pd.DataFrame(columns, index=pd.Index([], dtype='uint64', name='uid'))
+
+
+def _sorted_by_time(frame, column):
+    order = np.argsort(frame[column].to_numpy(), kind='stable')
+    return frame.iloc[order]
+
+
+def _first_rows(uids):
+    """Позиции первых вхождений каждого uid."""
+    _, positions = np.unique(uids, return_index=True)
+    return positions
+
+
+class IncrementalState:
+    """Состояние инкрементального расчета метрик."""
+
+    def __init__(self, users=None, aggregates=None, last_day=None, users_file=None, deltas=()):
+        self.users = _empty_users() if users is None else users
+        self.aggregates = dict(aggregates or {})
+        self.last_day = last_day
+        #файлы таблицы пользователей на диске: основной и дельты после него
+        self.users_file = users_file
+        self.deltas = list(deltas)
+        #uid, строки которых изменились с последнего сохранения
+        self.changed = []
+
+    @classmethod
+    def load(cls, state_dir):
+        """Читает состояние из state_dir; если его нет - пустое состояние."""
+        meta_path = os.path.join(state_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            return cls()
+        with open(meta_path) as source:
+            meta = json.load(source)
+        users_file, deltas = meta.get('users', USERS_FILE), meta.get('deltas', [])
+        users = pd.read_parquet(os.path.join(state_dir, users_file))
+        if deltas:
+            #в дельтах последние значения строк: более поздняя строка uid заменяет раннюю
+            users = pd.concat([users] + [pd.read_parquet(os.path.join(state_dir, name)) for name in deltas])
+            users = users[~users.index.duplicated(keep='last')]
+        aggregates = {}
+        for name, (keys, value) in AGGREGATES.items():
+            path = os.path.join(state_dir, name + '.parquet')
+            if os.path.exists(path):
+                aggregates[name] = pd.read_parquet(path).set_index(keys)[value]
+        return cls(users, aggregates, meta['last_day'], users_file, deltas)
+
+    def save(self, state_dir, compact_every=COMPACT_EVERY):
+        """Сохраняет состояние в state_dir (каждый файл пишется атомарно).
+
+        Из таблицы пользователей пишутся только измененные строки (дельта);
+        при первом сохранении и после compact_every дельт - вся таблица.
+        """
+        os.makedirs(state_dir, exist_ok=True)
+
+        def replace(frame, name, index):
+            path = os.path.join(state_dir, name)
+            frame.to_parquet(path + '.tmp', index=index)
+            os.replace(path + '.tmp', path)
+
+        stale = []
+        if self.users_file is None or len(self.deltas) >= compact_every:
+            users_file = 'users-{}.parquet'.format(self.last_day)
+            replace(self.users, users_file, True)
+            stale = [name for name in [self.users_file] + self.deltas if name not in (None, users_file)]
+            self.users_file, self.deltas = users_file, []
+        elif self.changed:
+            delta = 'users-delta-{}.parquet'.format(self.last_day)
+            replace(self.users.loc[pd.unique(np.concatenate(self.changed))], delta, True)
+            if delta not in self.deltas:
+                self.deltas.append(delta)
+        self.changed = []
+        for name, series in self.aggregates.items():
+            replace(series.reset_index(), name + '.parquet', False)
+        with open(os.path.join(state_dir, META_FILE + '.tmp'), 'w') as meta:
+            json.dump({'last_day': self.last_day, 'users': self.users_file, 'deltas': self.deltas}, meta)
+        os.replace(os.path.join(state_dir, META_FILE + '.tmp'), os.path.join(state_dir, META_FILE))
+        #старые файлы удаляются только после того, как meta.json на них больше не ссылается
+        for name in stale:
+            if os.path.exists(os.path.join(state_dir, name)):
+                os.remove(os.path.join(state_dir, name))
+
+    def update(self, visits=None, orders=None, costs=None):
+        """Добавляет партицию нормализованных таблиц (как из loader) к состоянию.
+
+        Все даты партиции должны быть позже последнего загруженного дня.
+        """
+        parts = [(visits, 'visit_start'), (orders, 'order_date'), (costs, 'cost_date')]
+        days = [day_index(frame[column]) for frame, column in parts
+                if frame is not None and len(frame)]
+        if not days:
+            return self
+        first, last = min(d.min() for d in days), max(d.max() for d in days)
+        if self.last_day is not None and first <= self.last_day:
+            raise ValueError(
+                'партиция начинается с дня {}, а состояние уже содержит дни по {}'.format(
+                    day_start([first])[0].date(), day_start([self.last_day])[0].date()))
+
+        if visits is not None and len(visits):
+            self._add_visits(visits)
+        if orders is not None and len(orders):
+            self._add_orders(orders)
+        if costs is not None and len(costs):
+            self._add('costs', {
+                'source_id': costs['source_id'].to_numpy(),
+                'day': day_index(costs['cost_date']),
+                'costs': costs['costs'].to_numpy(),
+            })
+        self.last_day = int(last)
+        return self
+
+    def _add(self, name, data):
+        keys, value = AGGREGATES[name]
+        frame = pd.DataFrame(data)
+        if frame.empty:
+            return
+        added = frame.groupby(keys)[value].sum()
+        current = self.aggregates.get(name)
+        self.aggregates[name] = added if current is None else current.add(added, fill_value=0)
+
+    def _ensure_users(self, uids):
+        uids = pd.unique(uids)
+        self.changed.append(uids)
+        missing = uids[~pd.Index(uids).isin(self.users.index)]
+        if len(missing):
+            fresh = pd.DataFrame(
+                {column: np.full(len(missing), -1, dtype=kind) for column, kind in USER_COLUMNS.items()},
+                index=pd.Index(missing, dtype='uint64', name='uid'),
+            )
+            self.users = pd.concat([self.users, fresh])
+
+    def _set(self, uids, column, values):
+        #номера дней приходят в int64, а столбцы таблицы пользователей уже
+        self.users.loc[uids, column] = np.asarray(values).astype(USER_COLUMNS[column])
+
+    def _add_visits(self, visits):
+        visits = _sorted_by_time(visits, 'visit_start')
+        uids = visits['uid'].to_numpy().astype(np.uint64)
+        days = day_index(visits['visit_start'])
+        sources = visits['source_id'].to_numpy()
+        self._ensure_users(uids)
+
+        #новые посетители: первое посещение и первый источник
+        first = _first_rows(uids)
+        first_uids = uids[first]
+        fresh = self.users.loc[first_uids, 'first_day'].to_numpy() < 0
+        new_uids = first_uids[fresh]
+        self._set(new_uids, 'first_day', days[first][fresh])
+        self._set(new_uids, 'first_source', sources[first][fresh])
+        self._add('source_users', {'source_id': sources[first][fresh], 'users': 1})
+        self._attribute_buyers(new_uids, sources[first][fresh])
+
+        #дни партиции новые, поэтому все пары (uid, день) учитываются сразу
+        codes, uniques = pd.factorize(uids)
+        pair_codes, pair_days = unique_pairs(codes, days)
+        self._add('dau', {'day': pair_days, 'users': 1})
+
+        for name, column, to_period in (('wau', 'last_week', week_of_day),
+                                        ('mau', 'last_month', month_of_day)):
+            period_codes, periods = unique_pairs(pair_codes, to_period(pair_days))
+            period_uids = uniques[period_codes]
+            fresh = periods > self.users.loc[period_uids, column].to_numpy()
+            self._add(name, {AGGREGATES[name][0][0]: periods[fresh], 'users': 1})
+            if name == 'mau':
+                cohorts = month_of_day(self.users.loc[period_uids[fresh], 'first_day'].to_numpy())
+                self._add('retention', {
+                    'cohort_month': cohorts,
+                    'lifetime': periods[fresh] - cohorts,
+                    'users': 1,
+                })
+            latest = pd.Series(periods, index=period_uids).groupby(level=0).max()
+            self._set(latest.index, column, latest.to_numpy())
+
+    def _attribute_buyers(self, uids, sources):
+        """Переносит к источникам sources покупателей uids, купивших раньше первого посещения."""
+        order_days = self.users.loc[uids, 'first_order_day'].to_numpy()
+        bought = order_days >= 0
+        if not bought.any():
+            return
+        self._add('buyers_daily', {'source_id': sources[bought], 'day': order_days[bought], 'buyers': 1})
+        pending = self.aggregates.get('pending_revenue')
+        if pending is None:
+            return
+        pending_uids = pending.index.get_level_values('uid')
+        moved = pending_uids.isin(uids[bought])
+        source_of = pd.Series(sources[bought], index=uids[bought])
+        self._add('source_revenue', {
+            'source_id': source_of.reindex(pending_uids[moved]).to_numpy(),
+            'order_month': pending.index.get_level_values('order_month')[moved],
+            'revenue': pending.to_numpy()[moved],
+        })
+        self.aggregates['pending_revenue'] = pending[~moved]
+
+    def _add_orders(self, orders):
+        orders = _sorted_by_time(orders, 'order_date')
+        uids = orders['uid'].to_numpy().astype(np.uint64)
+        days = day_index(orders['order_date'])
+        revenue = orders['revenue'].to_numpy()
+        self._ensure_users(uids)
+
+        #новые покупатели
+        first = _first_rows(uids)
+        first_uids = uids[first]
+        fresh = self.users.loc[first_uids, 'first_order_day'].to_numpy() < 0
+        buyer_uids, buyer_days = first_uids[fresh], days[first][fresh]
+        self._set(buyer_uids, 'first_order_day', buyer_days)
+        self._add('new_buyers', {'first_order_month': month_of_day(buyer_days), 'buyers': 1})
+        sources = self.users.loc[buyer_uids, 'first_source'].to_numpy()
+        known = sources >= 0
+        self._add('buyers_daily', {'source_id': sources[known], 'day': buyer_days[known], 'buyers': 1})
+
+        #выручка по когортам первой покупки и по первому источнику
+        info = self.users.loc[uids]
+        order_months = month_of_day(days)
+        self._add('revenue', {
+            'first_order_month': month_of_day(info['first_order_day'].to_numpy()),
+            'order_month': order_months,
+            'revenue': revenue,
+        })
+        sources = info['first_source'].to_numpy()
+        known = sources >= 0
+        self._add('source_revenue', {
+            'source_id': sources[known],
+            'order_month': order_months[known],
+            'revenue': revenue[known],
+        })
+        self._add('pending_revenue', {
+            'uid': uids[~known],
+            'order_month': order_months[~known],
+            'revenue': revenue[~known],
+        })
+
+    def aggregate(self, name):
+        """Агрегат name как Series (пустой, если данных еще не было)."""
+        if name in self.aggregates:
+            return self.aggregates[name]
+        keys, value = AGGREGATES[name]
+        if len(keys) == 1:
+            index = pd.Index([], dtype='int64', name=keys[0])
+        else:
+            index = pd.MultiIndex.from_arrays([[] for _ in keys], names=keys)
+        return pd.Series([], index=index, name=value, dtype='float64')
+
+    def _dated(self, name, to_start):
+        series = self.aggregate(name)
+        return pd.Series(series.to_numpy(), index=to_start(series.index.to_numpy()), name=name)
+
+    def activity(self):
+        """DAU, WAU, MAU и sticky factor за всю загруженную историю."""
+        return build_activity(
+            self._dated('dau', day_start),
+            self._dated('wau', week_start),
+            self._dated('mau', month_start),
+        )
+
+    def retention_pivot(self, drop_first=True):
+        """Retention Rate той же формы, что cohorts.retention_pivot."""
+        counts = self.aggregate('retention').unstack('lifetime', fill_value=0)
+        return retention_from_users(counts, drop_first)
+
+    def ltv_pivot(self, margin_rate=1):
+        """LTV по когортам первой покупки и возрасту когорты в месяцах."""
+        report = self.aggregate('revenue').reset_index()
+        buyers = self.aggregate('new_buyers')
+        report['age'] = report['order_month'] - report['first_order_month']
+        report['ltv'] = (report['revenue'] * margin_rate
+                         / buyers.reindex(report['first_order_month']).to_numpy())
+        pivot = report.pivot_table(index='first_order_month', columns='age', values='ltv', aggfunc='sum')
+        pivot.index = month_start(pivot.index.to_numpy())
+        return pivot
+
+    def cac(self):
+        """Расходы и новые покупатели по (source_id, день) и CAC на покупателя."""
+        frame = pd.concat(
+            [self.aggregate('costs'), self.aggregate('buyers_daily')], axis=1, join='inner'
+        ).reset_index()
+        frame['day'] = day_start(frame['day'].to_numpy())
+        frame['costs_per_buyer'] = frame['costs'] / frame['buyers']
+        return frame
+
+    def source_ltv(self):
+        """Выручка на посетителя по первому источнику и месяцу заказа."""
+        frame = self.aggregate('source_revenue').reset_index()
+        users = self.aggregate('source_users')
+        frame['n_visits'] = users.reindex(frame['source_id']).to_numpy()
+        frame['ltv'] = frame['revenue'] / frame['n_visits']
+        frame['order_month'] = month_start(frame['order_month'].to_numpy())
+        return frame
+
+
+def ingest(state_dir, visits_path=None, orders_path=None, costs_path=None):
+    """Добавляет к состоянию в state_dir партицию из CSV-файлов и сохраняет его."""
+    state = IncrementalState.load(state_dir)
+    state.update(
+        visits=read_source('visits', visits_path) if visits_path else None,
+        orders=read_source('orders', orders_path) if orders_path else None,
+        costs=read_source('costs', costs_path) if costs_path else None,
+    )
+    state.save(state_dir)
+    return state
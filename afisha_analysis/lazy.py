@@ -0,0 +1,348 @@
+# coding: utf-8
+"""Бэкенд графа метрик на ленивых запросах Polars: Pipeline(backend='polars').
+
+Исходные таблицы не загружаются целиком, а открываются как LazyFrame
+(scan_csv или scan_parquet по кешу loader). Узлы строят запросы, Polars
+оптимизирует их план, проталкивает фильтры (order_date < 2017-12-01 в
+LTV и частоте покупок) и проекции в чтение файла и выполняет их в
+несколько потоков. Только итоговые таблицы собираются (collect) и
+переводятся в pandas в тех же столбцах и типах, что у узлов pipeline.
+
+Небольшие таблицы отчета (сводные, CAC, ROMI) считаются теми же
+функциями pandas, что и в pipeline. Узлы с LazyFrame не сохраняются в
+дисковый кеш. Для сверки с pandas есть compare_backends.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from . import loader
+from .activity import build_activity
+from .attribution import NO_SOURCE
+from .bootstrap import user_summary
+from .cohorts import cohort_matrix, retention_from_users
+from .funnel import first_devices, lag_histogram
+from .ltv import build_cube
+from .periods import HALF_YEAR_END
+from .pipeline import NODES as PANDAS_NODES, Pipeline, node
+from .revenue import RevenueCube
+from .rolling import rolling_activity
+from .uids import UID_INDEX, encode
+
+
+NODES = {}
+
+#типы столбцов CSV из loader.SOURCES
+POLARS_TYPES = {'uint8': pl.UInt8, 'uint64': pl.UInt64, 'float64': pl.Float64, str: pl.Utf8}
+#узлы, которые работают только с небольшими таблицами pandas и берутся из pipeline как есть
+SHARED = ('dau', 'wau', 'mau', 'session_stats', 'session_duration_bins', 'buyers', 'days_to_first_order',
+          'lag_stats', 'days_to_first_order_bins', 'order_check', 'revenue_daily', 'ltv_output', 'ltv_cumulative',
+          'ltv_by_source', 'cac_mean', 'romi', 'source_intervals')
+USER_COLUMNS = ['uid', 'first_activity_date', 'source', 'first_order_date', 'first_order_month',
+                'order_count', 'revenue', 'days_to_first_order']
+
+
+def scan_source(name, data_dir=loader.DATA_DIR, cache_dir=loader.CACHE_DIR, start=None, end=None):
+    """LazyFrame нормализованной таблицы name: кеш Parquet loader, если он есть, иначе CSV.
+
+    start и end ограничивают даты столбца SOURCES[name]['partition']
+    полуинтервалом [start, end); с кешем читаются только файлы нужных
+    месяцев набора loader.partitioned_dataset.
+    """
+    if start is not None or end is not None:
+        return _scan_months(name, data_dir, cache_dir, start, end)
+    path = loader.source_path(name, data_dir)
+    if cache_dir is not None:
+        cached = loader.cache_path(name, path, cache_dir)
+        if os.path.exists(cached):
+            return pl.scan_parquet(cached)
+    spec = loader.SOURCES[name]
+    frame = pl.scan_csv(path, schema_overrides={column: POLARS_TYPES[kind] for column, kind in spec['dtype'].items()})
+    frame = frame.rename(spec['rename'])
+    columns = []
+    for column, fmt in spec['dates'].items():
+        if fmt == loader.DATE_FORMAT:
+            columns.append(pl.col(column).str.to_date(fmt).cast(pl.Datetime('ns')))
+        else:
+            columns.append(pl.col(column).str.to_datetime(fmt, time_unit='ns'))
+    columns += [pl.col(column).cast(pl.Categorical) for column in spec['categories']]
+    return frame.with_columns(columns)
+
+
+def _scan_months(name, data_dir, cache_dir, start, end):
+    date_column = pl.col(loader.SOURCES[name]['partition'])
+    if cache_dir is not None and loader._parquet_available():
+        root = loader.partitioned_dataset(name, data_dir, cache_dir)
+        files = [os.path.join(directory, 'part-0.parquet') for directory in loader.partition_months(root, start, end)]
+        frame = pl.scan_parquet(files) if files else scan_source(name, data_dir, cache_dir).head(0)
+    else:
+        frame = scan_source(name, data_dir, cache_dir)
+    if start is not None:
+        frame = frame.filter(date_column >= _timestamp(start))
+    if end is not None:
+        frame = frame.filter(date_column < _timestamp(end))
+    return frame
+
+
+def to_pandas(frame):
+    """DataFrame pandas из собранной таблицы Polars (без pyarrow)."""
+    return pd.DataFrame({column: frame[column].to_numpy() for column in frame.columns})
+
+
+def _series(frame, column):
+    return pd.Series(frame[column].to_numpy().astype(np.int64),
+                     index=pd.DatetimeIndex(frame['period'].to_numpy()), name=column)
+
+
+def _month_number(column):
+    """Номер месяца от января 1970 года, как periods.month_index."""
+    return (pl.col(column).dt.year().cast(pl.Int64) - 1970) * 12 + pl.col(column).dt.month().cast(pl.Int64) - 1
+
+
+def _timestamp(value):
+    return pl.lit(pd.Timestamp(value).to_pydatetime())
+
+
+for _name in SHARED:
+    NODES[_name] = PANDAS_NODES[_name]
+
+
+#пользователи
+
+@node('users', deps=('visits', 'orders'), stage='conversion', persist=False, registry=NODES)
+def _users(visits, orders):
+    """Запрос со сводкой по uid: те же столбцы, что у userindex.build_user_index (first-touch)."""
+    first_visits = visits.group_by('uid').agg(
+        pl.col('visit_start').min().alias('first_activity_date'),
+        #arg_min берет первую по порядку строку с минимальным временем, как argmin_per_group
+        pl.col('source_id').get(pl.col('visit_start').arg_min()).cast(pl.Int16).alias('source'),
+    )
+    first_orders = orders.group_by('uid').agg(
+        pl.col('order_date').min().alias('first_order_date'),
+        pl.len().cast(pl.Int32).alias('order_count'),
+        pl.col('revenue').sum(),
+    )
+    return first_visits.join(first_orders, on='uid', how='full', coalesce=True).with_columns(
+        pl.col('source').fill_null(NO_SOURCE),
+        pl.col('first_order_date').dt.truncate('1mo').alias('first_order_month'),
+        pl.col('order_count').fill_null(0),
+        pl.col('revenue').fill_null(0.0),
+        #total_days отбрасывает дробную часть, как astype('int') в ноутбуке
+        (pl.col('first_order_date') - pl.col('first_activity_date')).dt.total_days().cast(pl.Float64)
+        .alias('days_to_first_order'),
+    )
+
+
+@node('user_index', deps=('users',), stage='conversion', registry=NODES)
+def _user_index(users):
+    #порядок словаря pipeline: посетители по uid, затем покупатели без посещений по uid
+    index = to_pandas(users.select(USER_COLUMNS).sort([pl.col('first_activity_date').is_null(), 'uid']).collect())
+    index.index.name = UID_INDEX
+    return index
+
+
+#посещаемость и удержание
+
+@node('activity', deps=('visits',), stage='activity', registry=NODES)
+def _activity(visits):
+    queries = [
+        visits.group_by(pl.col('visit_start').dt.truncate(every).alias('period'))
+        .agg(pl.col('uid').n_unique().alias(name)).sort('period')
+        for name, every in (('dau', '1d'), ('wau', '1w'), ('mau', '1mo'))
+    ]
+    dau, wau, mau = pl.collect_all(queries)
+    return build_activity(_series(dau, 'dau'), _series(wau, 'wau'), _series(mau, 'mau'))
+
+
+@node('rolling_activity', deps=('visits',), stage='activity', registry=NODES)
+def _rolling_activity(visits):
+    return rolling_activity(to_pandas(visits.select('uid', 'visit_start').collect()))
+
+
+@node('session_duration', deps=('visits',), version=2, stage='sessions', registry=NODES)
+def _session_duration(visits):
+    frame = visits.select((pl.col('visit_end') - pl.col('visit_start')).dt.total_seconds().alias('seconds')).collect()
+    return pd.Series(frame['seconds'].to_numpy().astype(np.int64))
+
+
+@node('session_histogram', deps=('visits',), stage='sessions', registry=NODES)
+def _session_histogram(visits):
+    frame = to_pandas(visits.select('device', 'source_id', 'visit_start', 'visit_end').collect())
+    return PANDAS_NODES['session_histogram'].func(frame)
+
+
+@node('retention_pivot', deps=('visits',), stage='retention', registry=NODES)
+def _retention_pivot(visits):
+    months = visits.select('uid', _month_number('visit_start').alias('month')).unique()
+    cohorts = months.group_by('uid').agg(pl.col('month').min().alias('cohort'))
+    cells = (
+        months.join(cohorts, on='uid')
+        .group_by('cohort', (pl.col('month') - pl.col('cohort')).alias('lifetime'))
+        .agg(pl.len().alias('users'))
+        .collect()
+    )
+    users = cohort_matrix(cells['cohort'].to_numpy(), cells['lifetime'].to_numpy(),
+                          weights=cells['users'].to_numpy().astype(np.float64))
+    return retention_from_users(users)
+
+
+#электронная коммерция
+
+@node('lag_histogram', deps=('user_index', 'visits'), stage='conversion', registry=NODES)
+def _lag_histogram(user_index, visits):
+    frame = visits.select('uid', 'visit_start', 'device').collect()
+    codes = encode(user_index['uid'].to_numpy(), frame['uid'].to_numpy())
+    devices = first_devices(codes, frame['visit_start'].to_numpy(), frame['device'].cast(pl.Utf8).to_numpy(),
+                            len(user_index))
+    return lag_histogram(user_index, devices)
+
+
+@node('orders_mean', deps=('orders',), stage='conversion', registry=NODES)
+def _orders_mean(orders):
+    value = (
+        orders.filter(pl.col('order_date') < _timestamp(HALF_YEAR_END))
+        .group_by('uid').agg(pl.len().alias('orders'))
+        .select(pl.col('orders').mean())
+        .collect().item()
+    )
+    return np.nan if value is None else value
+
+
+@node('revenue_cube', deps=('orders',), stage='conversion', registry=NODES)
+def _revenue_cube(orders):
+    frame = orders.select('order_date', 'revenue').collect()
+    return RevenueCube().add(frame['order_date'].to_numpy(), frame['revenue'].to_numpy())
+
+
+@node('ltv_report', deps=('users', 'orders'), stage='ltv', registry=NODES, options=('margin_rate',))
+def _ltv_report(users, orders, margin_rate=1):
+    end = _timestamp(HALF_YEAR_END)
+    buyers = users.filter(pl.col('order_count') > 0).select('uid', 'first_order_month')
+    sizes = buyers.group_by('first_order_month').agg(pl.len().cast(pl.Int64).alias('new_buyers'))
+    #order_month < end и first_order_month < end равносильны фильтрам по датам до группировки
+    revenue = (
+        orders.filter(pl.col('order_date') < end)
+        .join(buyers.filter(pl.col('first_order_month') < end), on='uid')
+        .group_by('first_order_month', pl.col('order_date').dt.truncate('1mo').alias('order_month'))
+        .agg(pl.col('revenue').sum())
+    )
+    report = (
+        sizes.join(revenue, on='first_order_month')
+        .sort('first_order_month', 'order_month')
+        .with_columns(
+            (pl.col('revenue') * margin_rate).alias('gp'),
+            (_month_number('order_month') - _month_number('first_order_month')).alias('age'),
+        )
+        .with_columns((pl.col('gp') / pl.col('new_buyers')).alias('ltv'))
+    )
+    return to_pandas(report.collect())
+
+
+@node('ltv_cube', deps=('user_index', 'orders'), stage='ltv', registry=NODES)
+def _ltv_cube(user_index, orders):
+    frame = orders.select('uid', 'order_date', 'revenue').collect()
+    #uid_index - позиция uid в user_index
+    codes = encode(user_index['uid'].to_numpy(), frame['uid'].to_numpy())
+    return build_cube(user_index['first_order_date'].to_numpy(), user_index['source'].to_numpy(), codes,
+                      frame['order_date'].to_numpy(), frame['revenue'].to_numpy())
+
+
+#маркетинг
+
+@node('costs_per_source', deps=('costs',), stage='cac', registry=NODES)
+def _costs_per_source(costs):
+    frame = costs.group_by('source_id').agg(pl.col('costs').sum()).sort('source_id').collect()
+    return pd.Series(frame['costs'].to_numpy(), index=pd.Index(frame['source_id'].to_numpy(), name='source_id'),
+                     name='costs')
+
+
+@node('buyers_daily', deps=('users',), stage='cac', registry=NODES)
+def _buyers_daily(users):
+    frame = (
+        users.filter(pl.col('first_order_date').is_not_null() & pl.col('first_activity_date').is_not_null()
+                     & (pl.col('source') != NO_SOURCE))
+        .group_by(pl.col('source').alias('source_id'),
+                  pl.col('first_order_date').dt.truncate('1d').alias('first_order_dt'))
+        .agg(pl.len().cast(pl.Int64).alias('n_buyers'))
+        .sort('source_id', 'first_order_dt')
+    )
+    return to_pandas(frame.collect())
+
+
+@node('cac', deps=('buyers_daily', 'costs'), stage='cac', registry=NODES)
+def _cac(daily, costs):
+    return PANDAS_NODES['cac'].func(daily, to_pandas(costs.collect()))
+
+
+@node('report_fs', deps=('users', 'orders'), stage='romi', registry=NODES)
+def _report_fs(users, orders):
+    sources = users.select('uid', pl.col('source').cast(pl.Int64).alias('source_id'))
+    sizes = (
+        sources.filter(pl.col('source_id') != NO_SOURCE)
+        .group_by('source_id').agg(pl.len().cast(pl.Int64).alias('n_visits'))
+    )
+    revenue = (
+        orders.join(sources, on='uid')
+        .filter(pl.col('source_id') != NO_SOURCE)
+        .group_by('source_id', pl.col('order_date').dt.truncate('1mo').alias('order_month'))
+        .agg(pl.col('revenue').sum())
+    )
+    report = (
+        sizes.join(revenue, on='source_id')
+        .sort('source_id', 'order_month')
+        .with_columns((pl.col('revenue') / pl.col('n_visits')).alias('ltv'))
+    )
+    return to_pandas(report.collect())
+
+
+@node('romi_table', deps=('report_fs', 'costs'), stage='romi', registry=NODES)
+def _romi_table(report_fs, costs):
+    return PANDAS_NODES['romi_table'].func(report_fs, to_pandas(costs.collect()))
+
+
+#статистика
+
+@node('user_summary', deps=('user_index', 'visits'), stage='stats', registry=NODES)
+def _user_summary(user_index, visits):
+    frame = visits.select('uid', 'visit_start').collect()
+    codes = encode(user_index['uid'].to_numpy(), frame['uid'].to_numpy())
+    return user_summary(user_index, codes, frame['visit_start'].to_numpy())
+
+
+def _without_row_numbers(value):
+    #номера строк без смысла (например, оставшиеся после query в pandas) не сравниваются
+    if value.index.name is None and pd.api.types.is_integer_dtype(value.index):
+        return value.reset_index(drop=True)
+    return value
+
+
+def _same(expected, actual, rtol):
+    if isinstance(expected, tuple) and hasattr(expected, '_fields'):
+        for left, right in zip(expected, actual):
+            _same(left, right, rtol)
+    elif isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(_without_row_numbers(expected), _without_row_numbers(actual),
+                                      check_dtype=False, check_index_type=False, check_column_type=False,
+                                      check_names=False, rtol=rtol)
+    elif isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(_without_row_numbers(expected), _without_row_numbers(actual),
+                                       check_dtype=False, check_index_type=False, check_names=False, rtol=rtol)
+    elif not (pd.isna(expected) and pd.isna(actual)) and not np.isclose(expected, actual, rtol=rtol):
+        raise AssertionError('{!r} != {!r}'.format(expected, actual))
+
+
+def compare_backends(names, data_dir=loader.DATA_DIR, cache_dir=None, rtol=1e-9):
+    """Считает узлы names в pandas и Polars и возвращает словарь расхождений {имя: описание}."""
+    expected = Pipeline(data_dir, cache_dir)
+    actual = Pipeline(data_dir, cache_dir, backend='polars')
+    mismatches = {}
+    for name in names:
+        try:
+            _same(expected.get(name), actual.get(name), rtol)
+        except AssertionError as error:
+            mismatches[name] = str(error)
+    return mismatches
+
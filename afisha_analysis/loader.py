@@ -0,0 +1,304 @@
+# coding: utf-8
+"""Загрузка таблиц costs, orders и visits с компактными типами и кешем.
+
+CSV читаются порциями (chunksize) сразу в нужные типы: uid -> uint64,
+source_id -> uint8, device -> category, даты разбираются векторно по
+фиксированному формату. Нормализованные таблицы сохраняются в локальный
+кеш (Parquet), ключ кеша - хеш пути, mtime и размер исходного файла,
+поэтому повторные запуски не разбирают CSV вовсе, а каталоги данных с
+общим кешем не мешают друг другу.
+
+Для расчетов за ограниченный период таблица записывается в кеш еще и
+набором Parquet, разбитым по месяцам (каталоги month=YYYY-MM, как у
+Hive). load_partitioned читает только каталоги месяцев, пересекающих
+[start, end), и только нужные столбцы; строки граничных месяцев
+отбираются по дате.
+"""
+
+import glob
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .periods import month_index
+
+
+DATA_DIR = '/datasets'
+CACHE_DIR = os.environ.get(
+    'AFISHA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'afisha_analysis')
+)
+CHUNKSIZE = 1_000_000
+
+DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+#описание исходных файлов: имена столбцов, типы и форматы дат
+SOURCES = {
+    'costs': {
+        'file': 'costs.csv',
+        'dtype': {'source_id': 'uint8', 'dt': str, 'costs': 'float64'},
+        'rename': {'dt': 'cost_date'},
+        'dates': {'cost_date': DATE_FORMAT},
+        'categories': [],
+        'partition': 'cost_date',
+    },
+    'orders': {
+        'file': 'orders_log.csv',
+        'dtype': {'Buy Ts': str, 'Revenue': 'float64', 'Uid': 'uint64'},
+        'rename': {'Buy Ts': 'order_date', 'Revenue': 'revenue', 'Uid': 'uid'},
+        'dates': {'order_date': DATETIME_FORMAT},
+        'categories': [],
+        'partition': 'order_date',
+    },
+    'visits': {
+        'file': 'visits_log.csv',
+        'dtype': {'Device': str, 'End Ts': str, 'Source Id': 'uint8', 'Start Ts': str, 'Uid': 'uint64'},
+        'rename': {
+            'Device': 'device',
+            'End Ts': 'visit_end',
+            'Source Id': 'source_id',
+            'Start Ts': 'visit_start',
+            'Uid': 'uid',
+        },
+        'dates': {'visit_end': DATETIME_FORMAT, 'visit_start': DATETIME_FORMAT},
+        'categories': ['device'],
+        'partition': 'visit_start',
+    },
+}
+
+
+def source_path(name, data_dir=DATA_DIR):
+    """Путь к исходному CSV таблицы name."""
+    return os.path.join(data_dir, SOURCES[name]['file'])
+
+
+def normalize_chunk(name, chunk):
+    """Приводит порцию сырого CSV к именам столбцов и типам анализа."""
+    spec = SOURCES[name]
+    chunk = chunk.rename(columns=spec['rename'])
+    for column, fmt in spec['dates'].items():
+        chunk[column] = pd.to_datetime(chunk[column], format=fmt)
+    for column in spec['categories']:
+        chunk[column] = chunk[column].astype('category')
+    return chunk
+
+
+def _empty_frame(name):
+    """Пустая таблица name с теми же столбцами и типами, что у normalize_chunk."""
+    raw = pd.DataFrame({column: pd.Series(dtype=kind) for column, kind in SOURCES[name]['dtype'].items()})
+    return normalize_chunk(name, raw)
+
+
+def iter_chunks(name, path=None, chunksize=CHUNKSIZE, usecols=None, data_dir=DATA_DIR):
+    """Итерирует нормализованные порции таблицы name из CSV.
+
+    usecols задается в нормализованных именах столбцов.
+    """
+    spec = SOURCES[name]
+    path = path or source_path(name, data_dir)
+    raw_usecols = None
+    if usecols is not None:
+        reverse = {new: old for old, new in spec['rename'].items()}
+        raw_usecols = [reverse.get(column, column) for column in usecols]
+    dtype = {column: kind for column, kind in spec['dtype'].items()
+             if raw_usecols is None or column in raw_usecols}
+    reader = pd.read_csv(path, dtype=dtype, usecols=raw_usecols, chunksize=chunksize)
+    for chunk in reader:
+        yield normalize_chunk(name, chunk)
+
+
+def concat_chunks(chunks):
+    """Склеивает порции, сохраняя категориальные столбцы категориальными."""
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    columns = list(chunks[0].columns)
+    categorical = [column for column in columns
+                   if isinstance(chunks[0][column].dtype, pd.CategoricalDtype)]
+    merged = {column: union_categoricals([chunk[column] for chunk in chunks])
+              for column in categorical}
+    frame = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column, values in merged.items():
+        frame[column] = values
+    return frame[columns]
+
+
+def read_source(name, path=None, chunksize=CHUNKSIZE, data_dir=DATA_DIR):
+    """Читает таблицу name из CSV порциями в компактных типах."""
+    return concat_chunks(iter_chunks(name, path, chunksize=chunksize, data_dir=data_dir))
+
+
+def _parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def cache_prefix(name, path):
+    """Начало ключа кеша: имя таблицы и хеш абсолютного пути исходного файла."""
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    return '{}-{}'.format(name, digest)
+
+
+def cache_key(name, path):
+    """Ключ кеша: имя таблицы, хеш пути, mtime и размер исходного файла."""
+    stat = os.stat(path)
+    return '{}-{}-{}'.format(cache_prefix(name, path), stat.st_mtime_ns, stat.st_size)
+
+
+def cache_path(name, path, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, cache_key(name, path) + '.parquet')
+
+
+def load_source(name, data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE, path=None):
+    """Возвращает нормализованную таблицу name, по возможности из кеша.
+
+    cache_dir=None отключает кеш. Без pyarrow таблица всегда читается из CSV.
+    """
+    path = path or source_path(name, data_dir)
+    if cache_dir is None or not _parquet_available():
+        return read_source(name, path, chunksize=chunksize)
+
+    cached = cache_path(name, path, cache_dir)
+    if os.path.exists(cached):
+        return pd.read_parquet(cached)
+
+    frame = read_source(name, path, chunksize=chunksize)
+    os.makedirs(cache_dir, exist_ok=True)
+    #старые версии кеша этого файла больше не нужны; кеш других каталогов данных не трогается
+    for stale in glob.glob(os.path.join(cache_dir, cache_prefix(name, path) + '-*.parquet')):
+        os.remove(stale)
+    tmp = cached + '.tmp'
+    frame.to_parquet(tmp, index=False)
+    os.replace(tmp, cached)
+    return frame
+
+
+def dataset_path(name, path, cache_dir=CACHE_DIR):
+    """Каталог набора по месяцам для таблицы name (ключ тот же, что у кеша)."""
+    return os.path.join(cache_dir, cache_key(name, path) + '.months')
+
+
+def _month_label(month):
+    return 'month=' + str(np.datetime64(int(month), 'M'))
+
+
+def write_partitioned(name, frame, root):
+    """Записывает таблицу name в каталог root по месяцам столбца SOURCES[name]['partition'].
+
+    Строки внутри месяца сохраняют исходный порядок. Каталог собирается
+    рядом и подменяет root целиком.
+    """
+    months = month_index(frame[SOURCES[name]['partition']])
+    order = np.argsort(months, kind='stable')
+    bounds = np.flatnonzero(np.diff(months[order])) + 1
+    tmp = root + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for rows in (np.split(order, bounds) if len(order) else []):
+        directory = os.path.join(tmp, _month_label(months[rows[0]]))
+        os.makedirs(directory)
+        frame.iloc[rows].to_parquet(os.path.join(directory, 'part-0.parquet'), index=False)
+    shutil.rmtree(root, ignore_errors=True)
+    os.replace(tmp, root)
+    return root
+
+
+def _date_mask(dates, start, end):
+    keep = np.ones(len(dates), dtype=bool)
+    if start is not None:
+        keep &= (dates >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (dates < pd.Timestamp(end)).to_numpy()
+    return keep
+
+
+def partition_months(root, start=None, end=None):
+    """Каталоги месяцев набора root, пересекающих [start, end), по возрастанию."""
+    first = None if start is None else month_index([pd.Timestamp(start)])[0]
+    #end не включается: месяц, начинающийся ровно в end, не нужен
+    last = None if end is None else month_index([pd.Timestamp(end) - pd.Timedelta(1, 'ns')])[0]
+    selected = []
+    for entry in sorted(os.listdir(root)):
+        if not entry.startswith('month='):
+            continue
+        month = np.datetime64(entry[len('month='):], 'M').astype(np.int64)
+        if (first is None or month >= first) and (last is None or month <= last):
+            selected.append(os.path.join(root, entry))
+    return selected
+
+
+def read_partitioned(name, root, start=None, end=None, columns=None):
+    """Читает из набора root строки с датой в [start, end) и столбцы columns (None - все)."""
+    date_column = SOURCES[name]['partition']
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + [date_column]))
+    chunks = []
+    for directory in partition_months(root, start, end):
+        chunk = pd.read_parquet(directory, columns=read_columns)
+        keep = _date_mask(chunk[date_column], start, end)
+        chunks.append(chunk if keep.all() else chunk[keep])
+    #без подходящих месяцев - пустая таблица со столбцами и типами нормализованной таблицы
+    frame = concat_chunks(chunks) if chunks else _empty_frame(name)
+    return frame if columns is None else frame[list(columns)]
+
+
+def partitioned_dataset(name, data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE, path=None):
+    """Каталог набора по месяцам для таблицы name; строится из кеша таблицы, если его еще нет."""
+    path = path or source_path(name, data_dir)
+    root = dataset_path(name, path, cache_dir)
+    if not os.path.isdir(root):
+        frame = load_source(name, data_dir, cache_dir, chunksize, path)
+        #старые версии набора этого файла больше не нужны; наборы других каталогов данных не трогаются
+        for stale in glob.glob(os.path.join(cache_dir, cache_prefix(name, path) + '-*.months')):
+            shutil.rmtree(stale, ignore_errors=True)
+        write_partitioned(name, frame, root)
+    return root
+
+
+def load_partitioned(name, start=None, end=None, columns=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR,
+                     chunksize=CHUNKSIZE, path=None):
+    """Таблица name за [start, end) со столбцами columns из набора по месяцам.
+
+    Набор строится из нормализованной таблицы при первом обращении. Без
+    кеша или без pyarrow таблица читается целиком и фильтруется в памяти.
+    """
+    path = path or source_path(name, data_dir)
+    if cache_dir is None or not _parquet_available():
+        frame = load_source(name, data_dir, cache_dir, chunksize, path)
+        frame = frame[_date_mask(frame[SOURCES[name]['partition']], start, end)].reset_index(drop=True)
+        return frame if columns is None else frame[list(columns)]
+
+    return read_partitioned(name, partitioned_dataset(name, data_dir, cache_dir, chunksize, path),
+                            start, end, columns)
+
+
+def load_costs(data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE):
+    """Таблица маркетинговых расходов: source_id, cost_date, costs."""
+    return load_source('costs', data_dir, cache_dir, chunksize)
+
+
+def load_orders(data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE):
+    """Таблица заказов: order_date, revenue, uid."""
+    return load_source('orders', data_dir, cache_dir, chunksize)
+
+
+def load_visits(data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE):
+    """Таблица посещений: device, visit_end, source_id, visit_start, uid."""
+    return load_source('visits', data_dir, cache_dir, chunksize)
+
+
+def load_all(data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE):
+    """Загружает costs, orders и visits одним вызовом."""
+    return (
+        load_costs(data_dir, cache_dir, chunksize),
+        load_orders(data_dir, cache_dir, chunksize),
+        load_visits(data_dir, cache_dir, chunksize),
+    )
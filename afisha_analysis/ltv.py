@@ -0,0 +1,204 @@
+# coding: utf-8
+"""LTV по когортам из массивов заказов: один проход и сценарии без пересчета.
+
+build_cube один раз проходит по заказам: когорта покупателя берется
+поиском по uid_index в массиве когорт пользователей (без копии orders
+с месяцем первой покупки), возраст заказа - разность номеров периодов,
+и выручка и число заказов раскладываются одним np.bincount в куб
+источник x когорта x возраст. Там же считается размер когорт по
+источникам.
+
+Дальше любые сценарии - горизонт, маржа, граница наблюдения, разрез по
+источникам - считаются по кубу, размер которого не зависит от числа
+заказов. Когорты бывают по дням, неделям (с понедельника) и месяцам.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .periods import day_index, day_start, month_index, month_start, week_index, week_start
+from .uids import UID_INDEX
+
+
+#номера периодов по датам и даты начала периодов по номерам
+GRANULARITIES = {
+    'day': (day_index, day_start),
+    'week': (week_index, week_start),
+    'month': (month_index, month_start),
+}
+
+LtvCube = namedtuple(
+    'LtvCube',
+    ['revenue', 'orders', 'sizes', 'first_period', 'last_period', 'sources', 'granularity'],
+)
+LtvCube.__doc__ = """Выручка и число заказов [источник, когорта, возраст] и размеры когорт [источник, когорта].
+
+first_period - номер периода первой когорты, last_period - номер
+последнего периода с заказами, sources - source_id по первой оси
+(NO_SOURCE - покупатели без атрибутированного источника).
+"""
+
+
+def build_cube(first_order, sources, order_codes, order_dates, revenue, granularity='month'):
+    """Куб LTV по массивам пользователей и заказов.
+
+    first_order и sources - дата первой покупки (NaT у не покупателей) и
+    источник по uid_index; order_codes, order_dates и revenue - uid_index,
+    дата и выручка каждого заказа.
+    """
+    to_index, _ = GRANULARITIES[granularity]
+    first_order = np.asarray(first_order, dtype='datetime64[ns]')
+    buyers = np.flatnonzero(~np.isnat(first_order))
+    order_codes = np.asarray(order_codes, dtype=np.int64)
+    if not len(buyers) or not len(order_codes):
+        raise ValueError('нет покупателей или заказов для расчета LTV')
+
+    cohorts = np.zeros(len(first_order), dtype=np.int64)
+    cohorts[buyers] = to_index(first_order[buyers])
+    first_period = int(cohorts[buyers].min())
+    n_cohorts = int(cohorts[buyers].max()) - first_period + 1
+    source_ids, buyer_slots = np.unique(np.asarray(sources)[buyers], return_inverse=True)
+    slots = np.zeros(len(first_order), dtype=np.int64)
+    slots[buyers] = buyer_slots
+    n_sources = len(source_ids)
+
+    periods = to_index(order_dates)
+    order_cohorts = cohorts[order_codes]
+    #первая покупка - самый ранний заказ, поэтому возраст не бывает отрицательным
+    ages = periods - order_cohorts
+    n_ages = int(ages.max()) + 1
+    cells = (slots[order_codes] * n_cohorts + order_cohorts - first_period) * n_ages + ages
+    shape = (n_sources, n_cohorts, n_ages)
+    size = n_sources * n_cohorts * n_ages
+    revenue = np.bincount(cells, weights=np.asarray(revenue, dtype=np.float64), minlength=size)
+    orders = np.bincount(cells, minlength=size)
+    sizes = np.bincount(buyer_slots * n_cohorts + cohorts[buyers] - first_period,
+                        minlength=n_sources * n_cohorts)
+    return LtvCube(revenue.reshape(shape), orders.reshape(shape), sizes.reshape(n_sources, n_cohorts),
+                   first_period, int(periods.max()), source_ids, granularity)
+
+
+def cube_from_index(user_index, orders, granularity='month'):
+    """Куб LTV по сводной таблице пользователей и заказам с uid_index."""
+    return build_cube(user_index['first_order_date'].to_numpy(), user_index['source'].to_numpy(),
+                      orders[UID_INDEX].to_numpy(), orders['order_date'].to_numpy(),
+                      orders['revenue'].to_numpy(), granularity)
+
+
+def _bound(cube, cutoff):
+    """Номер первого периода, который не раньше cutoff (наблюдаются периоды до него)."""
+    if cutoff is None:
+        return cube.last_period + 1
+    to_index, to_start = GRANULARITIES[cube.granularity]
+    cutoff = pd.Timestamp(cutoff)
+    period = int(to_index([cutoff])[0])
+    return period if to_start([period])[0] == cutoff else period + 1
+
+
+def _slice(cube, by_source, sources):
+    """Выручка, заказы и размеры когорт по источникам или в сумме (с осью источника длины 1)."""
+    revenue, orders, sizes, labels = cube.revenue, cube.orders, cube.sizes, cube.sources
+    if sources is not None:
+        keep = np.isin(cube.sources, sources)
+        revenue, orders, sizes, labels = revenue[keep], orders[keep], sizes[keep], labels[keep]
+    if not by_source:
+        revenue = revenue.sum(axis=0, keepdims=True)
+        orders = orders.sum(axis=0, keepdims=True)
+        sizes = sizes.sum(axis=0, keepdims=True)
+    return revenue, orders, sizes, labels
+
+
+def ltv_matrix(cube, horizon=None, margin=1.0, cutoff=None, cumulative=True, by_source=False, sources=None):
+    """LTV когорт по возрасту: строки - когорты (и источники), столбцы - возраст в периодах.
+
+    horizon ограничивает возраст, cutoff - наблюдаемые периоды (начало
+    раньше cutoff), margin - доля выручки в валовой прибыли. Ненакопленный
+    LTV (cumulative=False) задан только там, где были заказы, как в
+    сводной таблице ноутбука; накопленный - для всех наблюдаемых возрастов.
+    """
+    revenue, orders, sizes, labels = _slice(cube, by_source, sources)
+    n_cohorts, n_ages = revenue.shape[1:]
+    if horizon is not None:
+        n_ages = min(n_ages, horizon)
+        revenue, orders = revenue[..., :n_ages], orders[..., :n_ages]
+    values = revenue * margin
+    if cumulative:
+        values = np.cumsum(values, axis=-1)
+    else:
+        values = np.where(orders > 0, values, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = values / np.where(sizes > 0, sizes, np.nan)[..., None]
+
+    cohort_periods = cube.first_period + np.arange(n_cohorts)
+    observed = cohort_periods[:, None] + np.arange(n_ages) < _bound(cube, cutoff)
+    values = np.where(observed, values, np.nan)
+
+    _, to_start = GRANULARITIES[cube.granularity]
+    cohort_starts = to_start(cohort_periods)
+    if by_source:
+        index = pd.MultiIndex.from_product([labels, cohort_starts], names=['source_id', 'cohort'])
+    else:
+        index = pd.Index(cohort_starts, name='cohort')
+    frame = pd.DataFrame(values.reshape(-1, n_ages), index=index,
+                         columns=pd.Index(np.arange(n_ages), name='age'))
+    return frame.dropna(how='all').dropna(axis=1, how='all')
+
+
+def ltv_report(cube, margin=1.0, cutoff=None):
+    """Длинная таблица как report в ноутбуке: когорта, размер, период заказа, выручка, gp, возраст, ltv.
+
+    Строки - пары (когорта, период заказа) с заказами в наблюдаемых
+    периодах; для месячных когорт столбцы называются first_order_month и
+    order_month.
+    """
+    revenue, orders, sizes, _ = _slice(cube, False, None)
+    cohorts, ages = np.nonzero(orders[0])
+    periods = cube.first_period + cohorts + ages
+    keep = periods < _bound(cube, cutoff)
+    cohorts, ages, periods = cohorts[keep], ages[keep], periods[keep]
+    _, to_start = GRANULARITIES[cube.granularity]
+    report = pd.DataFrame({
+        'first_order_' + cube.granularity: to_start(cube.first_period + cohorts),
+        'new_buyers': sizes[0, cohorts],
+        'order_' + cube.granularity: to_start(periods),
+        'revenue': revenue[0, cohorts, ages],
+    })
+    report['gp'] = report['revenue'] * margin
+    report['age'] = ages
+    report['ltv'] = report['gp'] / report['new_buyers']
+    return report
+
+
+def ltv_scenarios(cube, horizons, margins=(1.0,), cutoff=None, by_source=False):
+    """LTV покупателя за horizon периодов для каждой пары (горизонт, маржа).
+
+    Учитываются только когорты, которые прожили весь горизонт до
+    cutoff (или до последнего периода с заказами); LTV - выручка этих
+    когорт за горизонт на одного их покупателя. Маржа масштабирует
+    результат, поэтому все маржи получаются из одной накопленной суммы.
+    """
+    revenue, _, sizes, labels = _slice(cube, by_source, None)
+    cumulative = np.cumsum(revenue, axis=-1)
+    n_cohorts, n_ages = revenue.shape[1:]
+    cohort_periods = cube.first_period + np.arange(n_cohorts)
+    bound = min(_bound(cube, cutoff), cube.last_period + 1)
+    margins = np.asarray(margins, dtype=np.float64)
+    rows = []
+    for horizon in horizons:
+        mature = cohort_periods + horizon <= bound
+        gained = cumulative[:, mature, min(horizon, n_ages) - 1].sum(axis=1)
+        buyers = sizes[:, mature].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ltv = gained / np.where(buyers > 0, buyers, np.nan)
+        for slot in range(len(ltv)):
+            for margin, value in zip(margins, margin * ltv[slot]):
+                row = {'horizon': horizon, 'margin': margin, 'cohorts': int(mature.sum()),
+                       'buyers': int(buyers[slot]), 'ltv': value}
+                if by_source:
+                    row['source_id'] = labels[slot]
+                rows.append(row)
+    frame = pd.DataFrame(rows)
+    keys = ['horizon', 'margin'] + (['source_id'] if by_source else [])
+    return frame.set_index(keys)
@@ -0,0 +1,216 @@
+# coding: utf-8
+"""Мультиканальная атрибуция выручки и покупателей по всем посещениям до заказа.
+
+Посещения и заказы упорядочиваются по (uid_index, время). Для каждого
+заказа диапазон его посещений [lo, hi) находится бинарным поиском по
+составному ключу uid_index * span + секунды, так что соединение
+uid x посещение x заказ не строится. Касания разворачиваются порциями
+(не больше touch_budget касаний за раз) и получают веса по модели:
+
+- linear: поровну между всеми касаниями;
+- time_decay: 2 ** (-давность / half_life), нормированные к 1;
+- position: 40% первому и последнему касанию, 20% поровну остальным.
+
+Результат - выручка и покупатели по источникам в тех же разрезах, что
+costs_per_source, buyers_daily и report_fs ноутбука.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .periods import day_start, month_index, month_start
+from .uids import UID_INDEX
+
+
+MODELS = ('linear', 'time_decay', 'position')
+DEFAULT_HALF_LIFE = pd.Timedelta(days=7)
+DEFAULT_TOUCH_BUDGET = 10_000_000
+POSITION_ENDS = 0.4
+
+Attribution = namedtuple('Attribution', ['by_source', 'by_month', 'buyers_daily', 'unattributed_revenue'])
+
+
+def _seconds(times):
+    return np.asarray(times).astype('datetime64[s]').astype(np.int64)
+
+
+def _composite(codes, seconds, origin, span):
+    return codes.astype(np.int64) * span + (seconds - origin)
+
+
+def order_ranges(visit_codes, visit_seconds, order_codes, order_seconds, lookback=None):
+    """Границы [lo, hi) посещений каждого заказа в visits, упорядоченных по (uid, время).
+
+    Посещения учитываются до момента заказа включительно, а с lookback -
+    не раньше чем за lookback секунд до него.
+    """
+    origin = min(visit_seconds.min(), order_seconds.min())
+    span = max(visit_seconds.max(), order_seconds.max()) - origin + 1
+    if lookback is not None:
+        origin -= lookback
+        span += lookback
+    n_users = max(visit_codes.max(), order_codes.max()) + 1
+    if n_users > np.iinfo(np.int64).max // span:
+        raise OverflowError('составной ключ (uid, секунды) не помещается в int64')
+    keys = _composite(visit_codes, visit_seconds, origin, span)
+    hi = np.searchsorted(keys, _composite(order_codes, order_seconds, origin, span), side='right')
+    if lookback is None:
+        lo = np.searchsorted(keys, order_codes.astype(np.int64) * span, side='left')
+    else:
+        lo = np.searchsorted(keys, _composite(order_codes, order_seconds - lookback, origin, span), side='left')
+    return lo, hi
+
+
+def touch_weights(model, offsets, counts, ages=None, half_life=DEFAULT_HALF_LIFE):
+    """Веса касаний одного или нескольких заказов.
+
+    offsets - номер касания внутри заказа, counts - число касаний заказа
+    (для каждого касания), ages - давность касания в секундах (для time_decay).
+    """
+    if model == 'linear':
+        return 1.0 / counts
+    if model == 'position':
+        weights = np.where(counts == 1, 1.0, 0.5)
+        ends = (offsets == 0) | (offsets == counts - 1)
+        many = counts > 2
+        weights = np.where(many & ends, POSITION_ENDS, weights)
+        middle = many & ~ends
+        weights[middle] = (1 - 2 * POSITION_ENDS) / (counts[middle] - 2)
+        return weights
+    if model == 'time_decay':
+        return np.exp2(-ages / pd.Timedelta(half_life).total_seconds())
+    raise ValueError('model должна быть одной из {}, получено {!r}'.format(MODELS, model))
+
+
+def _expand(lo, hi):
+    """Позиции посещений и номер заказа для каждого касания заказов с диапазонами [lo, hi)."""
+    counts = hi - lo
+    owners = np.repeat(np.arange(len(lo)), counts)
+    starts = np.cumsum(counts) - counts
+    offsets = np.arange(counts.sum()) - np.repeat(starts, counts)
+    return owners, offsets, lo[owners] + offsets, counts[owners]
+
+
+def _chunks(counts, budget):
+    """Границы порций заказов, в каждой не больше budget касаний (или один заказ)."""
+    bounds = [0]
+    total = np.cumsum(counts)
+    while bounds[-1] < len(counts):
+        done = total[bounds[-1] - 1] if bounds[-1] else 0
+        stop = np.searchsorted(total, done + budget, side='right')
+        bounds.append(max(stop, bounds[-1] + 1))
+    return bounds
+
+
+def attribute(visits, orders, model='linear', lookback=None, half_life=DEFAULT_HALF_LIFE,
+              touch_budget=DEFAULT_TOUCH_BUDGET):
+    """Распределяет выручку заказов и покупателей по источникам посещений.
+
+    visits и orders должны содержать uid_index (см. uids.attach_uid_index).
+    Покупатель распределяется по касаниям своего первого заказа. Заказы
+    без посещений до них (и все заказы при пустом visits) попадают в
+    unattributed_revenue.
+    """
+    if model not in MODELS:
+        raise ValueError('model должна быть одной из {}, получено {!r}'.format(MODELS, model))
+    if not len(visits) or not len(orders):
+        return Attribution(
+            pd.DataFrame({'source_id': np.zeros(0, dtype=np.int64), 'revenue': np.zeros(0), 'buyers': np.zeros(0)}),
+            pd.DataFrame({'source_id': np.zeros(0, dtype=np.int64), 'order_month': month_start([]),
+                          'revenue': np.zeros(0)}),
+            pd.DataFrame({'source_id': np.zeros(0, dtype=np.int64), 'first_order_dt': day_start([]),
+                          'n_buyers': np.zeros(0)}),
+            orders['revenue'].sum(),
+        )
+    lookback = None if lookback is None else int(pd.Timedelta(lookback).total_seconds())
+
+    visit_codes = visits[UID_INDEX].to_numpy()
+    visit_seconds = _seconds(visits['visit_start'])
+    order = np.lexsort((visit_seconds, visit_codes))
+    visit_codes, visit_seconds = visit_codes[order], visit_seconds[order]
+    visit_sources = visits['source_id'].to_numpy()[order]
+
+    order_codes = orders[UID_INDEX].to_numpy()
+    order_seconds = _seconds(orders['order_date'])
+    order = np.lexsort((order_seconds, order_codes))
+    order_codes, order_seconds = order_codes[order], order_seconds[order]
+    revenue = orders['revenue'].to_numpy()[order]
+    #первый заказ пользователя - первая строка его группы
+    first_order = np.ones(len(order_codes), dtype=bool)
+    first_order[1:] = order_codes[1:] != order_codes[:-1]
+
+    lo, hi = order_ranges(visit_codes, visit_seconds, order_codes, order_seconds, lookback)
+    counts = hi - lo
+    n_sources = int(visit_sources.max()) + 1
+    order_months = month_index(order_seconds.astype('datetime64[s]'))
+    order_days = order_seconds // 86400
+    month_origin = order_months.min()
+    day_origin = order_days.min()
+    n_months = order_months.max() - month_origin + 1
+    n_days = order_days.max() - day_origin + 1
+
+    source_revenue = np.zeros(n_sources)
+    source_buyers = np.zeros(n_sources)
+    month_revenue = np.zeros(n_sources * n_months)
+    daily_buyers = np.zeros(n_sources * n_days)
+    bounds = _chunks(counts, touch_budget)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        owners, offsets, positions, touch_counts = _expand(lo[start:stop], hi[start:stop])
+        owners += start
+        ages = (order_seconds[owners] - visit_seconds[positions]).astype(np.float64)
+        weights = touch_weights(model, offsets, touch_counts, ages, half_life)
+        if model == 'time_decay':
+            weights /= np.bincount(owners - start, weights=weights, minlength=stop - start)[owners - start]
+        sources = visit_sources[positions].astype(np.int64)
+        credited = weights * revenue[owners]
+        source_revenue += np.bincount(sources, weights=credited, minlength=n_sources)
+        month_revenue += np.bincount(sources * n_months + order_months[owners] - month_origin,
+                                     weights=credited, minlength=n_sources * n_months)
+        buyer = first_order[owners]
+        source_buyers += np.bincount(sources[buyer], weights=weights[buyer], minlength=n_sources)
+        daily_buyers += np.bincount(sources[buyer] * n_days + order_days[owners][buyer] - day_origin,
+                                    weights=weights[buyer], minlength=n_sources * n_days)
+
+    present = np.flatnonzero((source_revenue != 0) | (source_buyers != 0))
+    by_source = pd.DataFrame({
+        'source_id': present,
+        'revenue': source_revenue[present],
+        'buyers': source_buyers[present],
+    })
+    cells = np.flatnonzero(month_revenue)
+    by_month = pd.DataFrame({
+        'source_id': cells // n_months,
+        'order_month': month_start(cells % n_months + month_origin),
+        'revenue': month_revenue[cells],
+    })
+    cells = np.flatnonzero(daily_buyers)
+    buyers_daily = pd.DataFrame({
+        'source_id': cells // n_days,
+        'first_order_dt': day_start(cells % n_days + day_origin),
+        'n_buyers': daily_buyers[cells],
+    })
+    return Attribution(by_source, by_month, buyers_daily, revenue[counts == 0].sum())
+
+
+def cac_romi(attribution, costs):
+    """CAC и ROMI по источникам на основе атрибутированных покупателей и выручки.
+
+    costs_per_source - сумма расходов источника; cac_mean - CAC ноутбука:
+    среднее по дням отношения расходов дня к атрибутированным новым
+    покупателям этого дня (дни без покупателей или без расходов не
+    учитываются); cac_total - все расходы источника на всех его
+    атрибутированных покупателей; romi - атрибутированная выручка на
+    единицу расходов. cac_mean и cac_total различаются, когда расходы и
+    покупатели распределены по дням неравномерно.
+    """
+    costs_per_source = costs.groupby('source_id')['costs'].sum().rename('costs_per_source')
+    daily = attribution.buyers_daily.merge(costs, left_on=['source_id', 'first_order_dt'],
+                                           right_on=['source_id', 'cost_date'])
+    daily['costs_per_buyer'] = daily['costs'] / daily['n_buyers']
+    cac_mean = daily.groupby('source_id')['costs_per_buyer'].mean().rename('cac_mean')
+    report = attribution.by_source.set_index('source_id').join(costs_per_source, how='outer').join(cac_mean)
+    report['cac_total'] = report['costs_per_source'] / report['buyers']
+    report['romi'] = report['revenue'] / report['costs_per_source']
+    return report.reset_index()
@@ -0,0 +1,147 @@
+# coding: utf-8
+"""Расчет метрик посещаемости для логов visits, не помещающихся в память.
+
+Первый проход читает CSV порциями и сразу копит то, что складывается по
+порциям: гистограмму длительности сессий (sessions.DurationHistogram с
+ограниченным числом корзин; отрицательные длительности только
+подсчитываются) и число посещений по дням. Пары (uid, день)
+раскладываются по файлам-корзинам по хешу uid. Второй проход читает по
+одной корзине: все посещения пользователя лежат в одной корзине, поэтому
+DAU/WAU/MAU и матрица удержания по корзинам точные и просто суммируются.
+Размер порции и число корзин выводятся из бюджета памяти.
+"""
+
+import math
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .activity import build_activity, unique_pairs
+from .cohorts import cohort_matrix, first_period, retention_from_users
+from .loader import iter_chunks, source_path
+from .periods import day_index, day_start, month_of_day, month_start, week_of_day, week_start
+from .sessions import DurationHistogram, durations
+from .sketch import hash_uids
+
+
+DEFAULT_MEMORY_BUDGET = 512 * 2 ** 20
+
+#оценки занимаемой памяти на строку: при разборе CSV и во втором проходе
+CSV_ROW_BYTES = 400
+BUCKET_ROW_BYTES = 96
+#средний размер строки visits_log.csv в байтах, для оценки числа строк
+CSV_LINE_BYTES = 80
+
+OutOfCoreVisits = namedtuple(
+    'OutOfCoreVisits',
+    ['activity', 'active_users', 'retention_pivot', 'durations', 'daily_visits', 'n_users', 'n_visits'],
+)
+SessionStats = namedtuple('SessionStats', ['mean', 'median', 'mode'])
+
+
+def plan(path, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Размер порции CSV и число корзин для файла path при заданном бюджете."""
+    chunksize = max(1, memory_budget // CSV_ROW_BYTES)
+    rows = os.path.getsize(path) // CSV_LINE_BYTES + 1
+    n_buckets = max(1, math.ceil(rows * BUCKET_ROW_BYTES / memory_budget))
+    return chunksize, n_buckets
+
+
+def _bucket_paths(directory, bucket):
+    return (os.path.join(directory, '{}.uid'.format(bucket)),
+            os.path.join(directory, '{}.day'.format(bucket)))
+
+
+def _spill(directory, n_buckets, uids, days):
+    buckets = (hash_uids(uids) % np.uint64(n_buckets)).astype(np.int64)
+    order = np.argsort(buckets, kind='stable')
+    buckets, uids, days = buckets[order], uids[order], days[order]
+    bounds = np.searchsorted(buckets, np.arange(n_buckets + 1))
+    for bucket in range(n_buckets):
+        start, stop = bounds[bucket], bounds[bucket + 1]
+        if start == stop:
+            continue
+        uid_path, day_path = _bucket_paths(directory, bucket)
+        with open(uid_path, 'ab') as target:
+            uids[start:stop].tofile(target)
+        with open(day_path, 'ab') as target:
+            days[start:stop].tofile(target)
+
+
+def _read_bucket(directory, bucket):
+    uid_path, day_path = _bucket_paths(directory, bucket)
+    if not os.path.exists(uid_path):
+        return None, None
+    return np.fromfile(uid_path, dtype=np.uint64), np.fromfile(day_path, dtype=np.int64)
+
+
+def _add_counts(total, periods):
+    values, counts = np.unique(periods, return_counts=True)
+    return total.add(pd.Series(counts, index=values), fill_value=0)
+
+
+def session_stats(histogram):
+    """Среднее, медиана и мода длительности сессии по гистограмме (sessions.DurationHistogram)."""
+    summary = histogram.total().summary(quantiles=(0.5,)).iloc[0]
+    return SessionStats(mean=summary['mean'], median=summary['q50'], mode=summary['mode'])
+
+
+def visits_out_of_core(path=None, memory_budget=DEFAULT_MEMORY_BUDGET, tmp_dir=None, n_buckets=None):
+    """DAU/WAU/MAU, удержание и длительность сессий по visits в пределах бюджета памяти.
+
+    Результаты совпадают с расчетом в памяти (compute_activity,
+    cohorts.retention_pivot, sessions.duration_histogram), но в памяти
+    одновременно находятся только одна порция CSV или одна корзина.
+    """
+    path = path or source_path('visits')
+    chunksize, planned = plan(path, memory_budget)
+    n_buckets = n_buckets or planned
+
+    histogram = DurationHistogram()
+    daily_visits = pd.Series(dtype='int64')
+    n_visits = 0
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        for chunk in iter_chunks('visits', path, chunksize=chunksize,
+                                 usecols=['uid', 'visit_start', 'visit_end']):
+            days = day_index(chunk['visit_start'])
+            histogram.add(durations(chunk['visit_start'], chunk['visit_end']))
+            daily_visits = _add_counts(daily_visits, days)
+            n_visits += len(chunk)
+            _spill(directory, n_buckets, chunk['uid'].to_numpy(), days)
+            del chunk
+
+        dau = wau = mau = pd.Series(dtype='int64')
+        active_users = pd.DataFrame()
+        n_users = 0
+        for bucket in range(n_buckets):
+            uids, days = _read_bucket(directory, bucket)
+            if uids is None:
+                continue
+            codes, uniques = pd.factorize(uids)
+            n_users += len(uniques)
+            user_codes, user_days = unique_pairs(codes, days)
+            dau = _add_counts(dau, user_days)
+            wau = _add_counts(wau, unique_pairs(user_codes, week_of_day(user_days))[1])
+            month_codes, months = unique_pairs(user_codes, month_of_day(user_days))
+            mau = _add_counts(mau, months)
+            cohorts = first_period(month_codes, months, len(uniques))[month_codes]
+            active_users = active_users.add(cohort_matrix(cohorts, months - cohorts), fill_value=0)
+
+    def dated(series, to_start, name):
+        series = series.sort_index().astype('int64')
+        return pd.Series(series.to_numpy(), index=to_start(series.index.to_numpy().astype(np.int64)), name=name)
+
+    active_users = active_users.fillna(0).astype('int64')
+    return OutOfCoreVisits(
+        activity=build_activity(dated(dau, day_start, 'dau'), dated(wau, week_start, 'wau'),
+                                dated(mau, month_start, 'mau')),
+        active_users=active_users,
+        retention_pivot=retention_from_users(active_users),
+        durations=histogram,
+        daily_visits=dated(daily_visits, day_start, 'visits'),
+        n_users=n_users,
+        n_visits=n_visits,
+    )
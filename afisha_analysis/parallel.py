@@ -0,0 +1,212 @@
+# coding: utf-8
+"""Параллельный расчет по партициям (source_id, месяц когорты) в пуле процессов.
+
+Таблица сортируется по ключу партиции: порядок строк считается
+argsort'ом ключа, и каждый столбец сразу в этом порядке записывается во
+временный .npy файл, без отсортированной копии таблицы. Рабочие
+процессы открывают файлы через np.load(mmap_mode='r') и берут свой
+диапазон строк. Между процессами передаются только пути, границы
+партиции и результат, DataFrame не пиклуется. Категориальные столбцы
+хранятся кодами, категории передаются вместе с описанием таблицы.
+
+На этом построены метрики по источникам (CAC, report_fs, ROMI), которые
+граф метрик считает параллельно с опцией workers.
+"""
+
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .activity import unique_pairs
+from .attribution import NO_SOURCE
+from .cohorts import assign_cohorts, cohort_matrix, retention_from_users
+from .periods import month_index, month_start
+from .romi import romi_report
+from .uids import UID_INDEX, lookup
+
+
+SharedFrame = namedtuple('SharedFrame', ['directory', 'columns', 'categories', 'length'])
+
+
+def share_frame(frame, directory, order=None):
+    """Записывает столбцы frame в .npy файлы каталога directory.
+
+    order - перестановка строк: столбцы пишутся сразу в переставленном
+    порядке через np.take в отображенный в память файл, без копии таблицы.
+    """
+    categories = {}
+    for column in frame.columns:
+        values = frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories[column] = values.cat.categories
+            values = values.cat.codes
+        values = values.to_numpy()
+        if values.dtype == object:
+            raise TypeError('столбец {!r} имеет тип object и не может быть отображен в память'.format(column))
+        path = os.path.join(directory, '{}.npy'.format(column))
+        if order is None:
+            np.save(path, values, allow_pickle=False)
+        else:
+            target = np.lib.format.open_memmap(path, mode='w+', dtype=values.dtype, shape=(len(order),))
+            np.take(values, order, out=target)
+            target.flush()
+            del target
+    return SharedFrame(directory, list(frame.columns), categories, len(frame))
+
+
+def open_frame(shared, start=0, stop=None):
+    """Открывает строки start:stop общей таблицы без копирования столбцов."""
+    data = {}
+    for column in shared.columns:
+        values = np.load(os.path.join(shared.directory, '{}.npy'.format(column)), mmap_mode='r')[start:stop]
+        if column in shared.categories:
+            values = pd.Categorical.from_codes(values, shared.categories[column])
+        data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _run(func, key, parts):
+    return key, func(*[open_frame(shared, start, stop) for shared, start, stop in parts])
+
+
+def map_partitions(func, frame, by, columns=None, max_workers=None, tmp_dir=None):
+    """Применяет func к каждой партиции frame по столбцу by в пуле процессов.
+
+    func должна быть функцией верхнего уровня модуля (ее пиклует пул) и
+    принимать DataFrame партиции. frame может быть списком таблиц с общим
+    столбцом by: тогда func получает партиции всех таблиц с одним ключом
+    (пустые, если ключа в таблице нет). columns ограничивает столбцы,
+    которые отображаются в память (для списка - список списков).
+    Возвращает словарь {ключ партиции: результат} по возрастанию ключей.
+    """
+    frames = list(frame) if isinstance(frame, (list, tuple)) else [frame]
+    if columns is None:
+        columns = [None] * len(frames)
+    elif not isinstance(frame, (list, tuple)):
+        columns = [columns]
+    sorted_keys = []
+    orders = []
+    for table in frames:
+        keys = table[by].to_numpy()
+        order = np.argsort(keys, kind='stable')
+        orders.append(order)
+        sorted_keys.append(keys[order])
+    values = np.unique(np.concatenate(sorted_keys))
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        bounds = []
+        shared = []
+        for position, (table, order, keys, names) in enumerate(zip(frames, orders, sorted_keys, columns)):
+            target = os.path.join(directory, str(position))
+            os.makedirs(target)
+            shared.append(share_frame(table if names is None else table[names], target, order))
+            bounds.append((np.searchsorted(keys, values, side='left'), np.searchsorted(keys, values, side='right')))
+        del orders, sorted_keys
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(_run, func, key, [(table, int(starts[index]), int(stops[index]))
+                                              for table, (starts, stops) in zip(shared, bounds)])
+                for index, key in enumerate(values.tolist())
+            ]
+            return dict(future.result() for future in futures)
+
+
+def _cohort_row(part):
+    """Число уникальных пользователей когорты по месяцам жизни."""
+    _, months = unique_pairs(part['code'].to_numpy(), part['month'].to_numpy())
+    lifetime = months - part['cohort'].to_numpy()[0]
+    return np.bincount(lifetime)
+
+
+def active_users_matrix(ids, times, max_workers=None, tmp_dir=None):
+    """Параллельный аналог cohorts.active_users_matrix: по процессу на когорту."""
+    cohorts = assign_cohorts(ids, times)
+    frame = pd.DataFrame({
+        'code': cohorts.codes,
+        'month': cohorts.months,
+        'cohort': cohorts.first_months[cohorts.codes],
+    })
+    rows = map_partitions(_cohort_row, frame, 'cohort', max_workers=max_workers, tmp_dir=tmp_dir)
+    if not rows:
+        return pd.DataFrame()
+    cohort = np.concatenate([np.full(len(row), key) for key, row in rows.items()])
+    lifetime = np.concatenate([np.arange(len(row)) for row in rows.values()])
+    weights = np.concatenate(list(rows.values())).astype(np.float64)
+    return cohort_matrix(cohort, lifetime, weights).astype(np.int64)
+
+
+def retention_pivot(ids, times, drop_first=True, max_workers=None, tmp_dir=None):
+    """Параллельный аналог cohorts.retention_pivot."""
+    users = active_users_matrix(ids, times, max_workers=max_workers, tmp_dir=tmp_dir)
+    return retention_from_users(users, drop_first)
+
+
+#метрики по источникам: партиция - source_id, результаты склеиваются по возрастанию source_id
+
+def _concat(parts, columns):
+    frames = [part for part in parts.values() if len(part)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _cac_part(daily, costs):
+    cac = daily.merge(costs, left_on=['source_id', 'first_order_dt'], right_on=['source_id', 'cost_date'])
+    cac['costs_per_buyer'] = cac['costs'] / cac['n_buyers']
+    return cac
+
+
+def cac_by_source(daily, costs, max_workers=None, tmp_dir=None):
+    """Параллельный аналог узла cac: расходы на покупателя по источнику и дню первой покупки."""
+    parts = map_partitions(_cac_part, [daily, costs], 'source_id', max_workers=max_workers, tmp_dir=tmp_dir)
+    return _concat(parts, list(daily.columns) + [column for column in costs.columns if column != 'source_id']
+                   + ['costs_per_buyer'])
+
+
+def _report_fs_part(users, orders):
+    if not len(orders):
+        return orders
+    revenue = orders.groupby(month_start(month_index(orders['order_date'].to_numpy())))['revenue'].sum()
+    return pd.DataFrame({
+        'source_id': np.int64(orders['source_id'].iloc[0]),
+        'n_visits': len(users),
+        'order_month': revenue.index,
+        'revenue': revenue.to_numpy(),
+    })
+
+
+def report_fs_by_source(user_index, orders, max_workers=None, tmp_dir=None):
+    """Параллельный аналог узла report_fs: размер источника, выручка по месяцам заказа и LTV.
+
+    Посетители и заказы делятся по источнику пользователя (заказу источник
+    назначается по uid_index); пользователи без источника не учитываются.
+    """
+    sources = user_index['source'].to_numpy()
+    users = pd.DataFrame({'source_id': sources[sources != NO_SOURCE]})
+    order_sources = lookup(sources, orders[UID_INDEX].to_numpy())
+    known = order_sources != NO_SOURCE
+    purchases = pd.DataFrame({
+        'source_id': order_sources[known],
+        'order_date': orders['order_date'].to_numpy()[known],
+        'revenue': orders['revenue'].to_numpy()[known],
+    })
+    parts = map_partitions(_report_fs_part, [users, purchases], 'source_id', max_workers=max_workers,
+                           tmp_dir=tmp_dir)
+    report = _concat(parts, ['source_id', 'n_visits', 'order_month', 'revenue'])
+    report['ltv'] = report['revenue'] / report['n_visits']
+    return report
+
+
+def _romi_part(report_fs, costs):
+    return romi_report(report_fs, costs) if len(report_fs) else report_fs
+
+
+def romi_by_source(report_fs, costs, max_workers=None, tmp_dir=None):
+    """Параллельный аналог romi.romi_report: расходы, CAC и ROMI по партициям source_id."""
+    parts = map_partitions(_romi_part, [report_fs, costs[['source_id', 'cost_date', 'costs']]], 'source_id',
+                           max_workers=max_workers, tmp_dir=tmp_dir)
+    return _concat(parts, list(report_fs.columns) + ['cost_month', 'costs', 'cac_per_source_new', 'romi'])
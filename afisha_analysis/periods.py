@@ -0,0 +1,64 @@
+# coding: utf-8
+"""Целочисленные индексы дней, недель и месяцев для векторных расчетов.
+
+День - число суток от 1970-01-01, неделя начинается с понедельника,
+месяц - число месяцев от января 1970 года. С такими индексами когорты и
+временные корзины считаются арифметикой над массивами, без datetime-столбцов.
+
+Здесь же границы отчетных периодов, общие для графа метрик и хранилища.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+#граница полугодового периода для LTV и частоты покупок, как в ноутбуке
+HALF_YEAR_END = '2017-12-01'
+#1970-01-01 - четверг, сдвиг на 3 дня выравнивает недели по понедельникам
+_WEEK_SHIFT = 3
+
+
+def _datetime64(values):
+    if isinstance(values, (pd.Series, pd.Index)):
+        values = values.to_numpy()
+    return np.asarray(values, dtype='datetime64[ns]')
+
+
+def day_index(values):
+    """Номер дня для массива дат."""
+    return _datetime64(values).astype('datetime64[D]').astype(np.int64)
+
+
+def week_index(values):
+    """Номер недели (с понедельника) для массива дат."""
+    return week_of_day(day_index(values))
+
+
+def week_of_day(days):
+    """Номер недели для массива номеров дней."""
+    return (np.asarray(days, dtype=np.int64) + _WEEK_SHIFT) // 7
+
+
+def month_index(values):
+    """Номер месяца для массива дат."""
+    return _datetime64(values).astype('datetime64[M]').astype(np.int64)
+
+
+def month_of_day(days):
+    """Номер месяца для массива номеров дней."""
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def day_start(days):
+    """Даты начала дней по их номерам."""
+    return pd.DatetimeIndex(np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype('datetime64[ns]'))
+
+
+def week_start(weeks):
+    """Даты понедельников по номерам недель."""
+    return day_start(np.asarray(weeks, dtype=np.int64) * 7 - _WEEK_SHIFT)
+
+
+def month_start(months):
+    """Даты первых чисел месяцев по их номерам."""
+    return pd.DatetimeIndex(np.asarray(months, dtype=np.int64).astype('datetime64[M]').astype('datetime64[ns]'))
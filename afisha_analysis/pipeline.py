@@ -0,0 +1,457 @@
+# coding: utf-8
+"""Граф метрик: именованные узлы, зависимости и мемоизация по отпечаткам входов.
+
+Каждая метрика - узел с именем, списком зависимостей и функцией от их
+значений. Отпечаток исходных таблиц - ключ кеша loader (mtime и размер
+CSV), отпечаток узла - хеш его имени, версии и отпечатков зависимостей.
+Запрос узла вычисляет только его предков; результаты хранятся в памяти и
+на диске (pickle) с вытеснением давно не использованных файлов, когда
+кеш превышает max_bytes. Изменение costs.csv меняет отпечатки только
+узлов, зависящих от расходов.
+
+У каждого узла есть этап (load, clean, activity, ...): с profiler
+(см. profiling.Profiler) вычисление и чтение из кеша каждого узла
+замеряются под именем его этапа.
+
+backend='polars' подменяет узлы ленивыми запросами Polars (см. lazy):
+имена узлов и их результаты те же, что у pandas.
+
+С start и end исходные таблицы ограничиваются по дате и читаются из
+наборов Parquet по месяцам; границы входят в отпечатки таблиц. Например,
+LTV и удержание до periods.HALF_YEAR_END можно считать с
+end=HALF_YEAR_END, не читая более поздние месяцы.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from . import loader
+from .activity import compute_activity
+from .attribution import NO_SOURCE
+from .bootstrap import Bootstrap, user_summary
+from .cohorts import retention_pivot
+from .funnel import SECONDS_PER_DAY, lag_histogram, visits_first_devices
+from .ltv import cube_from_index, ltv_matrix, ltv_report
+from .parallel import cac_by_source, report_fs_by_source, romi_by_source
+from .periods import HALF_YEAR_END, day_index, month_index, month_start
+from .revenue import revenue_cube
+from .rolling import RollingActivity
+from .romi import romi_report
+from .sessions import duration_histogram, durations
+from .uids import UID_INDEX, build_uid_dictionary, encode, extend_uid_dictionary
+from .userindex import (
+    build_user_index,
+    buyers_daily,
+    purchase_frequency,
+    select_buyers,
+    source_revenue,
+    source_sizes,
+)
+
+
+DEFAULT_MAX_BYTES = 2 * 2 ** 30
+SOURCES = ('costs', 'orders', 'visits')
+#корзины гистограмм для графиков: длительность сессии в секундах и дни до первой покупки
+SESSION_EDGES = np.linspace(0, 4000, 61)
+DAYS_TO_ORDER_EDGES = np.arange(76)
+
+Node = namedtuple('Node', ['name', 'deps', 'func', 'version', 'stage', 'persist', 'options'])
+
+NODES = {}
+BACKENDS = ('pandas', 'polars')
+#опции, которые меняют только способ вычисления, а не результат, и не входят в отпечатки
+EXECUTION_OPTIONS = ('workers',)
+
+
+def node(name, deps=(), version=1, stage=None, persist=True, registry=None, options=()):
+    """Регистрирует функцию как узел графа метрик (в NODES или в registry).
+
+    stage по умолчанию - имя узла; persist=False не сохраняет значение
+    узла в дисковый кеш. options - имена опций Pipeline, которые функция
+    принимает именованными аргументами.
+    """
+    def register(func):
+        (NODES if registry is None else registry)[name] = Node(name, tuple(deps), func, version, stage or name,
+                                                               persist, tuple(options))
+        return func
+    return register
+
+
+class DiskCache:
+    """Кеш значений узлов в файлах pickle с LRU-вытеснением по суммарному размеру."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise KeyError(key)
+        with open(path, 'rb') as source:
+            value = pickle.load(source)
+        #время доступа отмечаем явно: atime часто не обновляется файловой системой
+        os.utime(path)
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as target:
+            pickle.dump(value, target, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        self.evict()
+
+    def evict(self):
+        """Удаляет давно не использованные файлы, пока кеш больше max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class Pipeline:
+    """Вычисляет узлы графа по запросу с мемоизацией в памяти и на диске.
+
+    cache_dir=None отключает дисковый кеш, profiler - замеры узлов,
+    backend - 'pandas' или 'polars'. start и end ограничивают исходные
+    таблицы строками с датой в [start, end): таблицы читаются из наборов
+    по месяцам (loader.load_partitioned) только за нужные месяцы.
+    options - опции узлов, например workers (процессов для метрик по
+    источникам), margin_rate (доля маржи в LTV) или approx_error
+    (приближенные DAU/WAU/MAU через HyperLogLog);
+    опции, влияющие на результат, входят в отпечатки узлов, которые их
+    принимают.
+    """
+
+    def __init__(self, data_dir=loader.DATA_DIR, cache_dir=loader.CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 nodes=None, profiler=None, backend='pandas', start=None, end=None, options=None):
+        if backend not in BACKENDS:
+            raise ValueError('backend должен быть одним из {}, получено {!r}'.format(BACKENDS, backend))
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.start = None if start is None else pd.Timestamp(start)
+        self.end = None if end is None else pd.Timestamp(end)
+        if nodes is None and backend == 'polars':
+            from . import lazy
+            nodes = lazy.NODES
+        self.nodes = NODES if nodes is None else nodes
+        self.profiler = profiler
+        self.options = {key: value for key, value in (options or {}).items() if value is not None}
+        self.disk = None if cache_dir is None else DiskCache(os.path.join(cache_dir, 'nodes'), max_bytes)
+        self.memory = {}
+        self.fingerprints = {}
+
+    def fingerprint(self, name):
+        """Отпечаток узла: зависит только от его предков."""
+        if name in self.fingerprints:
+            return self.fingerprints[name]
+        if name in SOURCES:
+            digest = loader.cache_key(name, loader.source_path(name, self.data_dir))
+            if self.start is not None or self.end is not None:
+                digest = '{}-{}-{}'.format(digest, self.start, self.end)
+        else:
+            spec = self.nodes[name]
+            parts = [name, str(spec.version)] + [self.fingerprint(dep) for dep in spec.deps]
+            parts += ['{}={!r}'.format(option, value) for option, value in sorted(self._options(spec).items())
+                      if option not in EXECUTION_OPTIONS]
+            if self.backend != 'pandas':
+                parts.insert(0, self.backend)
+            digest = hashlib.sha1('|'.join(parts).encode()).hexdigest()
+        self.fingerprints[name] = digest
+        return digest
+
+    def get(self, name):
+        """Значение узла name; вычисляются только отсутствующие в кеше предки."""
+        key = self.fingerprint(name)
+        if key in self.memory:
+            return self.memory[key]
+        bounded = self.start is not None or self.end is not None
+        if name in SOURCES and self.backend == 'polars':
+            from .lazy import scan_source
+            value = self._measure('load', name, scan_source,
+                                  [name, self.data_dir, self.cache_dir, self.start, self.end])
+        elif name in SOURCES and bounded:
+            value = self._measure('load', name, loader.load_partitioned,
+                                  [name, self.start, self.end, None, self.data_dir, self.cache_dir])
+        elif name in SOURCES:
+            value = self._measure('load', name, loader.load_source, [name, self.data_dir, self.cache_dir])
+        else:
+            value = self._cached(name, key)
+        self.memory[key] = value
+        return value
+
+    def _measure(self, stage, name, func, args, cached=False):
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.measure(stage, name, func, args, cached)
+
+    def _options(self, spec):
+        return {option: self.options[option] for option in spec.options if option in self.options}
+
+    def _cached(self, name, key):
+        spec = self.nodes[name]
+        persist = self.disk is not None and spec.persist
+        if persist:
+            try:
+                return self._measure(spec.stage, name, self.disk.get, ['{}-{}'.format(name, key)], cached=True)
+            except (KeyError, EOFError, pickle.UnpicklingError):
+                pass
+        #зависимости вычисляются до замера, чтобы время узла не включало их время
+        args = [self.get(dep) for dep in spec.deps]
+        value = self._measure(spec.stage, name, functools.partial(spec.func, **self._options(spec)), args)
+        if persist:
+            self.disk.put('{}-{}'.format(name, key), value)
+        return value
+
+    def upstream(self, name):
+        """Имена узлов, от которых зависит name (включая его самого), в порядке вычисления."""
+        order = []
+
+        def visit(current):
+            if current in order:
+                return
+            for dep in ([] if current in SOURCES else self.nodes[current].deps):
+                visit(dep)
+            order.append(current)
+
+        visit(name)
+        return order
+
+
+#исходные таблицы с плотным индексом пользователей: индексы посетителей - по словарю одних visits,
+#покупатели без посещений дописываются после них, поэтому узлы только по посещениям не зависят от orders
+
+@node('visit_uids', deps=('visits',), stage='clean')
+def _visit_uids(visits):
+    return build_uid_dictionary(visits['uid'])
+
+
+@node('uid_dictionary', deps=('visit_uids', 'orders'), stage='clean')
+def _uid_dictionary(visit_uids, orders):
+    return extend_uid_dictionary(visit_uids, orders['uid'])
+
+
+@node('visits_clean', deps=('visits', 'visit_uids'), stage='clean')
+def _visits_clean(visits, dictionary):
+    return visits.assign(**{UID_INDEX: encode(dictionary, visits['uid'].to_numpy())})
+
+
+@node('orders_clean', deps=('orders', 'uid_dictionary'), stage='clean')
+def _orders_clean(orders, dictionary):
+    return orders.assign(
+        **{UID_INDEX: encode(dictionary, orders['uid'].to_numpy())},
+        order_month=month_start(month_index(orders['order_date'])),
+    )
+
+
+@node('user_index', deps=('visits_clean', 'orders_clean', 'uid_dictionary'), stage='conversion')
+def _user_index(visits, orders, dictionary):
+    return build_user_index(visits, orders, dictionary)
+
+
+#посещаемость и удержание
+
+@node('activity', deps=('visits',), stage='activity', options=('approx_error',))
+def _activity(visits, approx_error=None):
+    return compute_activity(visits, error=approx_error)
+
+
+@node('rolling_activity', deps=('visits_clean',), stage='activity')
+def _rolling_activity(visits):
+    state = RollingActivity()
+    state.update(visits[UID_INDEX].to_numpy(), day_index(visits['visit_start']))
+    return state.frame()
+
+
+@node('dau', deps=('activity',), stage='activity')
+def _dau(activity):
+    return activity.dau
+
+
+@node('wau', deps=('activity',), stage='activity')
+def _wau(activity):
+    return activity.wau
+
+
+@node('mau', deps=('activity',), stage='activity')
+def _mau(activity):
+    return activity.mau
+
+
+@node('session_duration', deps=('visits',), version=2, stage='sessions')
+def _session_duration(visits):
+    return pd.Series(durations(visits['visit_start'], visits['visit_end']), index=visits.index)
+
+
+@node('session_histogram', deps=('visits',), stage='sessions')
+def _session_histogram(visits):
+    return duration_histogram([visits], by=('device', 'source_id'))
+
+
+@node('session_stats', deps=('session_histogram',), stage='sessions')
+def _session_stats(histogram):
+    return histogram.summary()
+
+
+@node('session_duration_bins', deps=('session_histogram',), stage='sessions')
+def _session_duration_bins(histogram):
+    return histogram.binned(SESSION_EDGES)
+
+
+@node('retention_pivot', deps=('visits',), stage='retention')
+def _retention_pivot(visits):
+    return retention_pivot(visits['uid'], visits['visit_start'])
+
+
+#электронная коммерция
+
+@node('buyers', deps=('user_index',), stage='conversion')
+def _buyers(user_index):
+    return select_buyers(user_index)
+
+
+@node('days_to_first_order', deps=('buyers',), stage='conversion')
+def _days_to_first_order(buyers):
+    return buyers['days_to_first_order'].mean()
+
+
+@node('lag_histogram', deps=('user_index', 'visits_clean'), stage='conversion')
+def _lag_histogram(user_index, visits):
+    return lag_histogram(user_index, visits_first_devices(visits, len(user_index)))
+
+
+@node('lag_stats', deps=('lag_histogram',), stage='conversion')
+def _lag_stats(histogram):
+    return histogram.select(('source', 'device')).summary()
+
+
+@node('days_to_first_order_bins', deps=('lag_histogram',), stage='conversion')
+def _days_to_first_order_bins(histogram):
+    return histogram.binned(DAYS_TO_ORDER_EDGES, unit=SECONDS_PER_DAY)
+
+
+@node('orders_mean', deps=('user_index', 'orders_clean'), stage='conversion')
+def _orders_mean(user_index, orders):
+    return purchase_frequency(user_index, orders, before=HALF_YEAR_END)
+
+
+@node('revenue_cube', deps=('orders',), stage='conversion')
+def _revenue_cube(orders):
+    return revenue_cube([orders])
+
+
+@node('order_check', deps=('revenue_cube',), stage='conversion')
+def _order_check(cube):
+    return cube.totals()
+
+
+@node('revenue_daily', deps=('revenue_cube',), stage='conversion')
+def _revenue_daily(cube):
+    return cube.rollup('day')
+
+
+@node('ltv_cube', deps=('user_index', 'orders_clean'), stage='ltv')
+def _ltv_cube(user_index, orders):
+    return cube_from_index(user_index, orders)
+
+
+@node('ltv_report', deps=('ltv_cube',), version=2, stage='ltv', options=('margin_rate',))
+def _ltv_report(cube, margin_rate=1):
+    return ltv_report(cube, margin=margin_rate, cutoff=HALF_YEAR_END)
+
+
+@node('ltv_output', deps=('ltv_report',), stage='ltv')
+def _ltv_output(report):
+    return report.pivot_table(index='first_order_month', columns='age', values='ltv', aggfunc='mean').round()
+
+
+@node('ltv_cumulative', deps=('ltv_cube',), stage='ltv', options=('margin_rate',))
+def _ltv_cumulative(cube, margin_rate=1):
+    return ltv_matrix(cube, margin=margin_rate, cutoff=HALF_YEAR_END)
+
+
+@node('ltv_by_source', deps=('ltv_cube',), stage='ltv', options=('margin_rate',))
+def _ltv_by_source(cube, margin_rate=1):
+    return ltv_matrix(cube, margin=margin_rate, cutoff=HALF_YEAR_END, by_source=True)
+
+
+#маркетинг
+
+@node('costs_per_source', deps=('costs',), stage='cac')
+def _costs_per_source(costs):
+    return costs.groupby('source_id')['costs'].sum()
+
+
+@node('buyers_daily', deps=('user_index',), stage='cac')
+def _buyers_daily(user_index):
+    return buyers_daily(user_index)
+
+
+@node('cac', deps=('buyers_daily', 'costs'), stage='cac', options=('workers',))
+def _cac(daily, costs, workers=None):
+    if workers is not None and workers > 1:
+        return cac_by_source(daily, costs, max_workers=workers)
+    cac = daily.merge(costs, left_on=['source_id', 'first_order_dt'], right_on=['source_id', 'cost_date'])
+    cac['costs_per_buyer'] = cac['costs'] / cac['n_buyers']
+    return cac
+
+
+@node('cac_mean', deps=('cac',), stage='cac')
+def _cac_mean(cac):
+    return cac.groupby('source_id')['costs_per_buyer'].mean()
+
+
+@node('report_fs', deps=('user_index', 'orders_clean'), stage='romi', options=('workers',))
+def _report_fs(user_index, orders, workers=None):
+    if workers is not None and workers > 1:
+        return report_fs_by_source(user_index, orders, max_workers=workers)
+    report = source_sizes(user_index).merge(source_revenue(user_index, orders), on='source_id')
+    report['ltv'] = report['revenue'] / report['n_visits']
+    return report
+
+
+@node('romi_table', deps=('report_fs', 'costs'), stage='romi', options=('workers',))
+def _romi_table(report_fs, costs, workers=None):
+    if workers is not None and workers > 1:
+        return romi_by_source(report_fs, costs, max_workers=workers)
+    return romi_report(report_fs, costs)
+
+
+@node('romi', deps=('romi_table',), stage='romi')
+def _romi(table):
+    return table.groupby('source_id')['romi'].mean().round()
+
+
+@node('user_summary', deps=('user_index', 'visits_clean'), stage='stats')
+def _user_summary(user_index, visits):
+    return user_summary(user_index, visits[UID_INDEX].to_numpy(), visits['visit_start'].to_numpy())
+
+
+@node('source_intervals', deps=('user_summary', 'costs_per_source'), stage='stats')
+def _source_intervals(summary, costs):
+    return Bootstrap(summary[summary['source'] != NO_SOURCE], by='source').intervals(costs=costs)
+
+
+def compute(names, data_dir=loader.DATA_DIR, cache_dir=loader.CACHE_DIR, **options):
+    """Вычисляет узлы names одним Pipeline и возвращает словарь значений."""
+    pipeline = Pipeline(data_dir, cache_dir, **options)
+    return {name: pipeline.get(name) for name in names}
+
@@ -0,0 +1,254 @@
+# coding: utf-8
+"""Замеры этапов расчета: время, процессорное время, память и число строк.
+
+Profiler передается в Pipeline и записывает каждое вычисление узла
+графа (или любой блок кода в profiler.stage(...)): этап и узел, время
+по часам и процессорное время, пик памяти Python (tracemalloc) за время
+узла, прирост пика RSS за время узла и число строк на входе и выходе.
+Зависимости узла вычисляются до начала замера, поэтому записи не
+вкладываются друг в друга и их время складывается.
+
+Пик RSS в Linux сбрасывается перед узлом записью "5" в
+/proc/self/clear_refs и читается как VmHWM из /proc/self/status после
+него; прирост - этот пик минус RSS в начале узла. ru_maxrss - пик за
+всю жизнь процесса и узлу не принадлежит, поэтому там, где /proc
+недоступен, прирост не записывается (None).
+
+Отчет сохраняется в JSON или в текстовом формате Prometheus. С
+profile=True каждый узел считается под cProfile, и профиль самого
+медленного узла сохраняется в .prof (pstats: snakeviz, gprof2dot,
+flameprof) или в свернутые стеки (формат flamegraph.pl и speedscope,
+как py-spy record --format raw).
+"""
+
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+StageRecord = namedtuple(
+    'StageRecord',
+    ['stage', 'node', 'wall_seconds', 'cpu_seconds', 'traced_peak_bytes', 'peak_rss_delta_bytes',
+     'rows_in', 'rows_out', 'cached'],
+)
+
+#метрики Prometheus: поле записи, тип и описание
+PROMETHEUS_METRICS = (
+    ('wall_seconds', 'gauge', 'Время вычисления узла по часам'),
+    ('cpu_seconds', 'gauge', 'Процессорное время вычисления узла'),
+    ('traced_peak_bytes', 'gauge', 'Пик памяти Python за время узла (tracemalloc)'),
+    ('peak_rss_delta_bytes', 'gauge', 'Прирост пика RSS за время узла относительно RSS в его начале'),
+    ('rows_in', 'gauge', 'Строк во входных таблицах узла'),
+    ('rows_out', 'gauge', 'Строк в результате узла'),
+)
+PROMETHEUS_PREFIX = 'afisha_stage_'
+
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def _status_bytes(field):
+    """Поле /proc/self/status в байтах (там оно в килобайтах); None без /proc."""
+    try:
+        with open(PROC_STATUS) as source:
+            for line in source:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Сбрасывает пик RSS процесса (VmHWM) до текущего RSS; False, если это невозможно."""
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as target:
+            target.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (VmRSS) или None."""
+    return _status_bytes('VmRSS')
+
+
+def peak_rss():
+    """Пик RSS процесса в байтах с последнего reset_peak_rss (VmHWM) или None."""
+    return _status_bytes('VmHWM')
+
+
+def count_rows(value):
+    """Число строк таблицы, серии или массива; для остальных значений None."""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+class Profiler:
+    """Накопитель замеров этапов.
+
+    trace_memory=False отключает tracemalloc (он замедляет расчет в
+    несколько раз), profile=True включает cProfile для каждого узла.
+    """
+
+    def __init__(self, trace_memory=True, profile=False):
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.records = []
+        self.slowest = None
+
+    @contextmanager
+    def stage(self, stage, node=None, rows_in=None, cached=False):
+        """Замеряет блок кода; число строк результата задается через result['rows_out']."""
+        result = {'rows_out': None}
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile() if self.profile else None
+        rss = current_rss() if reset_peak_rss() else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield result
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            traced_peak = None
+            if self.trace_memory:
+                traced_peak = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+            peak = None if rss is None else peak_rss()
+            rss_delta = None if peak is None else peak - rss
+            record = StageRecord(stage, node or stage, wall, cpu, traced_peak, rss_delta,
+                                 rows_in, result['rows_out'], cached)
+            self.records.append(record)
+            if profile is not None and (self.slowest is None or wall > self.slowest[0].wall_seconds):
+                self.slowest = (record, profile)
+
+    def measure(self, stage, node, func, args, cached=False):
+        """Вызывает func(*args) под замером и возвращает ее результат."""
+        rows = [count_rows(arg) for arg in args]
+        rows_in = sum(row for row in rows if row is not None) if any(row is not None for row in rows) else None
+        with self.stage(stage, node, rows_in, cached) as result:
+            value = func(*args)
+            result['rows_out'] = count_rows(value)
+        return value
+
+    def frame(self):
+        """Записи по узлам в виде таблицы."""
+        return pd.DataFrame(self.records, columns=StageRecord._fields)
+
+    def summary(self):
+        """Итоги по этапам: время складывается, пики памяти - максимум."""
+        return self.frame().groupby('stage', sort=False).agg(
+            wall_seconds=('wall_seconds', 'sum'),
+            cpu_seconds=('cpu_seconds', 'sum'),
+            traced_peak_bytes=('traced_peak_bytes', 'max'),
+            peak_rss_delta_bytes=('peak_rss_delta_bytes', 'max'),
+            nodes=('node', 'size'),
+        )
+
+    def to_json(self, path=None):
+        """Отчет в JSON: итоги по этапам и записи по узлам. Без path возвращает строку."""
+        summary = self.summary().reset_index()
+        report = {
+            'stages': summary.astype(object).where(summary.notna(), None).to_dict(orient='records'),
+            'nodes': [record._asdict() for record in self.records],
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2, default=float)
+        if path is not None:
+            with open(path, 'w') as target:
+                target.write(text)
+        return text
+
+    def to_prometheus(self, path=None):
+        """Отчет в текстовом формате Prometheus (метки stage и node)."""
+        lines = []
+        for field, kind, description in PROMETHEUS_METRICS:
+            name = PROMETHEUS_PREFIX + field
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for record in self.records:
+                value = getattr(record, field)
+                if value is not None:
+                    lines.append('{}{{stage="{}",node="{}"}} {}'.format(name, record.stage, record.node, value))
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w') as target:
+                target.write(text)
+        return text
+
+    def save(self, path):
+        """Сохраняет отчет: .prom и .txt - формат Prometheus, остальное - JSON."""
+        if path.endswith(('.prom', '.txt')):
+            return self.to_prometheus(path)
+        return self.to_json(path)
+
+    def dump_slowest(self, path):
+        """Сохраняет профиль самого медленного узла и возвращает его запись.
+
+        .prof - двоичный формат pstats, иначе свернутые стеки
+        "f1;f2;f3 микросекунды" по строке на стек вызовов.
+        """
+        if self.slowest is None:
+            raise ValueError('профиль не записан: нужен Profiler(profile=True)')
+        record, profile = self.slowest
+        if path.endswith('.prof'):
+            profile.dump_stats(path)
+        else:
+            with open(path, 'w') as target:
+                for stack, micros in collapsed_stacks(profile):
+                    target.write('{} {}\n'.format(stack, micros))
+        return record
+
+
+def _label(func):
+    filename, line, name = func
+    return '{}:{}:{}'.format(filename, line, name)
+
+
+def collapsed_stacks(profile):
+    """Свернутые стеки из профиля cProfile.
+
+    cProfile хранит только пары вызывающий-вызываемый, поэтому стеки
+    восстанавливаются от корней вниз, а собственное время функции делится
+    между путями пропорционально числу вызовов.
+    """
+    stats = pstats.Stats(profile).stats
+    callees = {}
+    for func, (_, calls, own, _, callers) in stats.items():
+        for caller, (_, caller_calls, _, _) in callers.items():
+            callees.setdefault(caller, []).append((func, caller_calls / max(calls, 1)))
+    roots = [func for func, entry in stats.items() if not entry[4]]
+    result = {}
+
+    def walk(func, stack, share):
+        #пути с пренебрежимо малым общим временем не разворачиваются
+        if func in stack or int(stats[func][3] * share * 1e6) == 0:
+            return
+        stack = stack + (func,)
+        micros = int(stats[func][2] * share * 1e6)
+        if micros:
+            key = ';'.join(_label(item) for item in stack)
+            result[key] = result.get(key, 0) + micros
+        for callee, part in callees.get(func, ()):
+            walk(callee, stack, share * part)
+
+    for root in roots:
+        walk(root, (), 1.0)
+    return sorted(result.items())
@@ -0,0 +1,115 @@
+# coding: utf-8
+"""Скользящие уникальные пользователи за 1, 7 и 30 дней с обновлением по дням.
+
+Для каждого пользователя хранится день последнего посещения (last_seen),
+а для каждого дня - сколько пользователей видели последний раз в этот
+день. Число уникальных за окно w в день d - это число пользователей с
+last_seen в [d - w + 1, d]. При переходе к следующему дню из окна
+уходят пользователи, последний раз видевшие сайт ровно w дней назад, а
+каждый активный пользователь дня добавляется, если его прошлое
+посещение было вне окна. Поэтому день обрабатывается за время,
+пропорциональное числу его посещений, а не длине окна.
+
+В отличие от календарных WAU и MAU (activity) окна здесь скользящие:
+"7 дней по сегодня" и "30 дней по сегодня" для каждого дня.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .activity import encode_uids, unique_pairs
+from .periods import day_index, day_start
+
+
+DEFAULT_WINDOWS = (7, 30)
+#день "никогда не был" для last_seen
+NEVER = np.iinfo(np.int32).min
+
+
+class RollingActivity:
+    """Состояние скользящего расчета: last_seen по плотным кодам пользователей.
+
+    Дни подаются по возрастанию (можно порциями, например по одному дню
+    ежедневно); пропущенные дни без посещений тоже получают строку. Коды
+    пользователей должны быть одними и теми же во всех порциях (например,
+    uids.encode по общему словарю).
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS):
+        self.windows = tuple(sorted(set(windows) | {1}))
+        self.last_seen = np.full(0, NEVER, dtype=np.int32)
+        #число пользователей по дню последнего посещения, с начала self.first_day
+        self.last_counts = np.zeros(0, dtype=np.int64)
+        self.first_day = None
+        self.day = None
+        self.uniques = dict.fromkeys(self.windows, 0)
+        self.rows = []
+
+    def _grow(self, n_users, last_day):
+        if n_users > len(self.last_seen):
+            extra = max(n_users, 2 * len(self.last_seen)) - len(self.last_seen)
+            self.last_seen = np.concatenate([self.last_seen, np.full(extra, NEVER, dtype=np.int32)])
+        needed = last_day - self.first_day + 1
+        if needed > len(self.last_counts):
+            extra = max(needed, 2 * len(self.last_counts)) - len(self.last_counts)
+            self.last_counts = np.concatenate([self.last_counts, np.zeros(extra, dtype=np.int64)])
+
+    def _count_at(self, day):
+        return self.last_counts[day - self.first_day] if day >= self.first_day else 0
+
+    def _advance(self, day, users):
+        """Переход к дню day с уникальными кодами активных в этот день пользователей."""
+        for window in self.windows:
+            self.uniques[window] -= self._count_at(day - window)
+        previous = self.last_seen[users]
+        for window in self.windows:
+            self.uniques[window] += len(users) - int(np.count_nonzero(previous > day - window))
+        seen = previous[previous != NEVER].astype(np.int64) - self.first_day
+        np.subtract.at(self.last_counts, seen, 1)
+        self.last_counts[day - self.first_day] += len(users)
+        self.last_seen[users] = day
+        self.day = day
+        self.rows.append((day,) + tuple(self.uniques[window] for window in self.windows))
+
+    def update(self, codes, days):
+        """Добавляет посещения: codes - плотные коды пользователей, days - номера дней.
+
+        Все дни должны быть не раньше последнего обработанного. Возвращает
+        строки frame() для добавленных дней.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        if not len(codes):
+            return self.frame().iloc[0:0]
+        if self.day is not None and days.min() <= self.day:
+            raise ValueError('дни должны идти после {}, получен {}'.format(self.day, days.min()))
+        user_codes, user_days = unique_pairs(codes, days)
+        order = np.argsort(user_days, kind='stable')
+        user_codes, user_days = user_codes[order], user_days[order]
+        if self.first_day is None:
+            self.first_day = int(user_days[0])
+            self.day = self.first_day - 1
+        self._grow(int(user_codes.max()) + 1, int(user_days[-1]))
+        bounds = np.searchsorted(user_days, np.arange(self.day + 1, user_days[-1] + 2))
+        start = len(self.rows)
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            self._advance(self.day + 1, user_codes[lo:hi])
+        return self.frame().iloc[start:]
+
+    def frame(self):
+        """Таблица по дням: уникальные за каждое окно и sticky factor DAU / уникальные за окно."""
+        rows = np.asarray(self.rows, dtype=np.int64).reshape(-1, len(self.windows) + 1)
+        frame = pd.DataFrame({'dau': rows[:, 1]}, index=pd.Index(day_start(rows[:, 0]), name='period'))
+        for position, window in enumerate(self.windows[1:], start=2):
+            frame['users_{}d'.format(window)] = rows[:, position]
+        for window in self.windows[1:]:
+            frame['sticky_{}d'.format(window)] = frame['dau'] / frame['users_{}d'.format(window)]
+        return frame
+
+
+def rolling_activity(visits, windows=DEFAULT_WINDOWS, uid_column='uid', date_column='visit_start'):
+    """Скользящие DAU, уникальные за окна windows (в днях) и sticky factor по таблице посещений."""
+    codes, _ = encode_uids(visits[uid_column])
+    state = RollingActivity(windows)
+    state.update(codes, day_index(visits[date_column]))
+    return state.frame()
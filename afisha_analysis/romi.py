@@ -0,0 +1,127 @@
+# coding: utf-8
+"""ROMI по источникам и месяцам без перекрестного произведения с дневными расходами.
+
+Раньше выручка по (source_id, order_month) соединялась с дневными расходами
+только по source_id, и каждая строка выручки размножалась на все дни
+расходов источника. Здесь расходы сначала сворачиваются до
+(source_id, месяц), а соединение идет по обоим ключам. Для таблиц, которые
+не помещаются в память, есть потоковое соединение отсортированных порций.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .periods import month_index, month_start
+
+
+KEYS = ['source_id', 'cost_month']
+
+
+def monthly_costs(costs):
+    """Расходы, свернутые до (source_id, cost_month)."""
+    months = month_start(month_index(costs['cost_date']))
+    frame = pd.DataFrame({
+        'source_id': costs['source_id'].to_numpy(),
+        'cost_month': months,
+        'costs': costs['costs'].to_numpy(),
+    })
+    return frame.groupby(KEYS, as_index=False)['costs'].sum()
+
+
+def _add_romi(merged):
+    if 'costs' not in merged:
+        merged['costs'] = np.nan
+    merged['cac_per_source_new'] = merged['costs'] / merged['n_visits']
+    merged['romi'] = merged['ltv'] / merged['cac_per_source_new']
+    return merged
+
+
+def romi_report(report_fs, costs):
+    """Добавляет к report_fs месячные расходы источника, CAC и ROMI.
+
+    report_fs - таблица ноутбука со столбцами source_id, n_visits,
+    order_month, revenue, ltv; costs - дневные расходы из loader.
+    Число строк результата равно числу строк report_fs.
+    """
+    merged = report_fs.merge(
+        monthly_costs(costs),
+        left_on=['source_id', 'order_month'],
+        right_on=KEYS,
+        how='left',
+    )
+    return _add_romi(merged)
+
+
+def iter_monthly_costs(chunks):
+    """Потоково сворачивает дневные расходы до (source_id, cost_month).
+
+    Порции должны быть отсортированы по (source_id, cost_date); последняя
+    группа каждой порции переносится в следующую, пока не станет полной.
+    """
+    carry = None
+    for chunk in chunks:
+        monthly = monthly_costs(chunk)
+        if carry is not None:
+            monthly = pd.concat([carry, monthly]).groupby(KEYS, as_index=False)['costs'].sum()
+        if monthly.empty:
+            continue
+        carry = monthly.iloc[-1:]
+        if len(monthly) > 1:
+            yield monthly.iloc[:-1]
+    if carry is not None:
+        yield carry
+
+
+def _at_least(frame, on, bound):
+    """Маска строк, ключи которых лексикографически не меньше bound."""
+    greater = np.zeros(len(frame), dtype=bool)
+    equal = np.ones(len(frame), dtype=bool)
+    for column, value in zip(on, bound):
+        values = frame[column].to_numpy()
+        greater |= equal & (values > value)
+        equal &= values == value
+    return greater | equal
+
+
+def merge_sorted(left, right, on, how='inner'):
+    """Потоковое соединение двух последовательностей порций, отсортированных по on.
+
+    Для каждой порции left подгружается столько порций right, сколько нужно,
+    чтобы покрыть ее ключи; строки right с меньшими ключами затем
+    отбрасываются. В памяти одновременно находятся одна порция left и
+    перекрывающийся с ней участок right. how - 'inner' или 'left'.
+    """
+    if how not in ('inner', 'left'):
+        raise ValueError("how должен быть 'inner' или 'left', получено {!r}".format(how))
+    right = iter(right)
+    buffer = None
+    exhausted = False
+    for chunk in left:
+        if chunk.empty:
+            continue
+        last = tuple(chunk[on].iloc[-1])
+        while not exhausted and (buffer is None or buffer.empty
+                                 or tuple(buffer[on].iloc[-1]) <= last):
+            following = next(right, None)
+            if following is None:
+                exhausted = True
+            else:
+                buffer = following if buffer is None else pd.concat([buffer, following], ignore_index=True)
+        if buffer is None:
+            if how == 'left':
+                yield chunk
+            continue
+        yield chunk.merge(buffer, on=on, how=how)
+        #строки с ключом last могут понадобиться следующей порции left
+        buffer = buffer[_at_least(buffer, on, last)]
+
+
+def iter_romi_report(report_chunks, cost_chunks):
+    """Потоковый вариант romi_report.
+
+    report_chunks отсортированы по (source_id, order_month), cost_chunks -
+    дневные расходы, отсортированные по (source_id, cost_date).
+    """
+    report_chunks = (chunk.assign(cost_month=chunk['order_month']) for chunk in report_chunks)
+    for merged in merge_sorted(report_chunks, iter_monthly_costs(cost_chunks), on=KEYS, how='left'):
+        yield _add_romi(merged)
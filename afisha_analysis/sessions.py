@@ -0,0 +1,160 @@
+# coding: utf-8
+"""Длительность сессий и их статистика за один проход, пересборка сессий по таймауту.
+
+Длительность считается целыми секундами как разность моментов конца и
+начала (в ноутбуке .dt.seconds отбрасывал дни и заворачивал
+отрицательные значения в сутки). Отрицательные длительности - ошибки
+лога: они не попадают в статистику, а только подсчитываются.
+
+DurationHistogram (histogram.SegmentedHistogram) копит по сегментам
+(например, device x source_id) число сессий, точную сумму секунд и
+гистограмму: по секунде на корзину в пределах суток и логарифмические
+корзины дальше. Гистограммы порций
+складываются, поэтому среднее (точно), мода, медиана и квантили (точно
+в пределах суток) получаются за один проход по порциям.
+
+resessionize заново делит хиты пользователя на сессии: новая сессия
+начинается, если хит начался позже чем через timeout после конца
+предыдущих хитов этого пользователя. iter_sessions делает то же для
+порций, упорядоченных по времени начала.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .histogram import SegmentedHistogram
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+#корзины после суток: [сутки * 2**k, сутки * 2**(k+1)), последняя без верхней границы
+OVERFLOW_BINS = 16
+DEFAULT_TIMEOUT = pd.Timedelta(minutes=30)
+
+
+def _seconds(times):
+    if isinstance(times, (pd.Series, pd.Index)):
+        times = times.to_numpy()
+    return np.asarray(times).astype('datetime64[s]').astype(np.int64)
+
+
+def durations(start, end):
+    """Длительность каждого посещения в целых секундах (с днями и знаком)."""
+    return _seconds(end) - _seconds(start)
+
+
+#значение корзины: секунда для коротких, середина (геометрическая) для длинных
+BIN_VALUES = np.concatenate([
+    np.arange(SECONDS_PER_DAY, dtype=np.float64),
+    SECONDS_PER_DAY * 2.0 ** (np.arange(OVERFLOW_BINS) + 0.5),
+])
+#нижние границы корзин в секундах
+BIN_EDGES = np.concatenate([np.arange(SECONDS_PER_DAY), SECONDS_PER_DAY * 2 ** np.arange(OVERFLOW_BINS)])
+
+
+class DurationHistogram(SegmentedHistogram):
+    """Складываемая гистограмма длительностей сессий в секундах по сегментам."""
+
+    count_name = 'sessions'
+
+    def __init__(self, by=()):
+        super().__init__(BIN_EDGES, by, values=BIN_VALUES)
+
+    def _bins(self, seconds):
+        #по секунде в пределах суток, дальше логарифмические корзины - без поиска по границам
+        bins = seconds.copy()
+        long = seconds >= SECONDS_PER_DAY
+        bins[long] = SECONDS_PER_DAY + np.minimum(
+            np.log2(seconds[long] / SECONDS_PER_DAY).astype(np.int64), OVERFLOW_BINS - 1)
+        return bins
+
+
+def duration_histogram(chunks, by=('device', 'source_id'), start='visit_start', end='visit_end'):
+    """Гистограмма длительностей по порциям visits (одна таблица - список из одной порции)."""
+    histogram = DurationHistogram(by)
+    for chunk in chunks:
+        histogram.add(durations(chunk[start], chunk[end]), chunk)
+    return histogram
+
+
+def _split(codes, starts, ends, timeout):
+    """Порядок хитов по (код, начало), признак начала сессии и накопленный конец сессии."""
+    order = np.lexsort((starts, codes))
+    codes, starts, ends = codes[order], starts[order], np.maximum(ends, starts)[order]
+    if not len(codes):
+        return order, np.zeros(0, dtype=bool), ends
+    #максимум конца внутри пользователя одним проходом: к концу прибавлен сдвиг по коду
+    origin = starts.min()
+    span = ends.max() - origin + 1
+    if codes.max() > np.iinfo(np.int64).max // span:
+        raise OverflowError('составной ключ (uid, секунды) не помещается в int64')
+    shift = codes * span - origin
+    running = np.maximum.accumulate(ends + shift) - shift
+    new = np.ones(len(codes), dtype=bool)
+    new[1:] = (codes[1:] != codes[:-1]) | (starts[1:] - running[:-1] > timeout)
+    return order, new, running
+
+
+def resessionize(uids, starts, ends, timeout=DEFAULT_TIMEOUT):
+    """Номер сессии для каждого хита (в исходном порядке строк)."""
+    codes, _ = pd.factorize(np.asarray(uids))
+    order, new, _ = _split(codes.astype(np.int64), _seconds(starts), _seconds(ends),
+                           int(pd.Timedelta(timeout).total_seconds()))
+    result = np.empty(len(order), dtype=np.int64)
+    result[order] = np.cumsum(new) - 1
+    return result
+
+
+def sessions_from_hits(hits, timeout=DEFAULT_TIMEOUT):
+    """Сессии по хитам: uid, session_start, session_end, hits и источник и устройство первого хита.
+
+    hits - таблица со столбцами uid, session_start, session_end, source_id,
+    device и (необязательно) hits - числом хитов в строке.
+    """
+    codes, _ = pd.factorize(hits['uid'].to_numpy())
+    order, new, running = _split(codes.astype(np.int64), _seconds(hits['session_start']),
+                                 _seconds(hits['session_end']), int(pd.Timedelta(timeout).total_seconds()))
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(order)) - 1
+    weights = hits['hits'].to_numpy() if 'hits' in hits else np.ones(len(hits), dtype=np.int64)
+    rows = order[first]
+    return pd.DataFrame({
+        'uid': hits['uid'].to_numpy()[rows],
+        'session_start': hits['session_start'].to_numpy()[rows],
+        'session_end': running[last].astype('datetime64[s]').astype('datetime64[ns]'),
+        'hits': np.add.reduceat(weights[order], first) if len(first) else np.zeros(0, dtype=np.int64),
+        'source_id': hits['source_id'].to_numpy()[rows],
+        'device': hits['device'].to_numpy()[rows],
+    })
+
+
+def _hits(chunk):
+    return pd.DataFrame({
+        'uid': chunk['uid'].to_numpy(),
+        'session_start': chunk['visit_start'].to_numpy(),
+        'session_end': chunk['visit_end'].to_numpy(),
+        'hits': np.ones(len(chunk), dtype=np.int64),
+        'source_id': chunk['source_id'].to_numpy(),
+        'device': chunk['device'].astype(str).to_numpy(),
+    })
+
+
+def iter_sessions(chunks, timeout=DEFAULT_TIMEOUT):
+    """Потоковая пересборка сессий по порциям visits, упорядоченным по visit_start.
+
+    Сессии, которые уже не могут продолжиться (конец + timeout раньше
+    последнего начала в порции), выдаются сразу, остальные переносятся
+    в следующую порцию как один хит.
+    """
+    timeout = pd.Timedelta(timeout)
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        hits = _hits(chunk) if carry is None else pd.concat([carry, _hits(chunk)], ignore_index=True)
+        sessions = sessions_from_hits(hits, timeout)
+        closed = sessions['session_end'] + timeout < chunk['visit_start'].max()
+        if closed.any():
+            yield sessions[closed].reset_index(drop=True)
+        carry = sessions[~closed]
+    if carry is not None and len(carry):
+        yield carry.reset_index(drop=True)
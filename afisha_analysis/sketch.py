@@ -0,0 +1,152 @@
+# coding: utf-8
+"""Приближенный подсчет уникальных uid (HyperLogLog) по корзинам.
+
+Каждая корзина (день, когорта, источник) хранит массив из 2**precision
+регистров uint8. Регистры разных корзин сливаются поэлементным максимумом,
+поэтому недельные и месячные уникальные получаются слиянием дневных
+скетчей, без повторного прохода по сырым uid. Точность задается
+границей относительной ошибки: стандартная ошибка HLL равна
+1.04 / sqrt(2**precision), и точность выбирается так, чтобы граница была
+не меньше Z_SCORE стандартных ошибок (при 3 оценка выходит за границу
+примерно в 0.3% корзин).
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+DEFAULT_ERROR = 0.01
+#граница ошибки в стандартных ошибках HLL
+Z_SCORE = 3
+
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def precision_for_error(error):
+    """Минимальная точность (число бит индекса), при которой Z_SCORE стандартных ошибок не больше error."""
+    if not 0 < error < 1:
+        raise ValueError('error должна быть в интервале (0, 1), получено {!r}'.format(error))
+    precision = math.ceil(2 * math.log2(Z_SCORE * 1.04 / error))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def hash_uids(uids):
+    """64-битный хеш uid (финализатор splitmix64), векторно."""
+    x = np.asarray(uids).astype(np.uint64, copy=True)
+    with np.errstate(over='ignore'):
+        x += _GOLDEN
+        x ^= x >> np.uint64(30)
+        x *= _MIX_1
+        x ^= x >> np.uint64(27)
+        x *= _MIX_2
+        x ^= x >> np.uint64(31)
+    return x
+
+
+def _register_updates(uids, precision):
+    """Номер регистра и ранг (позиция младшего единичного бита + 1) для каждого uid."""
+    hashed = hash_uids(uids)
+    width = 64 - precision
+    index = (hashed >> np.uint64(width)).astype(np.int64)
+    rest = hashed & np.uint64((1 << width) - 1)
+    #младший единичный бит - степень двойки, log2 от нее в float64 точен
+    lowest = rest & (~rest + np.uint64(1))
+    rank = np.full(len(rest), width + 1, dtype=np.uint8)
+    nonzero = rest != 0
+    rank[nonzero] = np.log2(lowest[nonzero].astype(np.float64)).astype(np.uint8) + 1
+    return index, rank
+
+
+def empty_sketches(n_buckets, precision):
+    """Пустые регистры для n_buckets корзин."""
+    return np.zeros((n_buckets, 1 << precision), dtype=np.uint8)
+
+
+def sketch_buckets(uids, buckets, n_buckets, precision, out=None):
+    """Строит (или дополняет out) скетчи uid по целочисленным корзинам 0..n_buckets-1.
+
+    Передавая один и тот же out для последовательных порций данных,
+    можно набирать скетчи потоково.
+    """
+    if out is None:
+        out = empty_sketches(n_buckets, precision)
+    index, rank = _register_updates(uids, precision)
+    flat = np.asarray(buckets, dtype=np.int64) * (1 << precision) + index
+    np.maximum.at(out.reshape(-1), flat, rank)
+    return out
+
+
+def merge_sketches(sketches, groups, n_groups):
+    """Сливает скетчи строк sketches в n_groups групп по номерам groups."""
+    precision = int(math.log2(sketches.shape[1]))
+    out = empty_sketches(n_groups, precision)
+    np.maximum.at(out, np.asarray(groups, dtype=np.int64), sketches)
+    return out
+
+
+def estimate(sketches):
+    """Оценка числа уникальных значений для каждой строки регистров."""
+    sketches = np.atleast_2d(sketches)
+    m = sketches.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+    raw = alpha * m * m / np.exp2(-sketches.astype(np.float64)).sum(axis=1)
+    zeros = (sketches == 0).sum(axis=1)
+    #при малых значениях точнее линейный подсчет по пустым регистрам
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    result = raw.copy()
+    result[small] = m * np.log(m / zeros[small])
+    return result
+
+
+def approx_unique_counts(uids, keys, error=DEFAULT_ERROR):
+    """Приближенный аналог groupby(keys)['uid'].nunique() для целочисленных ключей."""
+    keys = np.asarray(keys)
+    values, buckets = np.unique(keys, return_inverse=True)
+    sketches = sketch_buckets(uids, buckets, len(values), precision_for_error(error))
+    return pd.Series(estimate(sketches), index=values)
+
+
+def synthetic_visits(n_users=200_000, n_days=120, visits_per_day=5_000, seed=0):
+    """Синтетический лог посещений: uid uint64 и день (номер от 1970-01-01)."""
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, np.iinfo(np.uint64).max, size=n_users, dtype=np.uint64)
+    #часть пользователей заходит чаще: вес по закону Ципфа
+    weights = 1.0 / np.arange(1, n_users + 1) ** 0.8
+    weights /= weights.sum()
+    total = n_days * visits_per_day
+    uids = users[rng.choice(n_users, size=total, p=weights)]
+    days = np.repeat(np.arange(n_days, dtype=np.int64), visits_per_day) + 17318
+    return pd.DataFrame({'uid': uids, 'visit_start': days.astype('datetime64[D]').astype('datetime64[ns]')})
+
+
+def accuracy_benchmark(error=DEFAULT_ERROR, **synthetic):
+    """Сравнивает приближенные DAU/WAU/MAU с точными на синтетических данных.
+
+    Возвращает таблицу с относительной ошибкой по каждому периоду.
+    """
+    from .activity import compute_activity
+
+    visits = synthetic_visits(**synthetic)
+    exact = compute_activity(visits)
+    approx = compute_activity(visits, error=error)
+    frames = []
+    for metric in ('dau', 'wau', 'mau'):
+        frame = pd.DataFrame({
+            'exact': getattr(exact, metric),
+            'approx': getattr(approx, metric),
+        })
+        frame['rel_error'] = (frame['approx'] - frame['exact']).abs() / frame['exact']
+        frame['metric'] = metric
+        frames.append(frame)
+    return pd.concat(frames).rename_axis('period').reset_index()
+
+
+if __name__ == '__main__':
+    result = accuracy_benchmark()
+    print(result.groupby('metric')['rel_error'].describe())
@@ -0,0 +1,301 @@
+# coding: utf-8
+"""Локальное аналитическое хранилище SQLite для costs, orders и visits.
+
+Логи один раз переносятся из CSV в файл SQLite с индексами по uid,
+времени и source_id, и по ним же строится таблица пользователей (первое
+посещение, first-touch источник, первая покупка, число заказов и
+выручка). Даты хранятся целыми числами: секунды от 1970-01-01 и номера
+дня, недели и месяца из periods. У visits есть индексы (day, uid),
+(week, uid) и (month, uid), поэтому DAU/WAU/MAU и месяцы активности
+для удержания читаются из индексов уже упорядоченными по периоду и uid,
+без обращения к строкам таблицы. uid хранится как int64 с тем же
+набором битов, что и uint64.
+
+DAU/WAU/MAU, удержание, LTV, CAC и ROMI считаются запросами к файлу и
+принимают срез: source_id и интервал дат [start, end). Такой срез читает
+только нужные строки по индексам, без загрузки логов целиком.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from . import loader
+from .activity import build_activity
+from .attribution import NO_SOURCE
+from .cohorts import cohort_matrix, retention_from_users
+from .periods import HALF_YEAR_END, day_index, day_start, month_index, month_start, week_of_day, week_start
+from .romi import romi_report
+
+
+#версия схемы и индексов: хранилище с другой версией перезагружается
+SCHEMA_VERSION = 2
+
+TABLES = {
+    'visits': ['uid', 'device', 'source_id', 'start_ts', 'end_ts', 'day', 'week', 'month'],
+    'orders': ['uid', 'ts', 'revenue', 'day', 'month'],
+    'costs': ['source_id', 'day', 'month', 'costs'],
+}
+
+SCHEMA = """
+CREATE TABLE meta (name TEXT PRIMARY KEY, key TEXT NOT NULL);
+CREATE TABLE visits (
+    uid INTEGER NOT NULL, device TEXT, source_id INTEGER NOT NULL,
+    start_ts INTEGER NOT NULL, end_ts INTEGER NOT NULL,
+    day INTEGER NOT NULL, week INTEGER NOT NULL, month INTEGER NOT NULL
+);
+CREATE TABLE orders (
+    uid INTEGER NOT NULL, ts INTEGER NOT NULL, revenue REAL NOT NULL,
+    day INTEGER NOT NULL, month INTEGER NOT NULL
+);
+CREATE TABLE costs (source_id INTEGER NOT NULL, day INTEGER NOT NULL, month INTEGER NOT NULL, costs REAL NOT NULL);
+"""
+
+#индексы создаются после загрузки: так вставка идет быстрее
+INDEXES = """
+CREATE INDEX visits_uid ON visits (uid, start_ts);
+CREATE INDEX visits_start ON visits (start_ts);
+CREATE INDEX visits_source ON visits (source_id, start_ts);
+CREATE INDEX visits_day ON visits (day, uid);
+CREATE INDEX visits_week ON visits (week, uid);
+CREATE INDEX visits_month ON visits (month, uid);
+CREATE INDEX orders_uid ON orders (uid, ts);
+CREATE INDEX orders_ts ON orders (ts);
+CREATE INDEX costs_source ON costs (source_id, day);
+"""
+
+#сводка по пользователям; при равном времени первым считается посещение, загруженное раньше
+USERS = """
+CREATE TABLE users AS
+WITH first_visits AS (
+    SELECT uid, start_ts AS first_ts, source_id AS source
+    FROM (SELECT uid, start_ts, source_id,
+                 ROW_NUMBER() OVER (PARTITION BY uid ORDER BY start_ts, rowid) AS position
+          FROM visits)
+    WHERE position = 1
+),
+buyers AS (
+    SELECT uid, MIN(ts) AS first_order_ts, MIN(day) AS first_order_day, MIN(month) AS first_order_month,
+           COUNT(*) AS order_count, SUM(revenue) AS revenue
+    FROM orders GROUP BY uid
+)
+SELECT f.uid, f.first_ts, f.source, b.first_order_ts, b.first_order_day, b.first_order_month,
+       COALESCE(b.order_count, 0) AS order_count, COALESCE(b.revenue, 0) AS revenue
+FROM first_visits f LEFT JOIN buyers b USING (uid)
+UNION ALL
+SELECT b.uid, NULL, {no_source}, b.first_order_ts, b.first_order_day, b.first_order_month, b.order_count, b.revenue
+FROM buyers b WHERE b.uid NOT IN (SELECT uid FROM first_visits);
+CREATE UNIQUE INDEX users_uid ON users (uid);
+CREATE INDEX users_source ON users (source, first_order_month);
+""".format(no_source=NO_SOURCE)
+
+
+def _seconds(values):
+    return np.asarray(values, dtype='datetime64[ns]').astype('datetime64[s]').astype(np.int64)
+
+
+def _rows(name, chunk):
+    """Столбцы порции loader в порядке TABLES[name], как списки значений Python."""
+    if name == 'visits':
+        days = day_index(chunk['visit_start'])
+        columns = [
+            chunk['uid'].to_numpy().view(np.int64), chunk['device'].astype(str).to_numpy(),
+            chunk['source_id'].to_numpy(), _seconds(chunk['visit_start']), _seconds(chunk['visit_end']),
+            days, week_of_day(days), month_index(chunk['visit_start']),
+        ]
+    elif name == 'orders':
+        columns = [
+            chunk['uid'].to_numpy().view(np.int64), _seconds(chunk['order_date']), chunk['revenue'].to_numpy(),
+            day_index(chunk['order_date']), month_index(chunk['order_date']),
+        ]
+    else:
+        columns = [chunk['source_id'].to_numpy(), day_index(chunk['cost_date']),
+                   month_index(chunk['cost_date']), chunk['costs'].to_numpy()]
+    return zip(*[column.tolist() for column in columns])
+
+
+def _month_bound(end):
+    """Первый номер месяца, начало которого не раньше end: month < bound равносильно month_start < end."""
+    month = month_index([pd.Timestamp(end)])[0]
+    return int(month if month_start([month])[0] >= pd.Timestamp(end) else month + 1)
+
+
+class Store:
+    """Файл SQLite с логами Афиши и запросы метрик к нему."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+    @classmethod
+    def build(cls, path, data_dir=loader.DATA_DIR, chunksize=loader.CHUNKSIZE):
+        """Открывает хранилище path, перезагружая его, если исходные CSV или схема изменились."""
+        keys = {name: loader.cache_key(name, loader.source_path(name, data_dir)) for name in TABLES}
+        keys['schema'] = str(SCHEMA_VERSION)
+        if os.path.exists(path):
+            store = cls(path)
+            try:
+                if dict(store.connection.execute('SELECT name, key FROM meta').fetchall()) == keys:
+                    return store
+            except sqlite3.DatabaseError:
+                pass
+            store.close()
+            os.remove(path)
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+        store = cls(path + '.tmp')
+        store.load(data_dir, keys, chunksize)
+        store.close()
+        os.replace(path + '.tmp', path)
+        return cls(path)
+
+    def load(self, data_dir, keys, chunksize=loader.CHUNKSIZE):
+        """Загружает три лога в пустой файл и строит индексы и таблицу пользователей."""
+        connection = self.connection
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(SCHEMA)
+        for name, columns in TABLES.items():
+            statement = 'INSERT INTO {} VALUES ({})'.format(name, ', '.join('?' * len(columns)))
+            for chunk in loader.iter_chunks(name, chunksize=chunksize, data_dir=data_dir):
+                connection.executemany(statement, _rows(name, chunk))
+        connection.executescript(INDEXES)
+        connection.executescript(USERS)
+        connection.executemany('INSERT INTO meta VALUES (?, ?)', keys.items())
+        connection.commit()
+        connection.execute('ANALYZE')
+
+    def close(self):
+        self.connection.close()
+
+    def query(self, sql, params=()):
+        """Произвольный запрос к хранилищу в виде DataFrame."""
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    @staticmethod
+    def _where(time_column, source_column, source_id=None, start=None, end=None, convert=_seconds):
+        """Условие WHERE и параметры для среза; convert переводит даты в единицы time_column."""
+        conditions, params = [], []
+        if source_id is not None:
+            conditions.append('{} = ?'.format(source_column))
+            params.append(int(source_id))
+        for bound, operator in ((start, '>='), (end, '<')):
+            if bound is not None:
+                conditions.append('{} {} ?'.format(time_column, operator))
+                params.append(int(convert([pd.Timestamp(bound)])[0]))
+        return ' AND '.join(conditions) or '1', params
+
+    def activity(self, source_id=None, start=None, end=None):
+        """DAU, WAU, MAU и sticky factor (Activity) по посещениям среза."""
+        where, params = self._where('start_ts', 'source_id', source_id, start, end)
+        series = []
+        for period, to_start in (('day', day_start), ('week', week_start), ('month', month_start)):
+            frame = self.query(
+                'SELECT {0} AS period, COUNT(DISTINCT uid) AS users FROM visits WHERE {1} '
+                'GROUP BY {0} ORDER BY {0}'.format(period, where), params)
+            series.append(pd.Series(frame['users'].to_numpy(), index=to_start(frame['period']),
+                                    name={'day': 'dau', 'week': 'wau', 'month': 'mau'}[period]))
+        return build_activity(*series)
+
+    def retention_pivot(self, source_id=None, start=None, end=None):
+        """Retention Rate по месячным когортам среза, как cohorts.retention_pivot."""
+        where, params = self._where('start_ts', 'source_id', source_id, start, end)
+        cells = self.query("""
+            WITH months AS (SELECT DISTINCT uid, month FROM visits WHERE {}),
+                 cohorts AS (SELECT uid, MIN(month) AS cohort FROM months GROUP BY uid)
+            SELECT c.cohort, m.month - c.cohort AS lifetime, COUNT(*) AS users
+            FROM months m JOIN cohorts c USING (uid)
+            GROUP BY 1, 2
+        """.format(where), params)
+        users = cohort_matrix(cells['cohort'], cells['lifetime'], weights=cells['users'].to_numpy(np.float64))
+        return retention_from_users(users)
+
+    def ltv_report(self, end=HALF_YEAR_END, margin_rate=1, source_id=None, start=None):
+        """Таблица LTV по когортам первой покупки и месяцам заказов раньше end, как ltv_report в pipeline.
+
+        start оставляет только когорты, месяц которых начинается не раньше
+        start (их заказы тоже не раньше start).
+        """
+        source = '' if source_id is None else 'AND source = {:d}'.format(int(source_id))
+        if start is not None:
+            source += ' AND first_order_month >= :first'
+        report = self.query("""
+            WITH sizes AS (
+                SELECT first_order_month, COUNT(*) AS new_buyers FROM users
+                WHERE order_count > 0 {0} GROUP BY 1
+            ),
+            revenue AS (
+                SELECT u.first_order_month, o.month AS order_month, SUM(o.revenue) AS revenue
+                FROM orders o JOIN users u USING (uid)
+                WHERE o.month < :bound AND u.first_order_month < :bound {0}
+                GROUP BY 1, 2
+            )
+            SELECT s.first_order_month, s.new_buyers, r.order_month, r.revenue
+            FROM sizes s JOIN revenue r USING (first_order_month)
+            ORDER BY 1, 3
+        """.format(source), {'bound': _month_bound(end), 'first': None if start is None else _month_bound(start)})
+        report['age'] = report['order_month'] - report['first_order_month']
+        report['first_order_month'] = month_start(report['first_order_month'])
+        report['order_month'] = month_start(report['order_month'])
+        report['gp'] = report['revenue'] * margin_rate
+        report['ltv'] = report['gp'] / report['new_buyers']
+        return report[['first_order_month', 'new_buyers', 'order_month', 'revenue', 'gp', 'age', 'ltv']]
+
+    def buyers_daily(self, source_id=None, start=None, end=None):
+        """Новые покупатели по источнику и дню первой покупки."""
+        where, params = self._where('first_order_ts', 'source', source_id, start, end)
+        frame = self.query("""
+            SELECT source AS source_id, first_order_day AS day, COUNT(*) AS n_buyers FROM users
+            WHERE first_order_ts IS NOT NULL AND first_ts IS NOT NULL AND source != {} AND {}
+            GROUP BY 1, 2 ORDER BY 1, 2
+        """.format(NO_SOURCE, where), params)
+        return pd.DataFrame({
+            'source_id': frame['source_id'],
+            'first_order_dt': day_start(frame['day']),
+            'n_buyers': frame['n_buyers'],
+        })
+
+    def costs(self, source_id=None, start=None, end=None):
+        """Дневные расходы в столбцах loader: source_id, cost_date, costs."""
+        where, params = self._where('day', 'source_id', source_id, start, end, convert=day_index)
+        frame = self.query('SELECT source_id, day, costs FROM costs WHERE {} ORDER BY source_id, day'.format(where),
+                           params)
+        return pd.DataFrame({
+            'source_id': frame['source_id'],
+            'cost_date': day_start(frame['day']),
+            'costs': frame['costs'],
+        })
+
+    def cac(self, source_id=None, start=None, end=None):
+        """Расходы на нового покупателя по источнику и дню, как cac в pipeline."""
+        daily = self.buyers_daily(source_id, start, end)
+        cac = daily.merge(self.costs(source_id, start, end),
+                          left_on=['source_id', 'first_order_dt'], right_on=['source_id', 'cost_date'])
+        cac['costs_per_buyer'] = cac['costs'] / cac['n_buyers']
+        return cac
+
+    def report_fs(self, source_id=None):
+        """Посетители, выручка по месяцам и LTV по first-touch источнику, как report_fs в pipeline."""
+        source = '' if source_id is None else 'AND u.source = {:d}'.format(int(source_id))
+        report = self.query("""
+            WITH sizes AS (
+                SELECT u.source AS source_id, COUNT(*) AS n_visits FROM users u
+                WHERE u.source != {0} {1} GROUP BY 1
+            ),
+            revenue AS (
+                SELECT u.source AS source_id, o.month AS order_month, SUM(o.revenue) AS revenue
+                FROM orders o JOIN users u USING (uid)
+                WHERE u.source != {0} {1} GROUP BY 1, 2
+            )
+            SELECT s.source_id, s.n_visits, r.order_month, r.revenue
+            FROM sizes s JOIN revenue r USING (source_id)
+            ORDER BY 1, 3
+        """.format(NO_SOURCE, source))
+        report['order_month'] = month_start(report['order_month'])
+        report['ltv'] = report['revenue'] / report['n_visits']
+        return report
+
+    def romi_report(self, source_id=None):
+        """report_fs с месячными расходами, CAC и ROMI (romi.romi_report)."""
+        return romi_report(self.report_fs(source_id), self.costs(source_id))
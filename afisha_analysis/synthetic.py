@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Генератор синтетических visits_log.csv, orders_log.csv и costs.csv в формате Афиши.
+
+Данные пишутся по дням и порциям, поэтому объем ограничен только диском
+(от 10**5 до 10**9 посещений). Распределения подобраны похожими на
+настоящие логи:
+
+- трафик по источникам неравномерный, у пользователя есть "свой"
+  источник, но часть посещений приходит из других;
+- возвраты: пользователь выбирается по степенному закону, поэтому
+  небольшая доля пользователей дает много посещений;
+- длительность сессии - логнормальная с тяжелым хвостом и пиками
+  на 0 и 60 секундах;
+- заказ возникает после части посещений с логнормальной задержкой;
+- расходы по источникам на каждый день пропорциональны их трафику.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .loader import DATETIME_FORMAT, SOURCES
+from .sketch import hash_uids
+
+
+START_DATE = '2017-06-01'
+N_DAYS = 365
+#доли трафика источников 1..10 (источников 6 и 8 в данных нет, как в реальных логах)
+SOURCE_SHARES = {1: 0.09, 2: 0.13, 3: 0.24, 4: 0.28, 5: 0.19, 7: 0.001, 9: 0.03, 10: 0.029}
+SOURCE_COST_PER_VISIT = {1: 0.55, 2: 0.9, 3: 1.6, 4: 0.6, 5: 0.7, 7: 0.0, 9: 0.35, 10: 0.4}
+TOUCH_SHARE = 0.27
+VISITS_PER_USER = 1.6
+OWN_SOURCE_SHARE = 0.8
+CONVERSION_RATE = 0.14
+RETURN_EXPONENT = 2.5
+CHUNK_ROWS = 5_000_000
+
+
+_SOURCE_IDS = np.array(list(SOURCE_SHARES), dtype=np.uint8)
+_SOURCE_CDF = np.cumsum(list(SOURCE_SHARES.values())) / sum(SOURCE_SHARES.values())
+
+
+def _pick_sources(uniform):
+    """Источники по равномерным числам из [0, 1) согласно SOURCE_SHARES."""
+    return _SOURCE_IDS[np.minimum(np.searchsorted(_SOURCE_CDF, uniform, side='right'), len(_SOURCE_IDS) - 1)]
+
+
+def _uids(users, seed):
+    """uid пользователей: хеш номера пользователя, выглядит как случайный uint64."""
+    return hash_uids(np.asarray(users, dtype=np.uint64) ^ hash_uids(np.uint64(seed)))
+
+
+def _own_sources(users, seed):
+    """"Свой" источник пользователя - детерминированно по хешу номера, без таблицы в памяти."""
+    uniform = (_uids(users, seed + 1) >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+    return _pick_sources(uniform)
+
+
+def _durations(rng, size):
+    seconds = rng.lognormal(mean=5.6, sigma=1.3, size=size)
+    bounce = rng.random(size)
+    seconds[bounce < 0.09] = 0
+    seconds[(bounce >= 0.09) & (bounce < 0.16)] = 60
+    return np.minimum(seconds, 30 * 86400).astype(np.int64)
+
+
+def _timestamps(day, rng, size):
+    #посещения гуще вечером: смесь равномерного времени и пика около 20:00
+    seconds = np.where(rng.random(size) < 0.6,
+                       rng.integers(0, 86400, size),
+                       np.clip(rng.normal(72000, 9000, size), 0, 86399)).astype(np.int64)
+    return np.datetime64(day, 's') + seconds.astype('timedelta64[s]')
+
+
+def _format(times):
+    return pd.DatetimeIndex(times).strftime(DATETIME_FORMAT)
+
+
+def _write(frame, path, first):
+    frame.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+
+def generate(out_dir, n_visits=100_000, n_days=N_DAYS, start=START_DATE, seed=0, chunk_rows=CHUNK_ROWS):
+    """Пишет три CSV в out_dir и возвращает число строк visits, orders и costs."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_users = max(1, int(n_visits / VISITS_PER_USER))
+
+    visits_path = os.path.join(out_dir, SOURCES['visits']['file'])
+    orders_path = os.path.join(out_dir, SOURCES['orders']['file'])
+    costs_path = os.path.join(out_dir, SOURCES['costs']['file'])
+    #сезонность: зимой трафик почти вдвое выше летнего
+    days = np.arange(n_days)
+    season = 1 + 0.45 * np.cos(2 * np.pi * (days - 200) / 365)
+    per_day = rng.multinomial(n_visits, season / season.sum())
+    end = np.datetime64(start, 's') + np.timedelta64(n_days, 'D')
+
+    counts = {'visits': 0, 'orders': 0, 'costs': 0}
+    first_visit_chunk = first_order_chunk = True
+    costs = []
+    for offset, day_visits in enumerate(per_day):
+        day = np.datetime64(start, 'D') + np.timedelta64(offset, 'D')
+        daily_traffic = dict.fromkeys(SOURCE_SHARES, 0)
+        for chunk_start in range(0, day_visits, chunk_rows):
+            size = min(chunk_rows, day_visits - chunk_start)
+            #номер пользователя по степенному закону: младшие номера возвращаются чаще
+            users = np.minimum((n_users * rng.random(size) ** RETURN_EXPONENT).astype(np.int64), n_users - 1)
+            other = rng.random(size) > OWN_SOURCE_SHARE
+            sources = np.where(other, _pick_sources(rng.random(size)), _own_sources(users, seed))
+            starts = _timestamps(day, rng, size)
+            ends = starts + _durations(rng, size).astype('timedelta64[s]')
+            uids = _uids(users, seed)
+            _write(pd.DataFrame({
+                'Device': np.where(rng.random(size) < TOUCH_SHARE, 'touch', 'desktop'),
+                'End Ts': _format(ends),
+                'Source Id': sources,
+                'Start Ts': _format(starts),
+                'Uid': uids,
+            }), visits_path, first_visit_chunk)
+            first_visit_chunk = False
+            counts['visits'] += size
+            for source, count in zip(*np.unique(sources, return_counts=True)):
+                daily_traffic[int(source)] += int(count)
+
+            #заказы: часть посещений конвертируется с логнормальной задержкой
+            converted = rng.random(size) < CONVERSION_RATE / VISITS_PER_USER
+            lag = rng.lognormal(mean=8.0, sigma=2.2, size=int(converted.sum())).astype(np.int64)
+            order_times = starts[converted] + lag.astype('timedelta64[s]')
+            keep = order_times < end
+            n_orders = int(keep.sum())
+            if n_orders:
+                _write(pd.DataFrame({
+                    'Buy Ts': _format(order_times[keep]),
+                    'Revenue': np.round(rng.lognormal(mean=1.0, sigma=1.1, size=n_orders), 2),
+                    'Uid': uids[converted][keep],
+                }), orders_path, first_order_chunk)
+                first_order_chunk = False
+                counts['orders'] += n_orders
+
+        for source, traffic in daily_traffic.items():
+            price = SOURCE_COST_PER_VISIT[source] * rng.lognormal(0, 0.25)
+            if traffic and price > 0:
+                costs.append((source, str(day), round(traffic * price, 2)))
+
+    if first_order_chunk:
+        pd.DataFrame(columns=['Buy Ts', 'Revenue', 'Uid']).to_csv(orders_path, index=False)
+    frame = pd.DataFrame(costs, columns=['source_id', 'dt', 'costs'])
+    frame.to_csv(costs_path, index=False)
+    counts['costs'] = len(frame)
+    return counts
@@ -0,0 +1,129 @@
+# coding: utf-8
+"""Общий словарь uid: плотный int32-индекс для visits, orders и покупателей.
+
+Словарь - массив всех uint64 uid из visits и orders; индекс
+пользователя - позиция его uid в этом массиве. После загрузки в таблицы
+добавляется столбец uid_index, и дальше соединения и группировки по
+пользователю делаются обращением к массивам длины n_users вместо
+хеш-соединений по uid. Исходные uid нужны только при выгрузке результатов.
+
+build_uid_dictionary дает отсортированный словарь. extend_uid_dictionary
+дописывает в конец словаря новые uid, не меняя индексы известных:
+например, словарь посетителей, дополненный покупателями без посещений,
+кодирует visits так же, как словарь одних посетителей.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .loader import CACHE_DIR, CHUNKSIZE, DATA_DIR, load_all
+
+
+UID_INDEX = 'uid_index'
+
+
+def build_uid_dictionary(*uid_arrays):
+    """Отсортированный массив уникальных uid из всех переданных массивов."""
+    arrays = [np.asarray(uids, dtype=np.uint64) for uids in uid_arrays]
+    if not arrays:
+        return np.array([], dtype=np.uint64)
+    return np.unique(np.concatenate(arrays))
+
+
+def extend_uid_dictionary(dictionary, *uid_arrays):
+    """Словарь dictionary, в конец которого дописаны отсутствующие в нем uid (по возрастанию)."""
+    new = build_uid_dictionary(*uid_arrays)
+    return np.concatenate([dictionary, new[encode(dictionary, new, strict=False) < 0]])
+
+
+def encode(dictionary, uids, strict=True):
+    """Индексы uid в словаре (int32).
+
+    Неизвестные uid дают ValueError, а при strict=False - индекс -1.
+    """
+    uids = np.asarray(uids, dtype=np.uint64)
+    #расширенный словарь (extend_uid_dictionary) не отсортирован целиком
+    sorter = None if (dictionary[1:] > dictionary[:-1]).all() else np.argsort(dictionary)
+    positions = np.searchsorted(dictionary, uids, sorter=sorter)
+    known = positions < len(dictionary)
+    codes = positions if sorter is None else np.where(known, sorter[np.minimum(positions, len(dictionary) - 1)], -1)
+    known[known] = dictionary[codes[known]] == uids[known]
+    if not known.all():
+        if strict:
+            raise ValueError('{} uid отсутствуют в словаре'.format(int((~known).sum())))
+        codes[~known] = -1
+    return codes.astype(np.int32)
+
+
+def decode(dictionary, codes):
+    """Исходные uid по индексам словаря."""
+    return dictionary[np.asarray(codes)]
+
+
+def attach_uid_index(dictionary, *frames):
+    """Добавляет в каждую таблицу столбец uid_index по столбцу uid."""
+    for frame in frames:
+        frame[UID_INDEX] = encode(dictionary, frame['uid'].to_numpy())
+    return frames
+
+
+def load_encoded(data_dir=DATA_DIR, cache_dir=CACHE_DIR, chunksize=CHUNKSIZE):
+    """Как load_all, но с общим словарем uid и столбцом uid_index в orders и visits.
+
+    Возвращает costs, orders, visits и словарь.
+    """
+    costs, orders, visits = load_all(data_dir, cache_dir, chunksize)
+    dictionary = build_uid_dictionary(visits['uid'], orders['uid'])
+    attach_uid_index(dictionary, orders, visits)
+    return costs, orders, visits, dictionary
+
+
+def per_user(codes, values, n_users, how, fill=None):
+    """Агрегат values по индексам пользователей: массив длины n_users.
+
+    how - 'min', 'max', 'sum' или 'count'. Для 'min'/'max' пользователи без
+    строк получают fill, а для дат - NaT, если fill не задан.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    if how == 'count':
+        return np.bincount(codes, minlength=n_users)
+    values = np.asarray(values)
+    if how == 'sum':
+        return np.bincount(codes, weights=values, minlength=n_users)
+    if how not in ('min', 'max'):
+        raise ValueError("how должен быть 'min', 'max', 'sum' или 'count', получено {!r}".format(how))
+
+    dtype = values.dtype
+    if dtype.kind == 'M':
+        #даты сравниваются как целые наносекунды
+        values = values.astype('datetime64[ns]').view(np.int64)
+    if values.dtype.kind == 'f':
+        identity = np.inf if how == 'min' else -np.inf
+    else:
+        info = np.iinfo(values.dtype)
+        identity = info.max if how == 'min' else info.min
+    result = np.full(n_users, identity, dtype=values.dtype)
+    (np.minimum if how == 'min' else np.maximum).at(result, codes, values)
+
+    absent = np.bincount(codes, minlength=n_users) == 0
+    if dtype.kind == 'M':
+        result = result.view('datetime64[ns]')
+        if fill is None:
+            fill = np.datetime64('NaT')
+    if fill is not None:
+        result[absent] = fill
+    return result
+
+
+def lookup(per_user_values, codes):
+    """Значение пользователя для каждой строки: массивный аналог merge по uid."""
+    return np.asarray(per_user_values)[np.asarray(codes)]
+
+
+def export(dictionary, codes=None, **columns):
+    """Таблица результатов по пользователям с исходными uid в индексе.
+
+    Без codes столбцы считаются массивами длины словаря.
+    """
+    uids = dictionary if codes is None else decode(dictionary, codes)
+    return pd.DataFrame(columns, index=pd.Index(uids, name='uid'))
@@ -0,0 +1,137 @@
+# coding: utf-8
+"""Сводная таблица по пользователям, которая строится один раз и хранится на диске.
+
+Один проход по visits и один проход по orders дают для каждого
+пользователя (строка = uid_index общего словаря): дату первого
+посещения, атрибутированный источник (по умолчанию first-touch -
+источник самого раннего посещения, см. attribution), дату и месяц
+первой покупки, число дней до первой покупки, число заказов и сумму
+выручки. Время до покупки, CAC, LTV по источникам и частота покупок
+читаются из этой таблицы, а не пересчитываются группировками сырых
+логов.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .attribution import NO_SOURCE, touch_sources
+from .loader import CACHE_DIR, cache_key, source_path
+from .periods import month_index, month_start
+from .uids import UID_INDEX, lookup, per_user
+
+
+def build_user_index(visits, orders, dictionary, model='first', window=None):
+    """Строит сводную таблицу пользователей по visits и orders с uid_index.
+
+    model ('first' или 'last') и window задают атрибуцию источника. Для
+    last-touch и при заданном окне учитываются только посещения до первой
+    покупки (у покупателей) и не раньше чем за window до нее.
+    """
+    n_users = len(dictionary)
+    visit_codes = visits[UID_INDEX].to_numpy()
+    order_codes = orders[UID_INDEX].to_numpy()
+
+    first_activity = per_user(visit_codes, visits['visit_start'].to_numpy(), n_users, 'min')
+    first_order = per_user(order_codes, orders['order_date'].to_numpy(), n_users, 'min')
+    #номер месяца NaT дает NaT в month_start, отдельная маска не нужна
+    first_order_month = month_start(month_index(first_order)).to_numpy()
+
+    reference = first_order if model == 'last' or window is not None else None
+    sources = touch_sources(visit_codes, visits['visit_start'], visits['source_id'], n_users,
+                            model=model, reference=reference, window=window)
+
+    index = pd.DataFrame({
+        'uid': dictionary,
+        'first_activity_date': first_activity,
+        'source': sources,
+        'first_order_date': first_order,
+        'first_order_month': first_order_month,
+        'order_count': per_user(order_codes, None, n_users, 'count').astype(np.int32),
+        'revenue': per_user(order_codes, orders['revenue'].to_numpy(), n_users, 'sum'),
+    })
+    #целые дни с отбрасыванием дробной части, как astype('int') в ноутбуке
+    index['days_to_first_order'] = np.trunc(
+        (index['first_order_date'] - index['first_activity_date']) / np.timedelta64(1, 'D')
+    )
+    index.index.name = UID_INDEX
+    return index
+
+
+def user_index_path(data_dir, cache_dir=CACHE_DIR, model='first', window=None):
+    """Путь к сохраненной таблице: ключ из mtime и размера visits и orders и атрибуции."""
+    keys = [cache_key(name, source_path(name, data_dir)) for name in ('visits', 'orders')]
+    keys.append(model if window is None else '{}{}'.format(model, pd.Timedelta(window).value))
+    return os.path.join(cache_dir, 'users-{}.parquet'.format('-'.join(keys)))
+
+
+def load_user_index(visits, orders, dictionary, path=None, model='first', window=None):
+    """Читает таблицу пользователей из path или строит и сохраняет ее.
+
+    Словарь uid должен быть тем же, что и при сохранении: строки таблицы -
+    позиции uid в словаре, это проверяется по столбцу uid.
+    """
+    if path is not None and os.path.exists(path):
+        index = pd.read_parquet(path)
+        if len(index) == len(dictionary) and (index['uid'].to_numpy() == dictionary).all():
+            return index
+    index = build_user_index(visits, orders, dictionary, model, window)
+    if path is not None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        index.to_parquet(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return index
+
+
+def select_buyers(index):
+    """Покупатели, у которых есть посещения (как соединение first_activity_date и first_order)."""
+    return index[index['first_order_date'].notna() & index['first_activity_date'].notna()]
+
+
+def buyers_daily(index):
+    """Новые покупатели по источнику и дню первой покупки."""
+    frame = select_buyers(index)
+    frame = frame[frame['source'] != NO_SOURCE]
+    return (
+        frame.groupby(['source', frame['first_order_date'].dt.normalize().rename('first_order_dt')])
+        .size()
+        .rename('n_buyers')
+        .rename_axis(['source_id', 'first_order_dt'])
+        .reset_index()
+    )
+
+
+def source_sizes(index):
+    """Число посетителей по источнику."""
+    sources = index['source'].to_numpy()
+    counts = np.bincount(sources[sources != NO_SOURCE])
+    present = np.flatnonzero(counts)
+    return pd.DataFrame({'source_id': present, 'n_visits': counts[present]})
+
+
+def source_revenue(index, orders):
+    """Выручка по источнику покупателя и месяцу заказа."""
+    sources = lookup(index['source'].to_numpy(), orders[UID_INDEX].to_numpy())
+    known = sources != NO_SOURCE
+    frame = pd.DataFrame({
+        'source_id': sources[known],
+        'order_month': month_start(month_index(orders['order_date'].to_numpy()[known])),
+        'revenue': orders['revenue'].to_numpy()[known],
+    })
+    return frame.groupby(['source_id', 'order_month'], as_index=False)['revenue'].sum()
+
+
+def purchase_frequency(index, orders=None, before=None):
+    """Среднее число заказов на покупателя.
+
+    С before считаются только заказы раньше этой даты (и только
+    покупатели, сделавшие такие заказы); для этого нужна таблица orders.
+    """
+    if before is None:
+        counts = index['order_count'].to_numpy()
+    else:
+        window = orders['order_date'] < pd.Timestamp(before)
+        counts = per_user(orders.loc[window, UID_INDEX].to_numpy(), None, len(index), 'count')
+    counts = counts[counts > 0]
+    return counts.mean() if len(counts) else np.nan
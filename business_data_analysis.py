@@ -12,16 +12,27 @@
 import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt
-from scipy import stats as st
 import numpy as np
 import plotly.express as px
 
+from afisha_analysis import compute_activity, load_costs, load_orders, load_partitioned, load_visits
+from afisha_analysis import retention_pivot as build_retention_pivot, romi_report
+from afisha_analysis import attach_uid_index, build_uid_dictionary
+from afisha_analysis import load_user_index, purchase_frequency, select_buyers, source_revenue, source_sizes, user_index_path
+from afisha_analysis import buyers_daily as user_buyers_daily
+from afisha_analysis import attribute, cac_romi
+from afisha_analysis import NO_SOURCE, Bootstrap, user_summary
+from afisha_analysis import duration_histogram, durations as session_durations
+from afisha_analysis import rolling_activity
+from afisha_analysis import lag_histogram, revenue_cube, visits_first_devices
+from afisha_analysis import cube_from_index, ltv_matrix, ltv_report, ltv_scenarios
+
 
 # In[2]:
 
 
-#подгрузим таблицу с маркетинговыми расходами
-costs = pd.read_csv('/datasets/costs.csv')
+#подгрузим таблицу с маркетинговыми расходами (порциями, в компактных типах, с кешем в parquet)
+costs = load_costs('/datasets')
 costs.info()
 display(costs.sample(10))
 
@@ -38,10 +49,7 @@ print("Нулевых данных в таблице costs:", costs.isnull().sum
 # In[4]:
 
 
-#поменяем тип некоторых данных, переименуем столбец
-costs['source_id'] = costs['source_id'].astype('object')
-costs = costs.rename(columns={'dt': 'cost_date'})
-costs['cost_date'] = pd.to_datetime(costs['cost_date'], format='%Y-%m-%d')
+#типы и названия столбцов уже приведены загрузчиком: source_id - uint8, cost_date - дата
 costs.head()
 
 
@@ -49,7 +57,7 @@ costs.head()
 
 
 #подгрузим таблицу с данными по заказам с сайта
-orders = pd.read_csv('/datasets/orders_log.csv')
+orders = load_orders('/datasets')
 orders.info()
 display(orders.sample(10))
 
@@ -66,11 +74,7 @@ print("Нулевых данных в таблице orders:", orders.isnull().s
 # In[7]:
 
 
-#приведем названия столбцов к нижнему регистру, заменим названия и приведем к нужному типу значения некоторых столбцов
-orders.columns = orders.columns.str.lower()
-orders = orders.rename(columns={'buy ts': 'order_date'})
-orders['order_date'] = pd.to_datetime(orders['order_date'], format='%Y-%m-%d %H:%M:%S')
-orders['uid'] = orders['uid'].astype('object')
+#названия столбцов приведены к нижнему регистру загрузчиком, order_date - дата, uid - uint64
 orders.head()
 
 
@@ -78,7 +82,7 @@ orders.head()
 
 
 #подгрузим таблицу с данными по посещению сайта
-visits = pd.read_csv('/datasets/visits_log.csv')
+visits = load_visits('/datasets')
 visits.info()
 display(visits.sample(10))
 
@@ -95,16 +99,32 @@ print("Нулевых данных в таблице visits:", visits.isnull().s
 # In[10]:
 
 
-#приведем к нижнему регистру названия столбцов, заменим названия и приведем к нужному типу значения некоторых столбцов
-visits.columns = visits.columns.str.lower()
-visits = visits.rename(columns={'end ts': 'visit_end', 'start ts': 'visit_start', 'source id': 'source_id'})
-visits['visit_end'] = pd.to_datetime(visits['visit_end'], format='%Y-%m-%d %H:%M:%S')
-visits['visit_start'] = pd.to_datetime(visits['visit_start'], format='%Y-%m-%d %H:%M:%S')
-visits['uid'] = visits['uid'].astype('object')
-visits['source_id'] = visits['source_id'].astype('object')
+#названия и типы столбцов приведены загрузчиком: device - category, source_id - uint8, uid - uint64
 visits.head()
 
 
+# In[ ]:
+
+
+#построим общий словарь uid: каждый пользователь получает плотный индекс uid_index (int32),
+#по которому дальше соединяются и группируются таблицы без хеш-соединений по uid
+uid_dictionary = build_uid_dictionary(visits['uid'], orders['uid'])
+attach_uid_index(uid_dictionary, orders, visits)
+
+
+# In[ ]:
+
+
+#соберем сводную таблицу по пользователям одним проходом по visits и orders (сохраняется на диск):
+#первое посещение, первый источник, первая покупка, дни до покупки, число заказов и выручка
+#модель атрибуции источника общая для CAC и ROMI: 'first' или 'last', окно - например pd.Timedelta(days=30)
+attribution_model, attribution_window = 'first', None
+user_index = load_user_index(visits, orders, uid_dictionary,
+                             user_index_path('/datasets', model=attribution_model, window=attribution_window),
+                             model=attribution_model, window=attribution_window)
+user_index.head()
+
+
 # ## Расчет и анализ основных метрик
 
 # ### Анализ уникальных посещений сайта в день, неделю, месяц
@@ -112,10 +132,7 @@ visits.head()
 # In[11]:
 
 
-#выделим в отдельные столбцы год, месяц и неделю, а также полную дату по данным посещений сайта
-visits['visit_year']  = visits['visit_start'].dt.year 
-visits['visit_month'] = visits['visit_start'].dt.month 
-visits['visit_week']  = visits['visit_start'].dt.week 
+#выделим в отдельный столбец полную дату посещения сайта (недели и месяцы считает compute_activity)
 visits['visit_date'] = visits['visit_start'].dt.date 
 print(visits.head()) 
 
@@ -123,8 +140,12 @@ print(visits.head())
 # In[12]:
 
 
-#найдем количество уникальных посетителей сайта в день (dau)
-dau_total = visits.groupby('visit_date').agg({'uid': 'nunique'}).mean()
+#найдем количество уникальных посетителей сайта в день, неделю и месяц одним проходом по visits
+#approx_error (например, 0.01) включает приближенный подсчет через HyperLogLog
+approx_error = None
+activity = compute_activity(visits, error=approx_error)
+dau, wau, mau = activity.dau, activity.wau, activity.mau
+dau_total = dau.mean()
 print("Количество уникальных посетителей в день в среднем:", int(dau_total))
 
 
@@ -132,7 +153,6 @@ print("Количество уникальных посетителей в де
 
 
 #отобразим на графике изменеие dau во времени
-dau = visits.groupby('visit_date').agg({'uid': 'nunique'})
 dau.hist(bins=50)
 
 
@@ -140,7 +160,7 @@ dau.hist(bins=50)
 
 
 #найдем количество уникальных посетителей сайта в неделю (wau)
-wau_total = (visits.groupby(['visit_year','visit_week']).agg({'uid': 'nunique'}).mean()) 
+wau_total = wau.mean()
 print("Количество уникальных посетителей в неделю в среднем:", int(wau_total)) 
 
 
@@ -148,23 +168,33 @@ print("Количество уникальных посетителей в не
 
 
 #отобразим на графике изменеие wau во времени
-wau = visits.groupby(['visit_year','visit_week']).agg({'uid': 'nunique'})
 wau.hist()
 
 
 # In[16]:
 
 
-#найдем количество уникальных посетителей сайта в месяц (mau)
-mau_total = (visits.groupby(['visit_year','visit_month']).agg({'uid': 'nunique'}).mean()) 
+#найдем количество уникальных посетителей сайта в месяц (mau) и sticky factor
+mau_total = mau.mean()
 print("Количество уникальных посетителей в месяц в среднем:", int(mau_total)) 
+print("Sticky factor DAU/WAU: {:.3f}, DAU/MAU: {:.3f}".format(activity.sticky_wau, activity.sticky_mau))
+
+
+# In[ ]:
+
+
+#скользящие уникальные за 7 и 30 дней по каждому дню и sticky factor к ним
+rolling = rolling_activity(visits)
+print(rolling[['sticky_7d', 'sticky_30d']].mean())
+rolling[['dau', 'users_7d', 'users_30d']].plot(figsize=(12, 5), title='Уникальные посетители: день, 7 и 30 дней')
+plt.show()
 
 
 # In[17]:
 
 
 #отобразим на графике изменеие mau во времени
-mau = visits.groupby(['visit_year','visit_month']).agg({'uid': 'nunique'})
+mau.index = mau.index.strftime('%Y-%m')
 mau.plot(kind='bar').set(xlabel='Дата посещения сайта', ylabel='Количество посетителей')
 plt.show()
 
@@ -221,7 +251,8 @@ print("Количество сессий одного посетителя в д
 
 
 #исследуем график распределения типичной пользовательской сессии
-visits['visit_duration_sec'] = (visits['visit_end'] - visits['visit_start']).dt.seconds
+#длительность в целых секундах с учетом дней; отрицательные значения - ошибки лога
+visits['visit_duration_sec'] = session_durations(visits['visit_start'], visits['visit_end'])
 visits['visit_duration_sec'].hist(bins=60, range=(0,4000)).set(xlabel='Количество посетителей сайта', ylabel='Длительность посещения сайта, сек')
 plt.show()
 
@@ -229,22 +260,27 @@ plt.show()
 # In[22]:
 
 
+#среднее, медиана и мода считаются по одной гистограмме длительностей, в том числе по устройствам
+duration_stats = duration_histogram([visits], by=['device'])
+duration_total = duration_stats.total().summary()
 #определим, сколько времени пользователи проводят на сайте в среднем
-print(visits['visit_duration_sec'].mean())
+print(duration_total['mean'].iloc[0])
 
 
 # In[23]:
 
 
 #определим медианное значение показателя времени, которое пользователи тратя на сайте 
-print(visits['visit_duration_sec'].median())
+print(duration_total['q50'].iloc[0])
 
 
 # In[24]:
 
 
 #рассчитаем моду продолжения посещения сайта
-print(visits['visit_duration_sec'].mode())
+print(duration_total['mode'].iloc[0])
+#и те же показатели по устройствам: короткие ли сессии с touch-устройств
+print(duration_stats.summary())
 
 
 # #### Вывод
@@ -263,101 +299,22 @@ print(visits['visit_duration_sec'].mode())
 # In[25]:
 
 
-#определим дату, когда пользователь впервые зашел на сайт
-first_activity_date = visits.groupby(['uid'])['visit_start'].min()
-
-#переименуем название столбца
-first_activity_date.name = 'first_activity_date'
-
-#объединим таблицу выше с таблицей посещения сайта
-visits = visits.join(first_activity_date,on='uid') 
-
-
-# In[26]:
-
-
-#выделим в отдельные столбцы месяц первого посещения и месяц всех посещений сайта
-visits['activity_month'] = visits['visit_start'].astype('datetime64[M]')
-visits['first_activity_month'] = visits['first_activity_date'].astype('datetime64[M]')
-
-
-# In[27]:
-
-
-#посчитаем жизненный цикл каждого пользователя в рамках когорты для каждой строки датафрейма
-visits['cohort_lifetime'] = visits['activity_month'] - visits['first_activity_month']
-
-#преобразуем данные в число месяцев, прошедших между датами, и коруглим и приведем эти данные к типу int
-visits['cohort_lifetime'] = visits['cohort_lifetime'] / np.timedelta64(1, 'M')
-visits['cohort_lifetime'] = visits['cohort_lifetime'].astype('int')
-
-
-# In[28]:
-
-
-#сгруппируем данные по когорному столбцу first_activity_month и по столбцу жизненного цикла когорты
-cohorts = visits.groupby(['first_activity_month','cohort_lifetime']).agg({'uid':'nunique'}).reset_index() 
-
-
-# In[29]:
-
-
-#найдем исходное количество пользователей в первый месяц жизни когорты
-initial_users_count = cohorts[cohorts['cohort_lifetime'] == 0][['first_activity_month', 'uid']]
-print(initial_users_count) 
-
-
-# In[30]:
-
-
-#переименуем столбец uid в получившейся таблице, чтобы потом объединить ее с основной cohorts
-initial_users_count = initial_users_count.rename(columns={'uid':'cohort_users'})
-
-
-# In[31]:
-
-
-#объединим таблицы в одну общую
-cohorts = cohorts.merge(initial_users_count,on='first_activity_month') 
-
-
-# In[32]:
-
-
-#найдем Retention Rate
-cohorts['retention'] = cohorts['uid'] / cohorts['cohort_users']
-
-
-# In[33]:
-
-
-cohorts.head(10)
-
-
-# In[34]:
-
-
-#уберем из таблица когорт нулевую(первую) когорту для наглядности изображения тепловой карты
-cohorts = cohorts.loc[cohorts['cohort_lifetime'] != 0]
+#построим матрицу когорт по месяцу первой активности и месяцу жизни когорты и найдем Retention Rate
+#(месяцы считаются арифметикой над номерами, уникальные пользователи в ячейках - через bincount)
+retention_pivot = build_retention_pivot(visits['uid'], visits['visit_start'])
 
 
 # In[35]:
 
 
-retention_mean = cohorts[cohorts['cohort_lifetime'] == 1]['retention'].mean()
+retention_mean = retention_pivot[1].mean()
 print("Среднее значение Retention Rate на второй месяц жизни когорты: {:.3f}".format(retention_mean))
 
 
 # In[36]:
 
 
-#построим сводную таблицу по данным Retention Rate
-retention_pivot = cohorts.pivot_table(
-    index='first_activity_month',
-    columns='cohort_lifetime',
-    values='retention',
-    aggfunc='sum',
-) 
+#сводная таблица по данным Retention Rate (нулевой месяц жизни когорт убран для наглядности тепловой карты)
 print(retention_pivot)
 
 
@@ -403,39 +360,12 @@ plt.show()
 # In[39]:
 
 
-#добавим день и месяц заказа в таблицы
-orders['order_dt'] = orders['order_date'].dt.date
+#добавим месяц заказа в таблицу
 orders['order_month'] = orders['order_date'].astype('datetime64[M]')
 
-#найдем время покупки для каждого покупателя
-first_order = orders.groupby('uid').agg({'order_date':'min'}).reset_index()
-first_order.columns = ['uid', 'first_order_date']
-first_order['first_order_dt'] = first_order['first_order_date'].dt.date
-first_order['first_order_month'] = first_order['first_order_date'].astype('datetime64[M]')
-first_order.head()
-
-
-# In[40]:
-
-
-#объединим данные о первых покупках с данными о первом посещении на сайт
-buyers = pd.merge(first_activity_date, first_order, on='uid')
-buyers.head()
-
-
-# In[41]:
-
-
-#переведем в формат времени и даты столбцы в новой таблице
-buyers['first_order_dt'] = pd.to_datetime(buyers['first_order_dt'])
-buyers['first_activity_date'] = pd.to_datetime(buyers['first_activity_date'])
-
-
-# In[42]:
-
-
-#найдем, сколько дней требуется для каждого покупателя, чтобы совершить первую покупку
-buyers['days_to_first_order'] = ((buyers['first_order_date'] - buyers['first_activity_date']) / np.timedelta64(1,'D')).astype('int')
+#возьмем покупателей из сводной таблицы пользователей: дата первого посещения,
+#дата первой покупки и число дней между ними там уже посчитаны
+buyers = select_buyers(user_index)
 buyers.head()
 
 
@@ -460,6 +390,17 @@ mean = buyers['days_to_first_order'].mean()
 print("Среднее время для совершения первой покупки после первого посещения сайта пользователями: {:.1f} дней.".format(mean))
 
 
+# In[ ]:
+
+
+#гистограммы лагов до первой покупки по источнику, устройству первого посещения и когорте:
+#квантили любого разреза берутся из накопленных корзин без новой группировки
+lags = lag_histogram(user_index, visits_first_devices(visits, len(user_index)))
+print(lags.select(('source',)).summary().round(1))
+print(lags.select(('device',)).summary().round(1))
+print(lags.select(('cohort',), device='desktop').summary().round(1))
+
+
 # #### Вывод
 
 # Среднее время для совершения первой покупки после первого посещения сайта пользователями: 16.7 дней.
@@ -470,16 +411,8 @@ print("Среднее время для совершения первой пок
 # In[45]:
 
 
-#выделим срез по данным о покупках за полгода с начала исследования
-orders_filtered = orders.query('order_date < "2017-12-01 00:00:00"')
-orders_filtered.head()
-
-
-# In[46]:
-
-
-#сгруппируем данные за полгода
-orders_mean = orders_filtered.groupby('uid')['order_date'].count().mean()
+#посчитаем среднее число покупок на покупателя по заказам за полгода с начала исследования
+orders_mean = purchase_frequency(user_index, orders, before='2017-12-01')
 
 
 # In[47]:
@@ -494,9 +427,10 @@ print("Среднее количество покупок на одного по
 # In[48]:
 
 
-avg_order = orders.groupby('order_date')['revenue'].sum().mean()
-max_order = orders.groupby('order_date')['revenue'].sum().max()
-min_order = orders.groupby('order_date')['revenue'].sum().min()
+#один проход по заказам: поминутные сумма, число, минимальный и максимальный чек
+orders_cube = revenue_cube([orders])
+order_check = orders_cube.totals()
+avg_order, max_order, min_order = order_check['mean'], order_check['max'], order_check['min']
 print("Средний чек одной покупки на сайте: {:.2f} у.е.".format(avg_order))
 print("Максимальный чек одной покупки на сайте: {:.2f} у.е.".format(max_order))
 print("Минимальный чек одной покупки на сайте: {:.2f} у.е.".format(min_order))
@@ -505,8 +439,8 @@ print("Минимальный чек одной покупки на сайте:
 # In[49]:
 
 
-orders['order_date_filtered'] = orders['order_date'].dt.date 
-order_grouped = orders.groupby('order_date_filtered').agg({'revenue':'sum'}).reset_index()
+#выручка и средний чек по дням - свертка того же куба
+order_grouped = orders_cube.rollup('day')
 print(order_grouped)
 
 
@@ -514,7 +448,7 @@ print(order_grouped)
 
 
 plt.figure(figsize = (16,10), dpi = 80)
-plt.plot('order_date_filtered', 'revenue', data = order_grouped, color = 'tab:brown')
+plt.plot(order_grouped.index, order_grouped['sum'], color = 'tab:brown')
 plt.title("Изменение среднего чека покупок на сайте Яндекс.Афиши с июня 2017 по конец мая 2018 года", fontsize=22)
 plt.grid(axis = 'both', alpha = 0.3)
 plt.ylabel('Сумма чека, у.е.')
@@ -547,77 +481,51 @@ costs['cost_month'] = costs['cost_date'].astype('datetime64[M]')
 # In[52]:
 
 
-#найдем месяц первой покупки для каждого посетителя сайта
-first_orders = orders.groupby('uid').agg({'order_month': 'min'}).reset_index()
-
-#заменим имя столбца
-first_orders.columns = ['uid', 'first_order_month']
-print(first_orders.head()) 
+#соберем куб LTV за полгода за один проход по заказам: из набора заказов, разбитого по месяцам, читаются
+#только каталоги month=2017-06 ... month=2017-11 и нужные столбцы, без загрузки и фильтрации всех заказов;
+#когорта покупателя берется из сводной таблицы пользователей по uid_index, выручка раскладывается
+#по источнику, месяцу первой покупки и возрасту когорты
+orders_half_year = load_partitioned('orders', end='2017-12-01', columns=['uid', 'order_date', 'revenue'])
+attach_uid_index(uid_dictionary, orders_half_year)
+ltv_cube = cube_from_index(user_index, orders_half_year, granularity='month')
+print(ltv_cube.sizes.sum(axis=0)) 
 
 
 # In[53]:
 
 
-#посчитаем количество новых покупателей (new_buyers) за каждый месяц
-cohort_sizes = (first_orders.groupby('first_order_month').agg({'uid': 'nunique'}).reset_index())
-
-#присвоим новые названия столбцам
-cohort_sizes.columns = ['first_order_month', 'new_buyers']
-print(cohort_sizes.head()) 
+#найдем валовую прибыль и LTV по месяцу первой покупки и месяцу заказа
+margin_rate = 1
+report = ltv_report(ltv_cube, margin=margin_rate, cutoff='2017-12-01')
+print(report.head()) 
 
 
 # In[54]:
 
 
-#построим когорты добавив месяц первой покупки каждого покупателя в таблицу с заказами
-orders_new = pd.merge(orders,first_orders, on='uid')
-print(orders_new.head()) 
+#построим сводную таблицу 
+output = report.pivot_table(index='first_order_month', columns='age', values='ltv', aggfunc='mean').round()
+output.fillna('')
 
 
 # In[55]:
 
 
-#сгруппируем таблицу заказов по месяцу первой покупки и месяцу каждого заказа и сложим выручку
-cohorts_1 = (orders_new.groupby(['first_order_month', 'order_month']).agg({'revenue': 'sum'}).reset_index())
-print(cohorts_1.head()) 
+#накопленный LTV когорт и тот же LTV в разрезе источников без повторного прохода по заказам
+print(ltv_matrix(ltv_cube, cutoff='2017-12-01').round(2))
+print(ltv_matrix(ltv_cube, cutoff='2017-12-01', by_source=True).round(2).head(12))
 
 
 # In[56]:
 
 
-#добавим в таблицу cohorts_1 данные о том, сколько людей первый раз совершили покупку в каждый месяц
-report = pd.merge(cohort_sizes, cohorts_1, on='first_order_month')
-report = report.query('first_order_month < "2017-12-01" & order_month < "2017-12-01"')
-print(report.head())
+#сценарии: LTV покупателя за 1, 3 и 6 месяцев при разной марже
+print(ltv_scenarios(ltv_cube, horizons=(1, 3, 6), margins=(0.3, 0.5, 1.0), cutoff='2017-12-01'))
 
 
 # In[57]:
 
 
-#найдем валовую прибыль
-margin_rate = 1
-report['gp'] = report['revenue'] * margin_rate
-
-#выделим возраст когорты в отдельный столбец
-report['age'] = (report['order_month'] - report['first_order_month']) / np.timedelta64(1, 'M')
-report['age'] = report['age'].round().astype('int')
-print(report.head()) 
-
-
-# In[58]:
-
-
-#сделаем расчет LTV
-report['ltv'] = report['gp'] / report['new_buyers']
-
-#построим сводную таблицу 
-output = report.pivot_table(index='first_order_month', columns='age', values='ltv', aggfunc='mean').round()
-output.fillna('')
-
-
-# In[59]:
-
-
 #посчитаем итоговый LTV первой когорты
 ltv_201706 = output.loc['2017-06-01'].sum()
 print(ltv_201706)
@@ -695,23 +603,9 @@ plt.show()
 # In[65]:
 
 
-#найдем первый источник перехода для каждого пользователя
-first_source = visits.sort_values('visit_start').groupby('uid').first() 
-first_source = first_source[['source_id']]
-
-#объединим таблицы первого источника и покупателей
-buyers = pd.merge(buyers, first_source, left_on='uid', right_index=True)
-buyers.head()
-
-
-# In[66]:
-
-
-#найдем уникальных покупателей в каждый день
-buyers_daily = buyers.groupby(['source_id', 'first_order_dt']).agg({'uid':'count'}).reset_index()
-
-#переименуем колонку новых значений
-buyers_daily.rename(columns={'uid':'n_buyers'}, inplace=True)
+#первый источник перехода (источник самого раннего посещения) уже есть в сводной таблице,
+#найдем уникальных покупателей в каждый день по первому источнику
+buyers_daily = user_buyers_daily(user_index)
 buyers_daily.head()
 
 
@@ -766,49 +660,24 @@ plt.show()
 # In[72]:
 
 
-#найдем первый источник по которому пришел каждый посетитель
-first_source = visits.groupby('uid')['source_id'].first().reset_index()
-first_source.columns = ['uid', 'source_id']
-
-
-# In[73]:
-
-
-#посчитаем количество посетителей, пришедших с каждого источника
-cohort_fs = (
-    first_source.groupby('source_id')
-    .agg({'uid': 'nunique'})
-    .reset_index()
-)
-cohort_fs.columns = ['source_id', 'n_visits']
+#посчитаем количество посетителей, пришедших с каждого первого источника (по сводной таблице пользователей)
+cohort_fs = source_sizes(user_index)
 cohort_fs.head()
 
 
-# In[74]:
-
-
-#объединим таблицу first_source с таблицей заказов
-visits_first_source = pd.merge(orders, first_source, on='uid')
-visits_first_source.head()
-
-
 # In[75]:
 
 
-#посчитаем доход в месяц от каждого источника
-cohorts = (
-    visits_first_source.groupby(['source_id', 'order_month'])
-    .agg({'revenue': 'sum'})
-    .reset_index()
-)
-cohorts.head()
+#посчитаем доход в месяц от каждого источника: первый источник покупателя берется из сводной таблицы
+source_cohorts = source_revenue(user_index, orders)
+source_cohorts.head()
 
 
 # In[76]:
 
 
 #объединим таблицы
-report_fs = pd.merge(cohort_fs, cohorts, on='source_id')
+report_fs = pd.merge(cohort_fs, source_cohorts, on='source_id')
 report_fs.head()
 
 
@@ -823,24 +692,9 @@ report_fs.head()
 # In[78]:
 
 
-#объединим таблицы
-merged = pd.merge(report_fs, costs, on='source_id', how='left')
-merged.head()
-
-
-# In[79]:
-
-
-#найдем расходы на привлечение каждого посетителя сайта по источникам
-merged['cac_per_source_new'] = merged['costs'] / merged['n_visits']
-merged.head()
-
-
-# In[80]:
-
-
-#ROMI
-merged['romi'] = merged['ltv'] / merged['cac_per_source_new']
+#объединим таблицы: расходы свернуты до месяца источника и соединяются по (source_id, месяц),
+#а CAC на посетителя и ROMI считаются для каждой пары источник-месяц
+merged = romi_report(report_fs, costs)
 merged.head()
 
 
@@ -876,6 +730,33 @@ def analysis(df, data):
 analysis(merged, 'romi')
 
 
+# In[ ]:
+
+
+#сравним CAC и ROMI по источникам при мультиканальной атрибуции: выручка и покупатели
+#распределяются по всем посещениям до заказа (модели 'linear', 'time_decay', 'position')
+multi_touch = attribute(visits, orders, model='position')
+cac_romi(multi_touch, costs).sort_values('romi', ascending=False)
+
+
+# In[ ]:
+
+
+#доверительные интервалы удержания, конверсии, LTV, CAC и ROMI по источникам: пуассоновский бутстреп
+#по сводке пользователей, 10 000 перевыборок считаются порциями матриц в пуле процессов
+summary = user_summary(user_index, visits['uid_index'].to_numpy(), visits['visit_start'].to_numpy())
+bootstrap = Bootstrap(summary[summary['source'] != NO_SOURCE], by='source')
+print(bootstrap.intervals(costs=costs_per_source).round(3))
+
+
+# In[ ]:
+
+
+#сравним ROMI и LTV источников 4 и 3: разность, ее 95% интервал и p-value
+print(bootstrap.compare('romi', 3, 4, costs=costs_per_source))
+print(bootstrap.compare('ltv', 3, 4))
+
+
 # #### Вывод
 
 # - самый окупаемый источник - Источник №4 (в среднем 108 у.е. с человека)
@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Общие данные тестов: небольшой синтетический набор логов Афиши.
+
+Фикстуры notebook_* - эталоны, посчитанные по сырым таблицам теми же
+merge, pivot_table и groupby-nunique, что в business_data_analysis.py.
+astype('datetime64[M]') и деление на np.timedelta64(1, 'M') из ноутбука
+заменены на to_period('M') и точную разность номеров месяцев: в pandas 2+
+они не работают, а cohort_lifetime ноутбука (деление на средний месяц и
+astype('int')) для февраль -> март дает 0.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from afisha_analysis.loader import load_all
+from afisha_analysis.pipeline import Pipeline
+from afisha_analysis.synthetic import generate
+
+
+SYNTHETIC_VISITS = 20_000
+
+
+def _month(times):
+    """Первое число месяца, как astype('datetime64[M]') в ноутбуке."""
+    return times.dt.to_period('M').dt.to_timestamp()
+
+
+def _months_between(later, earlier):
+    """Целое число месяцев между первыми числами месяцев."""
+    return (later.dt.year - earlier.dt.year) * 12 + later.dt.month - earlier.dt.month
+
+
+@pytest.fixture(scope='session')
+def synthetic_dir(tmp_path_factory):
+    """Каталог с visits_log.csv, orders_log.csv и costs.csv на SYNTHETIC_VISITS посещений."""
+    path = tmp_path_factory.mktemp('synthetic')
+    generate(str(path), n_visits=SYNTHETIC_VISITS, seed=0)
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def tables(synthetic_dir):
+    """costs, orders и visits синтетического набора; тесты не должны их менять."""
+    return load_all(synthetic_dir, cache_dir=None)
+
+
+@pytest.fixture(scope='session')
+def pipeline(synthetic_dir):
+    """Конвейер по синтетическому набору без дискового кэша, общий для тестов."""
+    return Pipeline(synthetic_dir, cache_dir=None)
+
+
+@pytest.fixture(scope='session')
+def notebook_visits(tables):
+    """visits с first_activity_date, месяцами активности и cohort_lifetime."""
+    visits = tables[2].copy()
+    first_activity_date = visits.groupby(['uid'])['visit_start'].min()
+    first_activity_date.name = 'first_activity_date'
+    visits = visits.join(first_activity_date, on='uid')
+    visits['activity_month'] = _month(visits['visit_start'])
+    visits['first_activity_month'] = _month(visits['first_activity_date'])
+    visits['cohort_lifetime'] = _months_between(visits['activity_month'], visits['first_activity_month'])
+    return visits
+
+
+@pytest.fixture(scope='session')
+def notebook_retention(notebook_visits):
+    """Сводная таблица Retention Rate ноутбука."""
+    cohorts = notebook_visits.groupby(['first_activity_month', 'cohort_lifetime']).agg({'uid': 'nunique'}).reset_index()
+    initial_users_count = cohorts[cohorts['cohort_lifetime'] == 0][['first_activity_month', 'uid']]
+    initial_users_count = initial_users_count.rename(columns={'uid': 'cohort_users'})
+    cohorts = cohorts.merge(initial_users_count, on='first_activity_month')
+    cohorts['retention'] = cohorts['uid'] / cohorts['cohort_users']
+    cohorts = cohorts[cohorts['cohort_lifetime'] != 0]
+    return cohorts.pivot_table(index='first_activity_month', columns='cohort_lifetime', values='retention',
+                               aggfunc='sum')
+
+
+@pytest.fixture(scope='session')
+def notebook_buyers(tables, notebook_visits):
+    """Покупатели с посещениями: первое посещение, первый заказ, дни до него и first-touch источник."""
+    orders = tables[1]
+    first_order = orders.groupby('uid').agg({'order_date': 'min'}).reset_index()
+    first_order.columns = ['uid', 'first_order_date']
+    first_order['first_order_dt'] = first_order['first_order_date'].dt.normalize()
+    first_order['first_order_month'] = _month(first_order['first_order_date'])
+    first_activity_date = notebook_visits.groupby('uid')['first_activity_date'].first()
+    buyers = pd.merge(first_activity_date, first_order, on='uid')
+    buyers['days_to_first_order'] = (
+        (buyers['first_order_date'] - buyers['first_activity_date']) / np.timedelta64(1, 'D')
+    ).astype('int')
+    first_source = notebook_visits.sort_values('visit_start', kind='stable').groupby('uid').first()
+    return pd.merge(buyers, first_source[['source_id']], left_on='uid', right_index=True)
+
+
+@pytest.fixture(scope='session')
+def notebook_report(tables):
+    """Таблица LTV ноутбука по всем месяцам (без отсечения по HALF_YEAR_END)."""
+    orders = tables[1].copy()
+    orders['order_month'] = _month(orders['order_date'])
+    first_orders = orders.groupby('uid').agg({'order_month': 'min'}).reset_index()
+    first_orders.columns = ['uid', 'first_order_month']
+    cohort_sizes = first_orders.groupby('first_order_month').agg({'uid': 'nunique'}).reset_index()
+    cohort_sizes.columns = ['first_order_month', 'new_buyers']
+    orders_new = pd.merge(orders, first_orders, on='uid')
+    cohorts_1 = orders_new.groupby(['first_order_month', 'order_month']).agg({'revenue': 'sum'}).reset_index()
+    report = pd.merge(cohort_sizes, cohorts_1, on='first_order_month')
+    report['gp'] = report['revenue']
+    report['age'] = _months_between(report['order_month'], report['first_order_month'])
+    report['ltv'] = report['gp'] / report['new_buyers']
+    return report
+
+
+@pytest.fixture(scope='session')
+def notebook_activity(notebook_visits):
+    """DAU, WAU и MAU ноутбука: groupby по дню, неделе (с понедельника) и месяцу с nunique."""
+    visits = notebook_visits
+    periods = {
+        'dau': visits['visit_start'].dt.normalize(),
+        'wau': visits['visit_start'].dt.to_period('W-SUN').dt.start_time,
+        'mau': visits['activity_month'],
+    }
+    return {name: visits.groupby(period)['uid'].nunique() for name, period in periods.items()}
+
+
+@pytest.fixture(scope='session')
+def notebook_cac(tables, notebook_buyers):
+    """costs_new ноутбука: новые покупатели по источнику и дню с расходами и CAC."""
+    buyers_daily = notebook_buyers.groupby(['source_id', 'first_order_dt']).agg({'uid': 'count'}).reset_index()
+    buyers_daily = buyers_daily.rename(columns={'uid': 'n_buyers'})
+    costs_new = pd.merge(buyers_daily, tables[0], left_on=['source_id', 'first_order_dt'],
+                         right_on=['source_id', 'cost_date'])
+    costs_new['costs_per_buyer'] = costs_new['costs'] / costs_new['n_buyers']
+    return costs_new
+
+
+@pytest.fixture(scope='session')
+def notebook_report_fs(tables, notebook_visits):
+    """report_fs ноутбука: посетители и выручка по first-touch источнику и месяцу заказа, LTV."""
+    first_source = notebook_visits.sort_values('visit_start', kind='stable').groupby('uid')['source_id'].first()
+    first_source = first_source.reset_index()
+    cohort_fs = first_source.groupby('source_id').agg({'uid': 'nunique'}).reset_index()
+    cohort_fs.columns = ['source_id', 'n_visits']
+    orders = tables[1].copy()
+    orders['order_month'] = _month(orders['order_date'])
+    visits_first_source = pd.merge(orders, first_source, on='uid')
+    cohorts = visits_first_source.groupby(['source_id', 'order_month']).agg({'revenue': 'sum'}).reset_index()
+    report_fs = pd.merge(cohort_fs, cohorts, on='source_id')
+    report_fs['ltv'] = report_fs['revenue'] / report_fs['n_visits']
+    return report_fs
@@ -0,0 +1,64 @@
+# coding: utf-8
+"""Замеры этапов bench.TARGETS под pytest-benchmark: время и прирост пика RSS каждого этапа.
+
+Перед каждым раундом узлы других этапов вычисляются заранее, поэтому
+замер включает только узлы своего этапа. Прирост пика RSS
+(profiling.Profiler) пишется в extra_info результата:
+pytest --benchmark-json=bench.json сохраняет его вместе со временем.
+"""
+
+import pytest
+
+from afisha_analysis.bench import TARGETS, run_stages
+from afisha_analysis.pipeline import NODES, SOURCES, Pipeline
+from afisha_analysis.profiling import Profiler
+
+pytest.importorskip('pytest_benchmark')
+
+
+def _stage(name):
+    return 'load' if name in SOURCES else NODES[name].stage
+
+
+def _stages():
+    #этап -> узлы, которые он считает: загрузка и этапы узлов TARGETS
+    stages = {'load': SOURCES}
+    for target in TARGETS:
+        stages[_stage(target)] = stages.get(_stage(target), ()) + (target,)
+    return stages
+
+
+STAGES = _stages()
+
+
+@pytest.mark.parametrize('stage', list(STAGES))
+def test_stage(benchmark, synthetic_dir, stage):
+    targets = STAGES[stage]
+    profilers = []
+
+    def setup():
+        profiler = Profiler(trace_memory=False)
+        pipeline = Pipeline(synthetic_dir, cache_dir=None)
+        for target in targets:
+            for name in pipeline.upstream(target):
+                if _stage(name) != stage:
+                    pipeline.get(name)
+        pipeline.profiler = profiler
+        profilers.append(profiler)
+        return (pipeline,), {}
+
+    def run(pipeline):
+        return [pipeline.get(target) for target in targets]
+
+    benchmark.pedantic(run, setup=setup, rounds=3)
+    records = [record for profiler in profilers for record in profiler.records]
+    assert {record.stage for record in records} == {stage}
+    deltas = [record.peak_rss_delta_bytes for record in records if record.peak_rss_delta_bytes is not None]
+    benchmark.extra_info['nodes'] = sorted({record.node for record in records})
+    benchmark.extra_info['peak_rss_delta_mb'] = max(deltas) / 2 ** 20 if deltas else None
+
+
+def test_run_stages_covers_targets(synthetic_dir):
+    result = run_stages(synthetic_dir, trace_memory=False)
+    assert set(STAGES) <= set(result['stage'])
+    assert (result['wall_seconds'] >= 0).all()
@@ -0,0 +1,33 @@
+# coding: utf-8
+"""Сводка для бутстрепа и оценки метрик против groupby по сырым таблицам."""
+
+import numpy as np
+
+from afisha_analysis.attribution import NO_SOURCE
+from afisha_analysis.bootstrap import RATIOS, Bootstrap
+
+
+def _expected_sums(tables, notebook_visits):
+    #посетители: first-touch источник, удержание - посещение в месяце жизни > 0
+    users = notebook_visits.sort_values('visit_start', kind='stable').groupby('uid').agg(
+        source=('source_id', 'first'), retained=('cohort_lifetime', 'max'))
+    users['retained'] = (users['retained'] > 0).astype(int)
+    orders = tables[1].groupby('uid').agg(orders=('revenue', 'count'), revenue=('revenue', 'sum'))
+    users = users.join(orders).fillna({'orders': 0, 'revenue': 0})
+    users['buyer'] = (users['orders'] > 0).astype(int)
+    users['users'] = 1
+    return users.groupby('source')[['users', 'retained', 'buyer', 'orders', 'revenue']].sum()
+
+
+def test_estimates_match_groupby(tables, pipeline, notebook_visits):
+    expected = _expected_sums(tables, notebook_visits)
+    summary = pipeline.get('user_summary')
+    visitors = summary[summary['source'] != NO_SOURCE]
+    bootstrap = Bootstrap(visitors, n_resamples=20, max_workers=1)
+    assert bootstrap.labels == expected.index.tolist()
+    np.testing.assert_allclose(bootstrap.sums, expected[list(bootstrap.columns)].to_numpy())
+    for name, (numerator, denominator) in RATIOS.items():
+        np.testing.assert_allclose(bootstrap.metric(name)[0], expected[numerator] / expected[denominator])
+    #покупатели без посещений попадают в отдельную группу NO_SOURCE
+    buyers_only = ~tables[1]['uid'].isin(notebook_visits['uid'])
+    assert (summary['source'] == NO_SOURCE).sum() == tables[1]['uid'][buyers_only].nunique()
@@ -0,0 +1,19 @@
+# coding: utf-8
+"""Когортная матрица и Retention Rate против groupby-nunique и pivot_table ноутбука."""
+
+import pandas as pd
+
+from afisha_analysis.cohorts import active_users_matrix, retention_pivot
+
+
+def test_active_users_match_groupby_nunique(notebook_visits):
+    users = active_users_matrix(notebook_visits['uid'], notebook_visits['visit_start'])
+    expected = notebook_visits.pivot_table(index='first_activity_month', columns='cohort_lifetime', values='uid',
+                                           aggfunc='nunique', fill_value=0)
+    assert users.to_numpy().tolist() == expected.to_numpy().tolist()
+
+
+def test_retention_matches_notebook(notebook_visits, notebook_retention):
+    retention = retention_pivot(notebook_visits['uid'], notebook_visits['visit_start'])
+    pd.testing.assert_frame_equal(retention, notebook_retention, check_dtype=False, check_index_type=False,
+                                  check_column_type=False)
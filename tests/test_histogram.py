@@ -0,0 +1,37 @@
+# coding: utf-8
+"""Общая сегментированная гистограмма: сложение порций и квантили."""
+
+import numpy as np
+import pandas as pd
+
+from afisha_analysis.funnel import LagHistogram
+from afisha_analysis.sessions import DurationHistogram
+
+
+def _data(n=5_000, seed=0):
+    rng = np.random.default_rng(seed)
+    seconds = rng.integers(-10, 4_000, n)
+    keys = pd.DataFrame({'source': rng.integers(1, 4, n), 'device': rng.choice(['desktop', 'touch'], n),
+                         'cohort': rng.integers(0, 3, n)})
+    return seconds, keys
+
+
+def test_merged_chunks_equal_one_pass():
+    seconds, keys = _data()
+    whole = LagHistogram().add(seconds, keys)
+    merged = LagHistogram().add(seconds[:1_000], keys[:1_000])
+    merged.merge(LagHistogram().add(seconds[1_000:], keys[1_000:].reset_index(drop=True)))
+    pd.testing.assert_frame_equal(merged.summary(), whole.summary())
+    pd.testing.assert_frame_equal(whole.select(('source',)).summary(),
+                                  LagHistogram(('source',)).add(seconds, keys).summary())
+
+
+def test_duration_quantiles_match_pandas():
+    seconds, keys = _data()
+    summary = DurationHistogram(('device',)).add(seconds, keys).summary(quantiles=(0.5, 0.9))
+    valid = pd.DataFrame({'device': keys['device'], 'seconds': seconds})[seconds >= 0]
+    expected = valid.groupby('device')['seconds'].agg(['count', 'mean', lambda x: x.quantile(0.5),
+                                                       lambda x: x.quantile(0.9)])
+    np.testing.assert_array_equal(summary['sessions'], expected['count'])
+    np.testing.assert_allclose(summary[['mean', 'q50', 'q90']].to_numpy(), expected.iloc[:, 1:].to_numpy())
+    assert summary['negative'].sum() == (seconds < 0).sum()
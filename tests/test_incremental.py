@@ -0,0 +1,105 @@
+# coding: utf-8
+"""Инкрементальное состояние: покупка раньше первого посещения, сохранение дельтами и сверка с ноутбуком."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from afisha_analysis.incremental import IncrementalState
+from afisha_analysis.loader import load_all
+from afisha_analysis.periods import day_index
+from afisha_analysis.synthetic import generate
+
+
+def _visits(day, uid, source):
+    start = pd.Timestamp(day) + pd.Timedelta(hours=10)
+    return pd.DataFrame({
+        'device': pd.Categorical(['desktop']),
+        'visit_end': [start + pd.Timedelta(minutes=5)],
+        'source_id': np.array([source], dtype='uint8'),
+        'visit_start': [start],
+        'uid': np.array([uid], dtype='uint64'),
+    })
+
+
+def _orders(day, uid, revenue):
+    return pd.DataFrame({
+        'order_date': [pd.Timestamp(day) + pd.Timedelta(hours=12)],
+        'revenue': [revenue],
+        'uid': np.array([uid], dtype='uint64'),
+    })
+
+
+def test_order_before_first_visit():
+    state = IncrementalState()
+    state.update(orders=_orders('2017-06-01', 5, 10.0))
+    assert state.users.loc[5, 'first_source'] == -1
+    assert state.aggregate('buyers_daily').empty and state.aggregate('source_revenue').empty
+
+    state.update(visits=_visits('2017-06-02', 5, 3), orders=_orders('2017-06-02', 5, 2.5))
+    assert state.users.loc[5, 'first_source'] == 3
+    day = day_index(pd.DatetimeIndex(['2017-06-01']))[0]
+    assert state.aggregate('buyers_daily').to_dict() == {(3, day): 1}
+    assert state.aggregate('source_revenue').sum() == 12.5
+    assert state.aggregate('pending_revenue').empty
+
+
+def _by_day(frame, column):
+    days = day_index(frame[column])
+    return {day: frame[days == day].reset_index(drop=True) for day in np.unique(days)}
+
+
+def test_save_writes_deltas_and_compacts(tmp_path):
+    data_dir, state_dir = str(tmp_path / 'data'), str(tmp_path / 'state')
+    generate(data_dir, n_visits=3_000, n_days=8, seed=2)
+    costs, orders, visits = load_all(data_dir, cache_dir=None)
+    parts = [_by_day(visits, 'visit_start'), _by_day(orders, 'order_date'), _by_day(costs, 'cost_date')]
+    state = IncrementalState()
+    for number, day in enumerate(sorted(parts[0])):
+        state.update(*(part.get(day) for part in parts))
+        state.save(state_dir, compact_every=3)
+        #первое сохранение пишет таблицу целиком, затем по дельте на сохранение до сжатия
+        assert len(state.deltas) == number % 4
+        assert sorted(name for name in os.listdir(state_dir) if name.startswith('users')) == sorted(
+            [state.users_file] + state.deltas)
+    assert len(pd.read_parquet(os.path.join(state_dir, state.deltas[-1]))) < len(state.users)
+
+    loaded = IncrementalState.load(state_dir)
+    pd.testing.assert_frame_equal(loaded.users.sort_index(), state.users.sort_index())
+    for name, series in state.aggregates.items():
+        pd.testing.assert_series_equal(loaded.aggregate(name).sort_index(), series.sort_index(), check_dtype=False,
+                                       check_index_type=False)
+
+
+def _by_month(frame, column):
+    months = frame[column].dt.to_period('M')
+    return {month: frame[months == month].reset_index(drop=True) for month in months.unique()}
+
+
+def test_monthly_updates_match_notebook(tables, notebook_activity, notebook_retention, notebook_report,
+                                        notebook_cac, notebook_report_fs):
+    costs, orders, visits = tables
+    parts = [_by_month(visits, 'visit_start'), _by_month(orders, 'order_date'), _by_month(costs, 'cost_date')]
+    state = IncrementalState()
+    for month in sorted(parts[0]):
+        state.update(*(part.get(month) for part in parts))
+
+    activity = state.activity()
+    for name, expected in notebook_activity.items():
+        assert getattr(activity, name).tolist() == expected.tolist()
+    pd.testing.assert_frame_equal(state.retention_pivot(), notebook_retention, check_dtype=False,
+                                  check_index_type=False, check_column_type=False, check_names=False)
+    output = notebook_report.pivot_table(index='first_order_month', columns='age', values='ltv', aggfunc='sum')
+    ltv = state.ltv_pivot()
+    assert ltv.index.tolist() == output.index.tolist() and ltv.columns.tolist() == output.columns.tolist()
+    np.testing.assert_allclose(ltv.to_numpy(), output.to_numpy())
+
+    cac = state.cac()
+    expected = notebook_cac[['source_id', 'first_order_dt', 'n_buyers']]
+    assert cac[['source_id', 'day', 'buyers']].to_numpy().tolist() == expected.to_numpy().tolist()
+    np.testing.assert_allclose(cac['costs_per_buyer'], notebook_cac['costs_per_buyer'])
+    source_ltv = state.source_ltv()
+    keys = ['source_id', 'n_visits', 'order_month']
+    assert source_ltv[keys].to_numpy().tolist() == notebook_report_fs[keys].to_numpy().tolist()
+    np.testing.assert_allclose(source_ltv['ltv'], notebook_report_fs['ltv'])
@@ -0,0 +1,55 @@
+# coding: utf-8
+"""Кеш loader и наборы по месяцам: каталоги данных с общим кешем не удаляют файлы друг друга."""
+
+import os
+
+import pytest
+
+from afisha_analysis.loader import SOURCES, cache_path, dataset_path, load_source, partitioned_dataset
+from afisha_analysis.synthetic import generate
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def two_dirs(tmp_path):
+    dirs = [str(tmp_path / 'a'), str(tmp_path / 'b')]
+    for seed, directory in enumerate(dirs):
+        generate(directory, n_visits=500, n_days=10, seed=seed)
+    return dirs, str(tmp_path / 'cache')
+
+
+def _touch(directory, name):
+    path = os.path.join(directory, SOURCES[name]['file'])
+    with open(path, 'a') as target:
+        target.write('\n')
+    return path
+
+
+def test_shared_cache_keeps_other_dirs(two_dirs):
+    dirs, cache_dir = two_dirs
+    paths = [os.path.join(directory, SOURCES['costs']['file']) for directory in dirs]
+    for directory in dirs:
+        load_source('costs', directory, cache_dir)
+    cached = [cache_path('costs', path, cache_dir) for path in paths]
+    assert cached[0] != cached[1] and all(os.path.exists(path) for path in cached)
+
+    #новая версия файла в первом каталоге заменяет только его кеш
+    _touch(dirs[0], 'costs')
+    load_source('costs', dirs[0], cache_dir)
+    assert not os.path.exists(cached[0])
+    assert os.path.exists(cache_path('costs', paths[0], cache_dir))
+    assert os.path.exists(cached[1])
+
+
+def test_shared_cache_keeps_other_datasets(two_dirs):
+    dirs, cache_dir = two_dirs
+    paths = [os.path.join(directory, SOURCES['visits']['file']) for directory in dirs]
+    roots = [partitioned_dataset('visits', directory, cache_dir) for directory in dirs]
+    assert roots[0] != roots[1] and all(os.path.isdir(root) for root in roots)
+
+    _touch(dirs[0], 'visits')
+    partitioned_dataset('visits', dirs[0], cache_dir)
+    assert not os.path.exists(roots[0])
+    assert os.path.isdir(dataset_path('visits', paths[0], cache_dir))
+    assert os.path.isdir(roots[1])
@@ -0,0 +1,28 @@
+# coding: utf-8
+"""Куб LTV против таблицы report ноутбука (merge размеров когорт и выручки) и ее pivot_table."""
+
+import numpy as np
+import pandas as pd
+
+from afisha_analysis.ltv import ltv_matrix, ltv_report
+from afisha_analysis.periods import HALF_YEAR_END
+
+
+def test_report_matches_notebook(pipeline, notebook_report):
+    report = ltv_report(pipeline.get('ltv_cube'), cutoff=HALF_YEAR_END)
+    expected = notebook_report.query('first_order_month < @HALF_YEAR_END & order_month < @HALF_YEAR_END')
+    pd.testing.assert_frame_equal(report, expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_matrix_matches_pivot_table(pipeline, notebook_report):
+    cube = pipeline.get('ltv_cube')
+    output = notebook_report.pivot_table(index='first_order_month', columns='age', values='ltv', aggfunc='mean')
+    matrix = ltv_matrix(cube, cumulative=False)
+    assert matrix.index.tolist() == output.index.tolist()
+    np.testing.assert_allclose(matrix.to_numpy(), output.to_numpy())
+
+    #накопленный LTV задан для всех возрастов до последнего месяца заказов
+    last_month = notebook_report['order_month'].max()
+    ages = (last_month.year - output.index.year) * 12 + last_month.month - output.index.month
+    cumulative = output.fillna(0).cumsum(axis=1).where(output.columns.to_numpy() <= ages.to_numpy()[:, None])
+    np.testing.assert_allclose(ltv_matrix(cube).to_numpy(), cumulative.to_numpy())
@@ -0,0 +1,32 @@
+# coding: utf-8
+"""Граф метрик: отпечатки узлов зависят только от их исходных таблиц."""
+
+import numpy as np
+
+from afisha_analysis.loader import SOURCES
+from afisha_analysis.pipeline import Pipeline
+from afisha_analysis.synthetic import generate
+from afisha_analysis.uids import UID_INDEX
+
+
+VISIT_NODES = ('visit_uids', 'visits_clean', 'rolling_activity', 'dau', 'wau', 'mau', 'session_stats')
+
+
+def test_orders_change_keeps_visit_nodes(tmp_path):
+    generate(str(tmp_path), n_visits=2_000, n_days=30, seed=1)
+    before = Pipeline(str(tmp_path), cache_dir=None)
+    visits_clean = before.get('visits_clean')
+    fingerprints = {name: before.fingerprint(name) for name in VISIT_NODES + ('orders_clean', 'user_index')}
+    #покупатель без посещений меняет orders, но не индексы посетителей
+    with open(tmp_path / SOURCES['orders']['file'], 'a') as target:
+        target.write('2017-06-05 10:00:00,1.5,1\n')
+    after = Pipeline(str(tmp_path), cache_dir=None)
+    for name in VISIT_NODES:
+        assert after.fingerprint(name) == fingerprints[name], name
+    assert after.fingerprint('orders_clean') != fingerprints['orders_clean']
+    assert after.fingerprint('user_index') != fingerprints['user_index']
+
+    user_index = after.get('user_index')
+    codes = visits_clean[UID_INDEX].to_numpy()
+    np.testing.assert_array_equal(user_index['uid'].to_numpy()[codes], visits_clean['uid'].to_numpy())
+    assert user_index['uid'].iloc[-1] == 1 and user_index['first_activity_date'].isna().iloc[-1]
@@ -0,0 +1,25 @@
+# coding: utf-8
+"""Куб выручки против groupby по заказам."""
+
+import numpy as np
+
+from afisha_analysis.revenue import revenue_cube
+
+
+def test_rollup_matches_groupby(tables):
+    orders = tables[1]
+    cube = revenue_cube([orders[:1_000], orders[1_000:]])
+    for resolution, periods in (('day', orders['order_date'].dt.normalize()),
+                                ('month', orders['order_date'].dt.to_period('M').dt.to_timestamp())):
+        rollup = cube.rollup(resolution)
+        expected = orders.groupby(periods)['revenue'].agg(['sum', 'mean', 'min', 'max', 'count'])
+        assert rollup.index.tolist() == expected.index.tolist()
+        np.testing.assert_allclose(rollup.to_numpy(dtype=float), expected.to_numpy(dtype=float))
+
+
+def test_totals_match_orders(tables):
+    revenue = tables[1]['revenue']
+    totals = revenue_cube([tables[1]]).totals()
+    np.testing.assert_allclose(totals[['sum', 'mean', 'min', 'max']].to_numpy(dtype=float),
+                               [revenue.sum(), revenue.mean(), revenue.min(), revenue.max()])
+    assert totals['count'] == len(revenue)
@@ -0,0 +1,18 @@
+# coding: utf-8
+"""Скользящие уникальные пользователи против nunique по окну дней."""
+
+import numpy as np
+
+from afisha_analysis.rolling import rolling_activity
+
+
+def test_windows_match_nunique(tables):
+    visits = tables[2]
+    rolling = rolling_activity(visits)
+    days = visits['visit_start'].dt.normalize()
+    for window in (1, 7, 30):
+        expected = [visits['uid'][(days > day - np.timedelta64(window, 'D')) & (days <= day)].nunique()
+                    for day in rolling.index]
+        column = 'dau' if window == 1 else 'users_{}d'.format(window)
+        assert rolling[column].tolist() == expected
+    assert rolling.index.tolist() == list(np.unique(days))
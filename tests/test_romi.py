@@ -0,0 +1,100 @@
+# coding: utf-8
+"""ROMI по источникам и месяцам против расчета ноутбука через соединение многие-ко-многим."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from afisha_analysis.romi import iter_romi_report, romi_report
+from afisha_analysis.uids import attach_uid_index, build_uid_dictionary
+from afisha_analysis.userindex import build_user_index, source_revenue, source_sizes
+
+
+COLUMNS = ['source_id', 'order_month', 'n_visits', 'revenue', 'ltv', 'costs', 'cac_per_source_new', 'romi']
+
+
+@pytest.fixture
+def tables():
+    visits = pd.DataFrame({
+        'device': pd.Categorical(['desktop', 'touch', 'desktop', 'touch', 'desktop']),
+        'visit_end': pd.to_datetime(['2017-06-01 10:05', '2017-06-20 12:00', '2017-06-03 09:10',
+                                     '2017-07-02 18:30', '2017-06-15 11:00']),
+        'source_id': np.array([1, 2, 2, 3, 1], dtype='uint8'),
+        'visit_start': pd.to_datetime(['2017-06-01 10:00', '2017-06-20 11:00', '2017-06-03 09:00',
+                                       '2017-07-02 18:00', '2017-06-15 10:00']),
+        #пользователь 10 пришел из источника 1, позже заходил из 2; у источника 3 нет покупателей
+        'uid': np.array([10, 10, 20, 30, 40], dtype='uint64'),
+    })
+    orders = pd.DataFrame({
+        'order_date': pd.to_datetime(['2017-06-01 10:03', '2017-07-05 08:00', '2017-06-04 12:00',
+                                      '2017-08-10 16:00', '2017-06-16 09:00', '2017-06-10 10:00']),
+        'revenue': [5.0, 7.5, 3.0, 4.0, 2.5, 100.0],
+        #пользователь 50 покупал, но не заходил на сайт
+        'uid': np.array([10, 10, 20, 20, 40, 50], dtype='uint64'),
+    })
+    cost_dates = pd.date_range('2017-06-01', '2017-07-31', freq='10D')
+    costs = pd.DataFrame({
+        'source_id': np.repeat(np.array([1, 2, 3], dtype='uint8'), len(cost_dates)),
+        'cost_date': np.tile(cost_dates, 3),
+        'costs': np.arange(1, 3 * len(cost_dates) + 1, dtype='float64'),
+    })
+    return visits, orders, costs
+
+
+def _month(dates):
+    return dates.dt.to_period('M').dt.to_timestamp()
+
+
+def baseline_romi(visits, orders, costs):
+    """Расчет ноутбука: first-touch источник, соединение с дневными расходами по source_id и группировка."""
+    first_source = visits.sort_values('visit_start', kind='stable').groupby('uid')['source_id'].first().reset_index()
+    cohort_fs = first_source.groupby('source_id').agg(n_visits=('uid', 'nunique')).reset_index()
+    revenue = (
+        orders.assign(order_month=_month(orders['order_date']))
+        .merge(first_source, on='uid')
+        .groupby(['source_id', 'order_month'], as_index=False)['revenue'].sum()
+    )
+    report_fs = cohort_fs.merge(revenue, on='source_id')
+    report_fs['ltv'] = report_fs['revenue'] / report_fs['n_visits']
+    #каждая строка выручки размножается на все дни расходов источника
+    merged = report_fs.merge(costs.assign(cost_month=_month(costs['cost_date'])), on='source_id', how='left')
+    merged = merged[merged['cost_month'] == merged['order_month']]
+    monthly = merged.groupby(['source_id', 'order_month'], as_index=False)['costs'].sum()
+    result = report_fs.merge(monthly, on=['source_id', 'order_month'], how='left')
+    result['cac_per_source_new'] = result['costs'] / result['n_visits']
+    result['romi'] = result['ltv'] / result['cac_per_source_new']
+    return result[COLUMNS]
+
+
+def package_report_fs(visits, orders):
+    dictionary = build_uid_dictionary(visits['uid'], orders['uid'])
+    attach_uid_index(dictionary, orders, visits)
+    index = build_user_index(visits, orders, dictionary)
+    report = source_sizes(index).merge(source_revenue(index, orders), on='source_id')
+    report['ltv'] = report['revenue'] / report['n_visits']
+    return report
+
+
+def _assert_same(actual, expected):
+    pd.testing.assert_frame_equal(actual[COLUMNS].reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_romi_report_matches_baseline(tables):
+    visits, orders, costs = tables
+    expected = baseline_romi(visits, orders, costs)
+    #источник без покупателей и покупатель без посещений в отчет не попадают
+    assert 3 not in set(expected['source_id'])
+    assert expected['costs'].isna().any()
+    _assert_same(romi_report(package_report_fs(visits, orders), costs), expected)
+
+
+def test_iter_romi_report_matches_baseline(tables):
+    visits, orders, costs = tables
+    expected = baseline_romi(visits, orders, costs)
+    report = package_report_fs(visits, orders).sort_values(['source_id', 'order_month'], ignore_index=True)
+    costs = costs.sort_values(['source_id', 'cost_date'], ignore_index=True)
+    report_chunks = [report.iloc[start:start + 2] for start in range(0, len(report), 2)]
+    cost_chunks = [costs.iloc[start:start + 4] for start in range(0, len(costs), 4)]
+    streamed = pd.concat(list(iter_romi_report(report_chunks, cost_chunks)), ignore_index=True)
+    _assert_same(streamed, expected)
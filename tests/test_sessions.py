@@ -0,0 +1,26 @@
+# coding: utf-8
+"""Длительности и пересборка сессий против вычислений pandas."""
+
+import numpy as np
+import pandas as pd
+
+from afisha_analysis.sessions import durations, resessionize
+
+
+def test_durations_match_total_seconds(tables):
+    visits = tables[2]
+    expected = (visits['visit_end'] - visits['visit_start']).dt.total_seconds()
+    np.testing.assert_array_equal(durations(visits['visit_start'], visits['visit_end']), expected)
+
+
+def test_resessionize_matches_groupby(tables):
+    timeout = pd.Timedelta(minutes=30)
+    visits = tables[2].sort_values(['uid', 'visit_start'], kind='stable')
+    #новая сессия: первый хит пользователя или разрыв больше timeout после самого позднего конца
+    running_end = visits['visit_end'].where(visits['visit_end'] > visits['visit_start'], visits['visit_start'])
+    running_end = running_end.groupby(visits['uid']).cummax()
+    previous_end = running_end.groupby(visits['uid']).shift()
+    expected = (previous_end.isna() | (visits['visit_start'] - previous_end > timeout)).cumsum() - 1
+    sessions = resessionize(tables[2]['uid'], tables[2]['visit_start'], tables[2]['visit_end'], timeout)
+    #номера сессий могут идти в другом порядке, сравниваются разбиения на сессии
+    np.testing.assert_array_equal(pd.factorize(sessions[visits.index.to_numpy()])[0], expected)
@@ -0,0 +1,19 @@
+# coding: utf-8
+"""Точность приближенных DAU/WAU/MAU (HyperLogLog) против точного подсчета."""
+
+import pytest
+
+from afisha_analysis.sketch import accuracy_benchmark, precision_for_error
+
+
+@pytest.mark.parametrize('error', [0.01, 0.05])
+def test_activity_error_within_bound(error):
+    result = accuracy_benchmark(error=error, n_users=50_000, n_days=60, visits_per_day=3_000, seed=1)
+    assert set(result['metric']) == {'dau', 'wau', 'mau'}
+    assert result['rel_error'].max() <= error
+
+
+def test_precision_grows_with_accuracy():
+    assert precision_for_error(0.05) < precision_for_error(0.01)
+    with pytest.raises(ValueError):
+        precision_for_error(0)
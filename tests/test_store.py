@@ -0,0 +1,46 @@
+# coding: utf-8
+"""Запросы SQLite-хранилища против вычислений ноутбука по тем же логам."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from afisha_analysis.periods import HALF_YEAR_END
+from afisha_analysis.store import Store
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory, synthetic_dir):
+    store = Store.build(str(tmp_path_factory.mktemp('store') / 'afisha.sqlite'), data_dir=synthetic_dir)
+    yield store
+    store.close()
+
+
+def _assert_same(frame, expected, keys):
+    assert frame[keys].to_numpy().tolist() == expected[keys].to_numpy().tolist()
+    values = [column for column in expected if column not in keys]
+    np.testing.assert_allclose(frame[values].to_numpy(dtype=float), expected[values].to_numpy(dtype=float))
+
+
+def test_activity_matches_notebook(store, notebook_activity):
+    activity = store.activity()
+    for name, expected in notebook_activity.items():
+        series = getattr(activity, name)
+        assert series.index.tolist() == expected.index.tolist()
+        assert series.tolist() == expected.tolist()
+
+
+def test_retention_matches_notebook(store, notebook_retention):
+    pd.testing.assert_frame_equal(store.retention_pivot(), notebook_retention, check_dtype=False,
+                                  check_index_type=False, check_column_type=False)
+
+
+def test_ltv_report_matches_notebook(store, notebook_report):
+    expected = notebook_report.query('first_order_month < @HALF_YEAR_END & order_month < @HALF_YEAR_END')
+    _assert_same(store.ltv_report(), expected, ['first_order_month', 'new_buyers', 'order_month', 'age'])
+
+
+def test_cac_and_report_fs_match_notebook(store, notebook_cac, notebook_report_fs):
+    cac = store.cac()
+    _assert_same(cac[notebook_cac.columns], notebook_cac, ['source_id', 'first_order_dt', 'n_buyers', 'cost_date'])
+    _assert_same(store.report_fs(), notebook_report_fs, ['source_id', 'n_visits', 'order_month'])
@@ -0,0 +1,46 @@
+# coding: utf-8
+"""Синтетические логи: схема таблиц, доли источников и заказы после посещений."""
+
+import numpy as np
+import pandas as pd
+
+from afisha_analysis.loader import SOURCES, load_all
+from afisha_analysis.synthetic import SOURCE_SHARES, generate
+
+
+def test_schema(synthetic_dir):
+    costs, orders, visits = load_all(synthetic_dir, cache_dir=None)
+    for name, frame in (('costs', costs), ('orders', orders), ('visits', visits)):
+        spec = SOURCES[name]
+        assert set(frame.columns) == {spec['rename'].get(column, column) for column in spec['dtype']}
+        assert len(frame)
+    assert visits['uid'].dtype == np.uint64 and orders['uid'].dtype == np.uint64
+    assert (visits['visit_end'] >= visits['visit_start']).all()
+    assert set(visits['device']) <= {'desktop', 'touch'}
+    assert (orders['revenue'] > 0).all() and (costs['costs'] > 0).all()
+
+
+def test_source_shares(synthetic_dir):
+    visits = load_all(synthetic_dir, cache_dir=None)[2]
+    expected = pd.Series(SOURCE_SHARES) / sum(SOURCE_SHARES.values())
+    shares = visits['source_id'].value_counts(normalize=True).reindex(expected.index, fill_value=0)
+    np.testing.assert_allclose(shares.to_numpy(), expected.to_numpy(), atol=0.03)
+
+
+def test_orders_follow_visits(synthetic_dir):
+    _, orders, visits = load_all(synthetic_dir, cache_dir=None)
+    assert len(orders)
+    first_visit = visits.groupby('uid')['visit_start'].min()
+    first_order = orders.groupby('uid')['order_date'].min()
+    #у каждого покупателя есть посещение не позже первой покупки
+    assert first_order.index.isin(first_visit.index).all()
+    assert (first_order >= first_visit.reindex(first_order.index)).all()
+
+
+def test_same_seed_same_data(tmp_path):
+    first = generate(str(tmp_path / 'a'), n_visits=2_000, n_days=30, seed=3)
+    second = generate(str(tmp_path / 'b'), n_visits=2_000, n_days=30, seed=3)
+    assert first == second
+    for name in ('visits', 'orders', 'costs'):
+        file = SOURCES[name]['file']
+        assert (tmp_path / 'a' / file).read_bytes() == (tmp_path / 'b' / file).read_bytes()
@@ -0,0 +1,40 @@
+# coding: utf-8
+"""Словарь uid: кодирование по отсортированному и по расширенному словарю, агрегаты по пользователям."""
+
+import numpy as np
+import pytest
+
+from afisha_analysis.uids import build_uid_dictionary, decode, encode, extend_uid_dictionary, lookup, per_user
+
+
+def test_extended_dictionary_keeps_codes():
+    visit_uids = build_uid_dictionary(np.array([30, 10, 20, 10], dtype=np.uint64))
+    dictionary = extend_uid_dictionary(visit_uids, np.array([25, 10, 5, 25], dtype=np.uint64))
+    np.testing.assert_array_equal(dictionary, [10, 20, 30, 5, 25])
+    uids = np.array([20, 5, 30, 25, 10], dtype=np.uint64)
+    #посетители кодируются одинаково по обоим словарям
+    np.testing.assert_array_equal(encode(dictionary, uids[[0, 2, 4]]), encode(visit_uids, uids[[0, 2, 4]]))
+    np.testing.assert_array_equal(decode(dictionary, encode(dictionary, uids)), uids)
+
+
+def test_unknown_uids():
+    dictionary = extend_uid_dictionary(build_uid_dictionary([10, 20]), [5])
+    with pytest.raises(ValueError):
+        encode(dictionary, [7])
+    np.testing.assert_array_equal(encode(dictionary, [7, 5, 40], strict=False), [-1, 2, -1])
+
+
+def test_per_user_matches_groupby_and_merge(tables):
+    orders = tables[1]
+    dictionary = build_uid_dictionary(orders['uid'].to_numpy())
+    codes = encode(dictionary, orders['uid'].to_numpy())
+    expected = orders.groupby('uid').agg(first=('order_date', 'min'), revenue=('revenue', 'sum'),
+                                         count=('uid', 'count'))
+    first = per_user(codes, orders['order_date'].to_numpy(), len(dictionary), 'min')
+    assert (decode(dictionary, np.arange(len(dictionary))) == expected.index.to_numpy()).all()
+    np.testing.assert_array_equal(first, expected['first'])
+    np.testing.assert_allclose(per_user(codes, orders['revenue'].to_numpy(), len(dictionary), 'sum'),
+                               expected['revenue'])
+    np.testing.assert_array_equal(per_user(codes, None, len(dictionary), 'count'), expected['count'])
+    merged = orders.merge(expected['first'].rename('first_order_date'), on='uid')
+    np.testing.assert_array_equal(lookup(first, codes), merged['first_order_date'])
@@ -0,0 +1,38 @@
+# coding: utf-8
+"""Сводная таблица пользователей против merge и groupby ноутбука."""
+
+import numpy as np
+import pandas as pd
+
+from afisha_analysis.userindex import buyers_daily, select_buyers, source_revenue, source_sizes
+
+
+def test_buyers_match_notebook(pipeline, notebook_buyers):
+    buyers = select_buyers(pipeline.get('user_index')).set_index('uid').sort_index()
+    expected = notebook_buyers.set_index('uid').sort_index()
+    assert buyers.index.tolist() == expected.index.tolist()
+    for column in ('first_activity_date', 'first_order_date', 'first_order_month', 'days_to_first_order'):
+        np.testing.assert_array_equal(buyers[column], expected[column])
+    np.testing.assert_array_equal(buyers['source'], expected['source_id'])
+
+
+def test_buyers_daily_matches_groupby(pipeline, notebook_buyers):
+    expected = notebook_buyers.groupby(['source_id', 'first_order_dt']).agg({'uid': 'count'}).reset_index()
+    daily = buyers_daily(pipeline.get('user_index'))
+    assert daily.to_numpy().tolist() == expected.to_numpy().tolist()
+
+
+def test_source_tables_match_notebook(pipeline, notebook_visits):
+    user_index = pipeline.get('user_index')
+    orders = pipeline.get('orders_clean')
+    first_source = notebook_visits.sort_values('visit_start', kind='stable').groupby('uid')['source_id'].first()
+    cohort_fs = first_source.reset_index().groupby('source_id').agg({'uid': 'nunique'}).reset_index()
+    assert source_sizes(user_index).to_numpy().tolist() == cohort_fs.to_numpy().tolist()
+
+    visits_first_source = pd.merge(orders, first_source.reset_index(), on='uid')
+    visits_first_source['order_month'] = visits_first_source['order_date'].dt.to_period('M').dt.to_timestamp()
+    expected = visits_first_source.groupby(['source_id', 'order_month'])['revenue'].sum().reset_index()
+    revenue = source_revenue(user_index, orders)
+    keys = ['source_id', 'order_month']
+    assert revenue[keys].to_numpy().tolist() == expected[keys].to_numpy().tolist()
+    np.testing.assert_allclose(revenue['revenue'], expected['revenue'])